@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from typing import Iterable
+import history_store
+import json, os
+import numpy as np
+
+TOTALS_FILENAME = "portfolio.json"
+REPORT_FILENAME = "portfolio_report.json"
+SUMMARY_SHEET = "Summary"
+MOVER_PERIODS = {"day": 1, "week": 7}
+TOP_MOVERS = 10
+
+class Portfolio:
+    """Collection value (price x quantity) per history date, in total and by set and finish. The totals are kept in
+    portfolio.json next to the partitions, so a run only reads the partitions written since the last one"""
+    def __init__(self, store: history_store.HistoryStore) -> None:
+        self.store = store
+        self.filename = os.path.join(store.directory, TOTALS_FILENAME)
+        self.days: dict[str, dict] = {}
+        if (os.path.exists(self.filename)):
+            with open(self.filename, "r", encoding = "utf-8") as file: self.days = json.load(file)
+    
+    def groups(self, field: int) -> tuple[np.ndarray, np.ndarray]:
+        # (group labels, group index of every card id) for one field of the card key
+        labels, index = np.unique(np.array([key[field] for key in self.store.cards], dtype = str), return_inverse = True)
+        return labels, index
+    
+    def update(self, rewritten: Iterable[str] = ()) -> list[str]:
+        """Adds the totals of dates that are new to the store, and of the rewritten ones. Returns the dates computed"""
+        rewritten = set(rewritten)
+        dates = [date for date in self.store.dates() if date not in self.days or date in rewritten]
+        if (len(dates) == 0): return []
+        
+        sets, set_index = self.groups(2)
+        finishes, finish_index = self.groups(3)
+        for date in dates:
+            card_ids, prices, quantities = self.store.read_partition(date)
+            values = np.nan_to_num(prices) * quantities
+            by_set = np.bincount(set_index[card_ids], weights = values, minlength = len(sets))
+            by_finish = np.bincount(finish_index[card_ids], weights = values, minlength = len(finishes))
+            self.days[date] = {
+                "value": round(float(values.sum()), 2),
+                "cards": int(len(card_ids)),
+                "copies": int(quantities.sum()),
+                "by_set": {label: round(value, 2) for label, value in zip(sets.tolist(), by_set.tolist()) if value != 0},
+                "by_finish": {label: round(value, 2) for label, value in zip(finishes.tolist(), by_finish.tolist()) if value != 0}
+            }
+        
+        self.save()
+        return dates
+    
+    def save(self) -> None:
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w", encoding = "utf-8") as file: json.dump(dict(sorted(self.days.items())), file)
+        os.replace(temp_filename, self.filename)
+    
+    def base_date(self, date: str, days: int) -> str | None:
+        # The latest recorded date at least days before date
+        cutoff = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days = days)).strftime("%Y-%m-%d")
+        earlier = [other for other in self.days if other <= cutoff]
+        return max(earlier) if len(earlier) > 0 else None
+    
+    def day_prices(self, date: str) -> tuple[np.ndarray, np.ndarray]:
+        # (price, quantity) by card id, NaN and 0 for cards without a price that day
+        card_ids, prices, quantities = self.store.read_partition(date)
+        day = np.full(len(self.store.cards), np.nan)
+        day_quantities = np.zeros(len(self.store.cards), dtype = np.int32)
+        day[card_ids] = prices
+        day_quantities[card_ids] = quantities
+        return day, day_quantities
+    
+    def movers(self, date: str, base: str, top: int = TOP_MOVERS) -> dict:
+        """Cards whose holding gained and lost the most value between base and date"""
+        prices, quantities = self.day_prices(date)
+        base_prices, _ = self.day_prices(base)
+        change = prices - base_prices
+        value_change = np.where(np.isnan(change), np.nan, change * quantities)
+        ranked = [card_id for card_id in np.argsort(value_change).tolist() if value_change[card_id] == value_change[card_id]]
+        
+        def mover(card_id: int) -> dict:
+            name, collector_number, card_set, foiling = self.store.cards[card_id]
+            return {
+                "name": name, "collector_number": collector_number, "set": card_set, "foiling": foiling, "quantity": int(quantities[card_id]),
+                "price": round(float(prices[card_id]), 2), "previous": round(float(base_prices[card_id]), 2), "change": round(float(change[card_id]), 2),
+                "change_pct": round(float(change[card_id] / base_prices[card_id] * 100), 1) if base_prices[card_id] > 0 else None,
+                "value_change": round(float(value_change[card_id]), 2)
+            }
+        
+        return {
+            "since": base,
+            "gainers": [mover(card_id) for card_id in reversed(ranked[-top:]) if value_change[card_id] > 0],
+            "losers": [mover(card_id) for card_id in ranked[:top] if value_change[card_id] < 0]
+        }
+    
+    def report(self, date: str | None = None) -> dict:
+        """The day's value, its breakdowns, value changes and top movers over MOVER_PERIODS, and the value series"""
+        if (date == None): date = max(self.days)
+        day = self.days[date]
+        report = {"date": date, "value": day["value"], "cards": day["cards"], "copies": day["copies"], "change": {}, "movers": {}}
+        for period, days in MOVER_PERIODS.items():
+            base = self.base_date(date, days)
+            if (base == None): continue
+            change = day["value"] - self.days[base]["value"]
+            report["change"][period] = {"since": base, "value": round(change, 2), "pct": round(change / self.days[base]["value"] * 100, 1) if self.days[base]["value"] > 0 else None}
+            if (base in self.store.dates()): report["movers"][period] = self.movers(date, base)
+        
+        report["by_set"] = dict(sorted(day["by_set"].items(), key = lambda item: -item[1]))
+        report["by_finish"] = dict(sorted(day["by_finish"].items(), key = lambda item: -item[1]))
+        report["history"] = [{"date": other, "value": totals["value"]} for other, totals in sorted(self.days.items())]
+        return report
+
+def write_report(report: dict, filename: str = REPORT_FILENAME) -> None:
+    with open(filename, "w", encoding = "utf-8") as file: json.dump(report, file, indent = 2)
+
+def write_summary_sheet(workbook, report: dict) -> None:
+    """Adds the report as a sheet of small tables to a write only workbook"""
+    from openpyxl.cell import WriteOnlyCell
+    import magic_excel as me
+    sheet = workbook.create_sheet(SUMMARY_SHEET)
+    for column, width in zip("ABCDEFG", [28, 14, 10, 12, 12, 12, 14]): sheet.column_dimensions[column].width = width
+    
+    def cell(value, header: bool = False, price: bool = False) -> WriteOnlyCell:
+        new_cell = WriteOnlyCell(sheet, value = value)
+        if (header):
+            new_cell.fill = me.HEADER_FILL
+            new_cell.border = me.HEADER_BORDER
+            new_cell.font = me.HEADER_FONT
+            new_cell.alignment = me.CENTER_ALIGN
+        if (price): new_cell.number_format = me.PRICE_FORMAT
+        return new_cell
+    
+    sheet.append([cell("Portfolio", True), cell(report["date"], True)])
+    sheet.append(["Value", cell(report["value"], price = True)])
+    sheet.append(["Cards", report["cards"]])
+    sheet.append(["Copies", report["copies"]])
+    for period, change in report["change"].items():
+        sheet.append([f"Change since {change['since']} ({period})", cell(change["value"], price = True), f"{change['pct']}%" if change["pct"] != None else ""])
+    
+    for title, values in (("Set", report["by_set"]), ("Finish", report["by_finish"])):
+        sheet.append([])
+        sheet.append([cell(title, True), cell("Value", True)])
+        for label, value in values.items(): sheet.append([label, cell(value, price = True)])
+    
+    for period, movers in report["movers"].items():
+        for side in ("gainers", "losers"):
+            if (len(movers[side]) == 0): continue
+            sheet.append([])
+            sheet.append([cell(f"Top {side} since {movers['since']} ({period})", True)] + [cell(header, True) for header in ("Set", "Number", "Foiling", "Price", "Change", "Value change")])
+            for mover in movers[side]:
+                sheet.append([mover["name"], mover["set"], mover["collector_number"], mover["foiling"], cell(mover["price"], price = True), cell(mover["change"], price = True), cell(mover["value_change"], price = True)])
+    
+    sheet.append([])
+    sheet.append([cell("Date", True), cell("Value", True)])
+    for entry in report["history"]: sheet.append([entry["date"], cell(entry["value"], price = True)])
@@ -0,0 +1,107 @@
+"""Compares the memory held by priced cards: the old Card dataclass that kept the whole Scryfall response against the slotted Card.
+Run from the repo root: python benchmarks/bench_card_memory.py [--cards 100000] [--output benchmarks/results/bench_card_memory.json]"""
+import argparse, gc, json, os, platform, sys, tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results") # Ignored by git
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import card_api
+
+SETS = [f"S{i:02d}" for i in range(50)]
+
+@dataclass(order=True)
+class LegacyCard:
+    # card_api.Card as it was before it was slotted, with an instance __dict__ and the full response kept
+    sort_index: str = field(init=False, repr=False)
+    name: str
+    collector_number: str
+    set: str
+    foiling: str
+    quantity: int = 1
+    price: float = 0.0
+    call_api: bool = False
+    price_history: dict[str, float] = field(default_factory=dict)
+    
+    def __post_init__(self):
+        object.__setattr__(self, "sort_index", self.name)
+        self.response_json = {}
+
+def make_response(i: int) -> dict:
+    # Roughly the size and shape of a real /cards/{set}/{cn} response, most of which pricing never looks at
+    return {
+        "object": "card",
+        "id": f"{i:08x}-0000-0000-0000-000000000000",
+        "name": f"Card {i}",
+        "set": SETS[i % len(SETS)].lower(),
+        "collector_number": str(i),
+        "oracle_text": "When this creature enters, draw a card. " * 8,
+        "type_line": "Creature — Human Wizard",
+        "image_uris": {size: f"https://cards.scryfall.io/{size}/front/0/0/{i:08x}.jpg?1700000000" for size in ("small", "normal", "large", "png", "art_crop", "border_crop")},
+        "legalities": {fmt: "legal" for fmt in ("standard", "future", "historic", "timeless", "gladiator", "pioneer", "explorer", "modern", "legacy", "pauper", "vintage", "penny", "commander", "oathbreaker", "brawl", "alchemy")},
+        "purchase_uris": {shop: f"https://{shop}.example/product/{i}" for shop in ("tcgplayer", "cardmarket", "cardhoarder")},
+        "related_uris": {site: f"https://{site}.example/card/{i}" for site in ("gatherer", "tcgplayer_infinite_articles", "edhrec")},
+        "prices": {"usd": f"{i % 1000 / 10:.2f}", "usd_foil": f"{i % 700 / 10:.2f}", "usd_etched": None, "eur": f"{i % 900 / 10:.2f}", "eur_foil": None, "tix": "0.02"}
+    }
+
+def make_row(i: int) -> tuple:
+    # Strings built per row like a database driver returns them, so nothing is shared by accident
+    return (f"Card {i}", str(i), "".join(SETS[i % len(SETS)]), "".join(card_api.foil_options[i % 3]), 1 + i % 4)
+
+def measure(build) -> tuple[int, list]:
+    gc.collect()
+    tracemalloc.start()
+    cards = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, cards
+
+def build_legacy(count: int) -> list[LegacyCard]:
+    cards = []
+    for i in range(count):
+        card = LegacyCard(*make_row(i))
+        card.response_json = json.loads(json.dumps(make_response(i))) # A fresh parse per card, as requests gives us
+        card.price = card_api.price_for_foiling(card.response_json["prices"], card.foiling)
+        cards.append(card)
+    return cards
+
+def build_compact(count: int) -> list[card_api.Card]:
+    cards = []
+    for i in range(count):
+        name, cn, card_set, foiling, quantity = make_row(i)
+        card = card_api.Card(name, cn, card_set, foiling, quantity = quantity)
+        card.set_response(json.loads(json.dumps(make_response(i))))
+        card.set_price_from_api()
+        cards.append(card)
+    return cards
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", type = int, default = 100_000)
+    parser.add_argument("--output", default = os.path.join(RESULTS_DIR, "bench_card_memory.json"))
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    
+    results = {}
+    for label, build in (("legacy", build_legacy), ("slotted", build_compact)):
+        size, cards = measure(lambda: build(args.cards))
+        results[label] = {"bytes": size, "bytes_per_card": round(size / len(cards), 1)}
+        print(f"{label:>8}: {size / 1024 / 1024:8.1f} MB for {len(cards)} cards, {size / len(cards):7.0f} bytes per card")
+        del cards
+    
+    report = {
+        "benchmark": "card_memory",
+        "timestamp": datetime.now().isoformat(timespec = "seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"cards": args.cards},
+        "results": results
+    }
+    with open(output, "w", encoding = "utf-8") as file: json.dump(report, file, indent = 2)
+    print(f"Wrote {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Cold-start time of every way the pricer is started: a fresh interpreter per run, timed from launch to exit, against the local Scryfall stub.
+Each mode also reports which heavy packages (numpy, openpyxl, requests...) it imported and what they cost, from python -X importtime.
+Run from the repo root: python benchmarks/bench_cold_start.py [--cards 300] [--repeats 5] [--output benchmarks/results/bench_cold_start.json]"""
+import argparse, json, os, platform, shutil, statistics, subprocess, sys, tempfile
+from datetime import datetime
+from time import perf_counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results") # Ignored by git
+REPO_DIR = os.path.abspath(os.path.join(BENCH_DIR, ".."))
+sys.path[:0] = [REPO_DIR, BENCH_DIR]
+import scryfall_stub
+from bench_end_to_end import write_collection
+
+HEAVY_MODULES = ["numpy", "pandas", "openpyxl", "requests", "pyodbc", "dearpygui", "pyarrow"]
+COLLECTION = ["--database", "collection.csv", "--summary_file", ""]
+# Command lines of main.py. The cache and history are warmed by one default run before any of them is timed
+MAIN_MODES = {
+    "help": ["--help"],
+    "validate_only": COLLECTION + ["--validate_only"],
+    "cache_only": COLLECTION + ["--dont_export", "--history_dir", ""],
+    "history_only": COLLECTION + ["--dont_export"],
+    "csv": COLLECTION + ["--export_format", "csv"],
+    "xlsx": COLLECTION
+}
+IMPORT_MODES = {"python": "", "import_main": "import main", "import_gui": "import gui"}
+
+def mode_code(mode: str, url: str) -> str:
+    # The code a fresh interpreter runs for the mode, with the API pointed at the stub
+    if (mode in IMPORT_MODES): return f"import sys; sys.path.insert(0, {REPO_DIR!r}); {IMPORT_MODES[mode]}"
+    return f"import sys; sys.path.insert(0, {REPO_DIR!r}); import card_api; card_api.API_URL = {url!r}; import main; main.main({MAIN_MODES[mode]!r})"
+
+def heavy_imports(stderr: str) -> dict[str, float]:
+    """Cumulative import time in ms of the heavy packages, from -X importtime output ("import time: self | cumulative | name")"""
+    imports = {}
+    for line in stderr.splitlines():
+        if (not line.startswith("import time:")): continue
+        fields = line[len("import time:"):].split("|")
+        if (len(fields) == 3 and fields[2].strip() in HEAVY_MODULES and fields[1].strip().isdigit()): imports[fields[2].strip()] = round(int(fields[1]) / 1000, 1)
+    return imports
+
+def time_mode(mode: str, url: str, repeats: int) -> dict:
+    code = mode_code(mode, url)
+    seconds = []
+    for _ in range(repeats):
+        start = perf_counter()
+        process = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True)
+        seconds.append(perf_counter() - start)
+        if (process.returncode != 0): return {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}"}
+    
+    profile = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output = True, text = True)
+    return {
+        "median_s": round(statistics.median(seconds), 4),
+        "min_s": round(min(seconds), 4),
+        "max_s": round(max(seconds), 4),
+        "heavy_imports_ms": heavy_imports(profile.stderr)
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs = "+", choices = list(IMPORT_MODES) + list(MAIN_MODES), default = list(IMPORT_MODES) + list(MAIN_MODES))
+    parser.add_argument("--cards", type = int, default = 300, help = "Collection size. Small, so the time is mostly startup")
+    parser.add_argument("--repeats", type = int, default = 5)
+    parser.add_argument("--output", default = os.path.join(RESULTS_DIR, "bench_cold_start.json"))
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    
+    scratch = tempfile.mkdtemp(prefix = "bench_cold_start_")
+    cwd = os.getcwd()
+    stub = scryfall_stub.StubServer(cards = args.cards // 3 + 1)
+    try:
+        os.chdir(scratch)
+        write_collection("collection.csv", args.cards)
+        results = {}
+        with stub:
+            subprocess.run([sys.executable, "-c", mode_code("xlsx", stub.url)], capture_output = True, check = True)
+            for mode in args.modes:
+                result = time_mode(mode, stub.url, args.repeats)
+                results[mode] = result
+                if ("error" in result): print(f"{mode:>14}: failed, {result['error']}")
+                else: print(f"{mode:>14}: {result['median_s']:7.3f} s median  " + "  ".join(f"{name} {ms:.0f}ms" for name, ms in result["heavy_imports_ms"].items()))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors = True)
+    
+    report = {
+        "benchmark": "cold_start",
+        "timestamp": datetime.now().isoformat(timespec = "seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"cards": args.cards, "repeats": args.repeats},
+        "results": results
+    }
+    with open(output, "w", encoding = "utf-8") as file: json.dump(report, file, indent = 2)
+    print(f"Wrote {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Workbook export and history load time as a collection ages, with and without compaction, on a synthetic history store.
+Run from the repo root: python benchmarks/bench_compaction.py [--cards 1000] [--ages 180 365 730 1095]"""
+import argparse, os, sys, tempfile
+from datetime import date, timedelta
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import compaction, history_store
+
+def make_store(directory: str, cards: int, days: int, today: date) -> history_store.HistoryStore:
+    store = history_store.HistoryStore(directory)
+    for i in range(cards): store.get_card_id((f"Card {i}", str(i), f"S{i % 50:02d}", "nonfoil"))
+    card_ids = np.arange(cards, dtype = np.int32)
+    for day in range(days, -1, -1):
+        prices = (card_ids % 1000) / 10 + (day % 7) / 100
+        store.write_partition((today - timedelta(days = day)).strftime("%Y-%m-%d"), card_ids, prices, 1 + card_ids % 4)
+    return store
+
+def time_store(store: history_store.HistoryStore, filename: str) -> dict[str, float]:
+    timings = {"columns": len(store.dates())}
+    start = perf_counter()
+    store.load_matrix()
+    timings["load"] = perf_counter() - start
+    start = perf_counter()
+    store.export_workbook(filename, "Sheet", lambda workbook: compaction.write_rollup_sheet(workbook, store))
+    timings["export"] = perf_counter() - start
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark history load and workbook export by collection age, with and without compaction")
+    parser.add_argument("--cards", type = int, default = 1000)
+    parser.add_argument("--ages", type = int, nargs = "+", default = [180, 365, 730, 1095], help = "Days of history")
+    parser.add_argument("--daily_days", type = int, default = compaction.DAILY_DAYS)
+    bench_args = parser.parse_args()
+    
+    today = date.today()
+    with tempfile.TemporaryDirectory() as directory:
+        for age in bench_args.ages:
+            store = make_store(os.path.join(directory, f"history-{age}"), bench_args.cards, age, today)
+            raw = time_store(store, os.path.join(directory, f"raw-{age}.xlsx"))
+            
+            start = perf_counter()
+            periods = compaction.compact(store, today.strftime("%Y-%m-%d"), bench_args.daily_days)
+            compact_seconds = perf_counter() - start
+            compacted = time_store(store, os.path.join(directory, f"compacted-{age}.xlsx"))
+            
+            print(f"{age:>5} days       raw: {raw['columns']:>5} columns, load {raw['load']:.2f}s, export {raw['export']:.2f}s")
+            print(f"{age:>5} days compacted: {compacted['columns']:>5} columns, load {compacted['load']:.2f}s, export {compacted['export']:.2f}s ({len(periods)} periods rolled in {compact_seconds:.2f}s)")
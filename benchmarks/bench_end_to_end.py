@@ -0,0 +1,127 @@
+"""End-to-end throughput of the main flow (reader -> pricing -> cache -> history/Excel export) against the local Scryfall stub.
+Every size runs in its own process so peak memory is per size. Results are printed and written as JSON for comparing runs.
+Run from the repo root: python benchmarks/bench_end_to_end.py [--sizes 1000 10000 100000] [--latency_ms 50] [--output benchmarks/results/bench_end_to_end.json]"""
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results") # Ignored by git
+REPO_DIR = os.path.join(BENCH_DIR, "..")
+sys.path[:0] = [REPO_DIR, BENCH_DIR]
+import scryfall_stub
+
+try: import resource
+except ImportError: resource = None # Windows, peak memory comes from tracemalloc instead
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS. tracemalloc only sees Python allocations, so Windows numbers run lower
+    if (resource == None): return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def write_collection(filename: str, size: int) -> None:
+    # Three finishes per printing, like a collection with foils and etched copies
+    finishes = ["nonfoil", "foil", "etched"]
+    with open(filename, "w", encoding = "utf-8") as file:
+        file.write("Name,Number,Set,Foiling,Quantity\n")
+        for i in range(size):
+            file.write(f"{scryfall_stub.fixture_name(i // 3)},{i // 3},{scryfall_stub.STUB_SET.upper()},{finishes[i % 3]},{1 + i % 4}\n")
+
+def run_worker(size: int, url: str, rate: float, workers: int) -> dict:
+    """Runs in the child process, inside a scratch directory. Uses main's stages with the options the command line would give"""
+    write_collection("collection.csv", size)
+    if (resource == None): tracemalloc.start()
+    import card_api, main
+    config = main.default_config(database = "collection.csv", excel_filename = "magic.xlsx", workers = workers)
+    
+    card_api.API_URL = url
+    card_api.fetcher = card_api.Fetcher(rate = rate, max_workers = workers)
+    result: dict = {"cards": size, "passes": {}}
+    
+    def timed_pass(name: str) -> None:
+        stages: dict[str, dict[str, float]] = {}
+        def stage(stage_name: str, start: float) -> None:
+            stages[stage_name] = {"seconds": round(perf_counter() - start, 4), "peak_rss_mb": round(peak_rss_mb(), 1)}
+        
+        start = perf_counter()
+        cards = main.get_cards(config, "collection.csv")
+        stage("read", start)
+        
+        start = perf_counter()
+        main.get_card_prices_from_api(config, cards)
+        stage("price", start)
+        
+        start = perf_counter()
+        main.write_prices(config, [cards], "magic.xlsx", "collection")
+        stage("export", start)
+        
+        total = sum(timing["seconds"] for timing in stages.values())
+        result["passes"][name] = {"stages": stages, "seconds": round(total, 4), "cards_per_second": round(size / total, 1)}
+    
+    timed_pass("cold") # Empty cache, every printing is fetched
+    timed_pass("warm") # Same day again, every price is a cache hit
+    
+    # The default command line path, streaming every stage at once, from an empty cache and history again
+    for filename in ("prices.db", "prices.db-wal", "prices.db-shm", "magic.xlsx"):
+        if (os.path.exists(filename)): os.remove(filename)
+    shutil.rmtree("history", ignore_errors = True)
+    start = perf_counter()
+    main.stream_card_prices(config, main.iter_cards(config, "collection.csv"), lambda batches: main.write_prices(config, batches, "magic.xlsx", "collection"))
+    seconds = perf_counter() - start
+    result["passes"]["stream_cold"] = {"seconds": round(seconds, 4), "cards_per_second": round(size / seconds, 1), "peak_rss_mb": round(peak_rss_mb(), 1)}
+    
+    return result
+
+def run_size(size: int, args: argparse.Namespace, url: str) -> dict:
+    scratch = tempfile.mkdtemp(prefix = f"bench_e2e_{size}_")
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", str(size), "--url", url, "--rate", str(args.rate), "--workers", str(args.workers)]
+        process = subprocess.run(command, cwd = scratch, capture_output = True, text = True)
+        if (process.returncode != 0): raise RuntimeError(f"{size} card run failed:\n{process.stderr}")
+        return json.loads(process.stdout.strip().splitlines()[-1])
+    finally: shutil.rmtree(scratch, ignore_errors = True)
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [1_000, 10_000, 100_000])
+    parser.add_argument("--latency_ms", type = float, default = 0.0, help = "Stub latency per request")
+    parser.add_argument("--rate_429", type = float, default = 0.0)
+    parser.add_argument("--error_rate", type = float, default = 0.0)
+    parser.add_argument("--rate", type = float, default = 10.0, help = "Client requests per second. Default = 10, Scryfall's limit")
+    parser.add_argument("--workers", type = int, default = 8)
+    parser.add_argument("--output", default = os.path.join(RESULTS_DIR, "bench_end_to_end.json"))
+    parser.add_argument("--worker", type = int, default = 0, help = argparse.SUPPRESS)
+    parser.add_argument("--url", default = "", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if (args.worker > 0):
+        print(json.dumps(run_worker(args.worker, args.url, args.rate, args.workers)))
+        return
+    
+    # The stub runs in this process, so its threads do not compete with the pricer for the GIL
+    stub = scryfall_stub.StubServer(cards = max(args.sizes) // 3 + 1, latency_ms = args.latency_ms, rate_429 = args.rate_429, error_rate = args.error_rate)
+    with stub:
+        results = []
+        for size in args.sizes:
+            result = run_size(size, args, stub.url)
+            results.append(result)
+            for name, run in result["passes"].items():
+                print(f"{size:>8} cards {name:>11}: {run['seconds']:8.2f} s {run['cards_per_second']:>10.1f} cards/s" +
+                    "".join(f"  {stage} {timing['seconds']:.2f}s/{timing['peak_rss_mb']:.0f}MB" for stage, timing in run.get("stages", {}).items()))
+    
+    report = {
+        "benchmark": "end_to_end",
+        "timestamp": datetime.now().isoformat(timespec = "seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"latency_ms": args.latency_ms, "rate_429": args.rate_429, "error_rate": args.error_rate, "rate": args.rate, "workers": args.workers},
+        "stub": stub.counts,
+        "results": results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok = True)
+    with open(args.output, "w", encoding = "utf-8") as file: json.dump(report, file, indent = 2)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
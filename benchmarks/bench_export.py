@@ -0,0 +1,54 @@
+"""Compares the incremental Excel export against the full restyle on a synthetic price workbook.
+Run from the repo root: python benchmarks/bench_export.py [--rows 10000] [--dates 365]"""
+import argparse, os, shutil, sys, tempfile
+from datetime import date, timedelta
+from time import perf_counter
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import card_api, magic_excel as me
+
+def make_cards(rows: int) -> list[card_api.Card]:
+    return [card_api.Card(f"Card {i}", str(i), f"S{i % 50:02d}", card_api.foil_options[i % 3], quantity = 1 + i % 4, price = (i % 1000) / 10) for i in range(rows)]
+
+def make_workbook(filename: str, cards: list[card_api.Card], dates: int) -> None:
+    # write_only keeps building the synthetic history cheap
+    workbook = Workbook(write_only = True)
+    sheet = workbook.create_sheet("Sheet")
+    start = date(2000, 1, 1)
+    sheet.append(me.HEADERS + [(start + timedelta(days = day)).strftime("%Y-%m-%d") for day in range(dates)])
+    for card in cards:
+        sheet.append([card.name, card.collector_number, card.set, card.foiling, card.quantity] + [card.price] * dates)
+    workbook.save(filename)
+
+def time_export(filename: str, cards: list[card_api.Card], incremental: bool) -> dict[str, float]:
+    timings = {}
+    start = perf_counter()
+    with me.ExcelManager(filename, "w") as file:
+        timings["load"] = perf_counter() - start
+        start = perf_counter()
+        me.write_price_column(file.active, cards, "2099-01-01", incremental = incremental)
+        timings["write"] = perf_counter() - start
+        start = perf_counter()
+    timings["save"] = perf_counter() - start
+    timings["total"] = sum(timings.values())
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark incremental vs full Excel export")
+    parser.add_argument("--rows", type = int, default = 10000)
+    parser.add_argument("--dates", type = int, default = 365)
+    parser.add_argument("--new_cards", type = int, default = 100, help = "Cards that are not in the workbook yet")
+    bench_args = parser.parse_args()
+    
+    cards = make_cards(bench_args.rows + bench_args.new_cards)
+    with tempfile.TemporaryDirectory() as directory:
+        base = os.path.join(directory, "base.xlsx")
+        print(f"Building {bench_args.rows} rows x {bench_args.dates} date columns")
+        make_workbook(base, cards[:bench_args.rows], bench_args.dates)
+        
+        for mode, incremental in [("full", False), ("incremental", True)]:
+            filename = os.path.join(directory, f"{mode}.xlsx")
+            shutil.copy(base, filename)
+            timings = time_export(filename, cards, incremental)
+            print(f"{mode:>12}: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
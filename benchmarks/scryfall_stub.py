@@ -0,0 +1,150 @@
+"""A local stand-in for the parts of the Scryfall API the pricer uses: GET /cards/{set}/{cn} and POST /cards/collection.
+Cards come from generated fixtures, and latency, 429s and server errors can be injected.
+Run from the repo root: python benchmarks/scryfall_stub.py [--port 8765] [--cards 100000] [--latency_ms 50] [--rate_429 0.01] [--error_rate 0.01]
+then point card_api.API_URL at the printed URL"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse, json, random, threading, time
+
+STUB_SET = "bnch"
+DEFAULT_CARDS = 100_000
+
+def fixture_name(collector_number: int) -> str: return f"Bench Card {collector_number}"
+
+def fixture(card_set: str, collector_number: str, cards: int) -> dict | None:
+    """The card object for a printing, or None if it is not in the fixtures. Prices are derived from the number so runs are repeatable"""
+    if (card_set.lower() != STUB_SET or not collector_number.isdigit() or int(collector_number) >= cards): return None
+    number = int(collector_number)
+    return {
+        "object": "card",
+        "name": fixture_name(number),
+        "set": STUB_SET,
+        "collector_number": collector_number,
+        "prices": {
+            "usd": f"{(number * 7919) % 5000 / 100:.2f}",
+            "usd_foil": f"{(number * 104729) % 9000 / 100:.2f}" if number % 3 != 0 else None,
+            "usd_etched": f"{(number * 1299709) % 12000 / 100:.2f}" if number % 10 == 0 else None,
+            "eur": f"{(number * 7907) % 4500 / 100:.2f}",
+            "eur_foil": None,
+            "tix": f"{number % 300 / 100:.2f}"
+        }
+    }
+
+class StubServer:
+    """Serves the fixtures on a background thread. Counts requests, 429s and errors so benchmarks can report them"""
+    def __init__(self, cards: int = DEFAULT_CARDS, latency_ms: float = 0.0, rate_429: float = 0.0, error_rate: float = 0.0, retry_after: float = 0.1, port: int = 0, seed: int = 0) -> None:
+        self.cards = cards
+        self.latency = latency_ms / 1000
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "429": 0, "errors": 0, "not_found": 0}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        self.thread: threading.Thread | None = None
+    
+    @property
+    def url(self) -> str: return f"http://127.0.0.1:{self.server.server_address[1]}"
+    
+    def count(self, key: str, amount: int = 1) -> None:
+        with self.lock: self.counts[key] += amount
+    
+    def roll(self) -> tuple[bool, bool]:
+        # (send a 429, send a 500) for one request
+        with self.lock:
+            roll = self.random.random()
+        return roll < self.rate_429, self.rate_429 <= roll < self.rate_429 + self.error_rate
+    
+    def handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real API behind the pooled session
+            
+            def log_message(self, format, *args) -> None: pass
+            
+            def send(self, code: int, body: dict, headers: dict | None = None) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items(): self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def injected_failure(self) -> bool:
+                stub.count("requests")
+                if (stub.latency > 0): time.sleep(stub.latency)
+                too_many, error = stub.roll()
+                if (too_many):
+                    stub.count("429")
+                    self.send(429, {"object": "error", "code": "rate_limited", "status": 429}, {"Retry-After": str(stub.retry_after)})
+                    return True
+                if (error):
+                    stub.count("errors")
+                    self.send(500, {"object": "error", "code": "internal_server_error", "status": 500})
+                    return True
+                return False
+            
+            def do_GET(self) -> None:
+                if (self.injected_failure()): return
+                parts = self.path.split("?")[0].strip("/").split("/")
+                card_json = fixture(parts[1], parts[2], stub.cards) if len(parts) == 3 and parts[0] == "cards" else None
+                if (card_json == None):
+                    stub.count("not_found")
+                    self.send(404, {"object": "error", "code": "not_found", "status": 404})
+                else: self.send(200, card_json)
+            
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if (self.injected_failure()): return
+                if (self.path.split("?")[0] != "/cards/collection"):
+                    self.send(404, {"object": "error", "code": "not_found", "status": 404})
+                    return
+                
+                identifiers = body.get("identifiers", [])
+                if (len(identifiers) > 75):
+                    self.send(422, {"object": "error", "code": "too_many_identifiers", "status": 422})
+                    return
+                
+                data, not_found = [], []
+                for identifier in identifiers:
+                    card_json = fixture(identifier.get("set", ""), str(identifier.get("collector_number", "")), stub.cards)
+                    if (card_json == None): not_found.append(identifier)
+                    else: data.append(card_json)
+                stub.count("not_found", len(not_found))
+                self.send(200, {"object": "list", "not_found": not_found, "data": data})
+        
+        return Handler
+    
+    def start(self) -> str:
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "scryfall-stub", daemon = True)
+        self.thread.start()
+        return self.url
+    
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def __enter__(self) -> "StubServer":
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None: self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local Scryfall stand-in for benchmarks")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--cards", type = int, default = DEFAULT_CARDS, help = f"Fixture printings, {STUB_SET.upper()} 0 to cards - 1")
+    parser.add_argument("--latency_ms", type = float, default = 0.0, help = "Delay added to every request")
+    parser.add_argument("--rate_429", type = float, default = 0.0, help = "Fraction of requests answered with 429 and Retry-After")
+    parser.add_argument("--error_rate", type = float, default = 0.0, help = "Fraction of requests answered with 500")
+    parser.add_argument("--retry_after", type = float, default = 0.1, help = "Retry-After seconds sent with a 429")
+    args = parser.parse_args()
+    
+    stub = StubServer(args.cards, args.latency_ms, args.rate_429, args.error_rate, args.retry_after, args.port)
+    print(f"Serving {args.cards} {STUB_SET.upper()} printings on {stub.url}")
+    try: stub.server.serve_forever()
+    except KeyboardInterrupt: print(stub.counts)
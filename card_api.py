@@ -1,13 +1,20 @@
 from dataclasses import dataclass, field
 from hashlib import sha256
-from time import sleep
+from sys import intern
+from fetcher import Fetcher
 from logger import Color
-import requests
+import scryfall_bulk
 
 API_CALL_TIMEOUT_MS = 100 # Must be between 50-100 ms 
 API_URL = "https://api.scryfall.com"
+COLLECTION_BATCH_SIZE = 75 # Max identifiers Scryfall accepts per /cards/collection request
+MAX_WORKERS = 8 # Requests in flight at once, the token bucket still holds the total rate to 1 per API_CALL_TIMEOUT_MS
 
-CURRENCY = "usd"
+fetcher = Fetcher(rate = 1000 / API_CALL_TIMEOUT_MS, max_workers = MAX_WORKERS)
+bulk_index: scryfall_bulk.BulkIndex | None = None # When set, cards are resolved against it instead of the API
+
+CURRENCY = "usd" # Card.price is in this currency
+CURRENCIES = ["usd", "eur", "tix"] # Every response prices all of them, Card.currency_prices holds them in this order
 
 foiling_to_price = {
     "nonfoil": f"{CURRENCY}",
@@ -21,8 +28,21 @@ currency_symbols = {
     "tix": "tix "
 }
 
-@dataclass(order=True)
+class CardPrices:
+    """The prices of one printing in a Scryfall response, as floats (None when Scryfall has no price). Has dict's get, so it works with price_for_foiling"""
+    __slots__ = scryfall_bulk.PRICE_KEYS
+    
+    def __init__(self, prices: dict) -> None:
+        for price_key in scryfall_bulk.PRICE_KEYS: setattr(self, price_key, scryfall_bulk.parse_price(prices.get(price_key)))
+    
+    def get(self, key: str, default = None) -> float | None: return getattr(self, key, default)
+    
+    def __repr__(self) -> str: return f"CardPrices({', '.join(f'{key}={self.get(key)}' for key in self.__slots__)})"
+
+@dataclass(order=True, slots=True)
 class Card:
+    """One collection row. Slotted, with set and finish strings interned, so 100k+ cards stay small.
+    Only the canonical name and prices are kept from the Scryfall response, the rest of it is released once the card is priced"""
     sort_index: str = field(init=False, repr=False)
     name: str
     collector_number: str 
@@ -31,52 +51,137 @@ class Card:
     quantity: int = 1
     price: float = 0.0
     call_api: bool = False
-    price_history: dict[str, float] = field(default_factory=dict)
-
+    price_history: dict[str, float] | None = field(default=None, compare=False, repr=False) # Only used by the GUI
+    api_name: str | None = field(default=None, init=False, compare=False, repr=False) # The name Scryfall has for this printing
+    prices: CardPrices | None = field(default=None, init=False, compare=False, repr=False)
+    stale: bool = field(default=False, init=False, compare=False, repr=False) # Price carried forward from an expired cache entry
+    currency_prices: tuple[float | None, ...] | None = field(default=None, init=False, compare=False, repr=False) # This finish's price in each of CURRENCIES
+    
     def __post_init__(self):
         object.__setattr__(self, "sort_index", self.name)
         if (self.foiling not in foil_options): self.foiling = "nonfoil"
-        if (self.call_api):
-            self.response_json = get_api_response(self)
-            self.set_price_from_api()
-        else: self.response_json = {}
+        self.set = intern(self.set)
+        self.foiling = intern(self.foiling)
+        if (self.call_api): self.set_price_from_api()
     
     def __str__(self) -> str:  return f"x{self.quantity} {Color.BLUE}{self.name}{Color.RESET} [#{self.collector_number} {self.set}, {self.foiling}] = {Color.GREEN}{currency_symbols[CURRENCY]}{self.price:.2f}{Color.RESET}"
     
-    def generate_hash(self) -> str: return sha256(f"{self.name}{self.collector_number}{self.set}{self.foiling}".encode()).hexdigest()
+    def generate_hash(self) -> str: return card_hash(self.name, self.collector_number, self.set, self.foiling)
+    
+    def set_response(self, response_json: dict) -> None:
+        # Keep only what pricing and validation need, the response itself can then be freed
+        self.api_name = response_json["name"]
+        self.prices = CardPrices(response_json["prices"])
     
     def set_price_from_api(self) -> None:
         # {'usd': '0.45', 'usd_foil': '1.47', 'usd_etched': None, 'eur': '0.75', 'eur_foil': '1.67', 'tix': '2.50'}
-        if (self.response_json == {}): self.response_json = get_api_response(self)
+        if (self.prices == None): self.set_response(get_api_response(self))
         
-        prices = self.response_json["prices"]
-        price = prices[foiling_to_price[self.foiling]]
-        
-        # Bad price handling
-        if (price == None and self.foiling != "nonfoiil"): price = prices["usd"] # Use nonfoil price, if it exists
-        if (price == None): self.price = 0.0 # No price, set to 0
-        else: self.price = float(price)
-       
+        self.price = price_for_foiling(self.prices, self.foiling)
+    
+    def capture_currencies(self) -> None:
+        # Only from a response, cache hits get theirs from the cache row
+        if (self.prices != None): self.currency_prices = tuple(price_for_foiling(self.prices, self.foiling, currency) for currency in CURRENCIES)
+    
+    def price_in(self, currency: str) -> float | None:
+        if (currency == CURRENCY): return self.price
+        if (self.currency_prices == None): return None
+        return self.currency_prices[CURRENCIES.index(currency)]
+
+def card_hash(name: str, collector_number: str, card_set: str, foiling: str) -> str:
+    return sha256(f"{name}{collector_number}{card_set}{foiling}".encode()).hexdigest()
+
+def price_key(foiling: str, currency: str = CURRENCY) -> str:
+    # Scryfall's key for a finish in a currency. Keys it does not have (eur_etched, tix_foil) fall back to nonfoil in price_for_foiling
+    if (currency == CURRENCY): return foiling_to_price[foiling]
+    return currency if foiling == "nonfoil" else f"{currency}_{foiling}"
+
+def price_for_foiling(prices: dict | CardPrices, foiling: str, currency: str = CURRENCY) -> float:
+    price = prices.get(price_key(foiling, currency))
+    
+    # Bad price handling
+    if (price == None and foiling != "nonfoil"): price = prices.get(price_key("nonfoil", currency)) # Use nonfoil price, if it exists
+    if (price == None): return 0.0 # No price, set to 0
+    return float(price)
+
 class BadCardCallError(Exception):
-    def __init__(self, code: int, card: Card) -> None:
+    def __init__(self, code: int, card: Card, url: str | None = None) -> None:
         self.code = code
         self.card = card
+        self.url = url # The request that failed, when it was not the card's own /cards/{set}/{cn}
         super().__init__(code)
-        
+    
     def __str__(self) -> str:
-        return f"Got status code {self.code} for {self.card.name} [{self.card.collector_number}, {self.card.set}, {self.card.foiling}]\nURL = {API_URL}/cards/{self.card.set}/{self.card.collector_number}"
+        return f"Got status code {self.code} for {self.card.name} [{self.card.collector_number}, {self.card.set}, {self.card.foiling}]\nURL = {self.url or f'{API_URL}/cards/{self.card.set}/{self.card.collector_number}'}"
+
+def printing_key(card_set: str, collector_number: str) -> tuple[str, str]:
+    return (str(card_set).lower(), str(collector_number))
+
+def get_bulk_response(card) -> dict:
+    key = printing_key(card.set, card.collector_number)
+    if (bulk_index == None or key not in bulk_index): raise BadCardCallError(404, card)
+    return scryfall_bulk.to_response_json(key, bulk_index[key])
 
 def get_api_response(card) -> dict:
+    if (bulk_index != None): return get_bulk_response(card)
     card_url = f"{API_URL}/cards/{card.set}/{card.collector_number}"
-    response = requests.get(card_url)
-    sleep(API_CALL_TIMEOUT_MS / 1000)
+    response = fetcher.get(card_url)
     
-    if (response.status_code != 200):
-        print(card_url)
-        raise BadCardCallError(response.status_code, card)
+    if (response.status_code != 200): raise BadCardCallError(response.status_code, card) # The error's message carries the URL
     
     return response.json()
 
+def group_by_printing(cards: list[Card]) -> dict[tuple[str, str], list[Card]]:
+    # Every finish and duplicate row of a printing shares one Scryfall response
+    groups: dict[tuple[str, str], list[Card]] = {}
+    for card in cards: groups.setdefault(printing_key(card.set, card.collector_number), []).append(card)
+    return groups
+
+def get_collection_response(cards: list[Card]) -> tuple[dict[tuple[str, str], dict], list[BadCardCallError]]:
+    """Resolves cards through /cards/collection, COLLECTION_BATCH_SIZE printings at a time. Each printing is only requested once.
+    Returns the found card objects keyed by printing_key, and an error for every card Scryfall could not find"""
+    responses: dict[tuple[str, str], dict] = {}
+    not_found: list[BadCardCallError] = []
+    groups = group_by_printing(cards)
+    
+    if (bulk_index != None):
+        for key in groups:
+            if (key in bulk_index): responses[key] = scryfall_bulk.to_response_json(key, bulk_index[key])
+    
+    else:
+        keys = list(groups)
+        batches = [keys[start:start + COLLECTION_BATCH_SIZE] for start in range(0, len(keys), COLLECTION_BATCH_SIZE)]
+        
+        def fetch_batch(batch: list[tuple[str, str]]) -> dict:
+            identifiers = [{"set": card_set, "collector_number": collector_number} for card_set, collector_number in batch]
+            response = fetcher.post(f"{API_URL}/cards/collection", json = {"identifiers": identifiers})
+            
+            if (response.status_code != 200): raise BadCardCallError(response.status_code, groups[batch[0]][0], f"{API_URL}/cards/collection")
+            return response.json()
+        
+        for body in fetcher.map(fetch_batch, batches):
+            for card_json in body["data"]:
+                responses[printing_key(card_json["set"], card_json["collector_number"])] = card_json
+    
+    # Anything Scryfall listed in not_found (or silently dropped) is reported like a 404 from /cards/{set}/{cn}
+    for key, group in groups.items():
+        if (key not in responses): not_found.extend(BadCardCallError(404, card) for card in group)
+    
+    return responses, not_found
+
+def set_prices_from_collection(cards: list[Card]) -> list[BadCardCallError]:
+    """Prices every card with as few requests as possible, fanning each printing's prices out to all of its cards.
+    Cards that were not found keep their current price"""
+    responses, not_found = get_collection_response(cards)
+    
+    for card in cards:
+        key = printing_key(card.set, card.collector_number)
+        if (key not in responses): continue
+        card.set_response(responses[key])
+        card.set_price_from_api()
+    
+    return not_found
+
 
 if __name__ == "__main__":
     print("Welcome to card_api.py")
@@ -0,0 +1,151 @@
+from abc import ABC, abstractmethod
+from typing import Iterator
+import card_api
+import csv, os, sqlite3
+
+SOURCE_TYPES = ["access", "csv", "xlsx", "sqlite"]
+SOURCE_EXTENSIONS = {
+    ".accdb": "access",
+    ".mdb": "access",
+    ".csv": "csv",
+    ".xlsx": "xlsx",
+    ".db": "sqlite",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite"
+}
+COLUMNS = ["name", "number", "set", "foiling", "quantity"] # Same order as the Cards table and the Excel export
+DEFAULT_SQL = "SELECT * FROM Cards"
+FETCH_SIZE = 750
+ACCESS_ENCODING = "latin-1"
+ACCESS_DRIVER = r'Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ='
+
+# Sets that are written differently in collections than on Scryfall
+SET_FIXUPS = {"PLIST": "PLST"}
+
+def normalize_row(row: tuple, autocall_api: bool = False) -> card_api.Card:
+    """Turns a (name, number, set, foiling, quantity) row from any source into a Card"""
+    card_name, card_cn, card_set, card_foil, card_quantity = (tuple(row) + (None,) * 5)[:5]
+    
+    # Spreadsheets give whole collector numbers back as numbers
+    if (isinstance(card_cn, float) and card_cn.is_integer()): card_cn = int(card_cn)
+    card_set = str(card_set).strip()
+    card_set = SET_FIXUPS.get(card_set, card_set)
+    card_foil = str(card_foil or "nonfoil").strip().lower()
+    card_quantity = int(card_quantity) if card_quantity not in (None, "") else 1
+    
+    return card_api.Card(str(card_name).strip(), str(card_cn).strip(), card_set, card_foil, quantity = card_quantity, call_api = autocall_api)
+
+def is_header(row: tuple) -> bool:
+    return [str(val).strip().lower() for val in row[:len(COLUMNS)]] == COLUMNS
+
+def is_blank(row: tuple) -> bool:
+    return all(val in (None, "") for val in row)
+
+class CardSource(ABC):
+    """A collection to read cards from. Subclasses implement rows(), which yields raw rows without loading the whole collection"""
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.cards_found = 0
+    
+    def open(self) -> None:
+        """Connects to the collection up front, so a bad file, driver or DSN fails before reading starts. Raises OSError"""
+    
+    @abstractmethod
+    def rows(self) -> Iterator[tuple]: ...
+    
+    def cards(self, autocall_api: bool = False) -> Iterator[card_api.Card]:
+        for row in self.rows():
+            if (is_blank(row) or is_header(row)): continue
+            self.cards_found += 1
+            yield normalize_row(row, autocall_api)
+
+def fetch_rows(cursor, sql: str, fetch_size: int) -> Iterator[tuple]:
+    # Falls back to the whole Cards table if the custom query fails, like the Access reader always has
+    try: cursor.execute(sql)
+    except Exception: cursor.execute(DEFAULT_SQL)
+    
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if (len(rows) == 0): return
+        for row in rows: yield tuple(row)
+
+class AccessSource(CardSource):
+    """An Access database, read through the Microsoft Access ODBC driver (Windows only)"""
+    def __init__(self, filename: str, sql: str = DEFAULT_SQL, fetch_size: int = FETCH_SIZE) -> None:
+        super().__init__(filename)
+        self.sql = sql
+        self.fetch_size = fetch_size
+        self.connection = None
+    
+    def open(self) -> None:
+        try: import pyodbc # Only needed for Access, so the other sources work where the driver is not installed
+        except ImportError as err: raise OSError(f"Reading Access databases needs pyodbc and the Microsoft Access ODBC driver ({err})") from err
+        
+        try: self.connection = pyodbc.connect(ACCESS_DRIVER + os.path.abspath(self.filename) + ";")
+        except pyodbc.Error as err: raise OSError(f"Could not open {self.filename}: {err}") from err
+        self.connection.setdecoding(pyodbc.SQL_CHAR, encoding = ACCESS_ENCODING)
+        self.connection.setdecoding(pyodbc.SQL_WCHAR, encoding = ACCESS_ENCODING)
+        self.connection.setencoding(encoding = ACCESS_ENCODING)
+    
+    def rows(self) -> Iterator[tuple]:
+        if (self.connection == None): self.open()
+        cnxn, self.connection = self.connection, None
+        try:
+            cursor = cnxn.cursor()
+            try: yield from fetch_rows(cursor, self.sql, self.fetch_size)
+            finally: cursor.close()
+        finally: cnxn.close()
+
+class SQLiteSource(CardSource):
+    def __init__(self, filename: str, sql: str = DEFAULT_SQL, fetch_size: int = FETCH_SIZE) -> None:
+        super().__init__(filename)
+        self.sql = sql
+        self.fetch_size = fetch_size
+        self.connection: sqlite3.Connection | None = None
+    
+    def open(self) -> None:
+        if (not os.path.exists(self.filename)): raise FileNotFoundError(self.filename) # sqlite3 would create an empty database
+        try:
+            self.connection = sqlite3.connect(f"file:{self.filename}?mode=ro", uri = True)
+            self.connection.execute("PRAGMA schema_version") # sqlite3 only reads the file when it is first queried
+        except sqlite3.Error as err: raise OSError(f"Could not open {self.filename}: {err}") from err
+    
+    def rows(self) -> Iterator[tuple]:
+        if (self.connection == None): self.open()
+        cnxn, self.connection = self.connection, None
+        try:
+            cursor = cnxn.cursor()
+            try: yield from fetch_rows(cursor, self.sql, self.fetch_size)
+            finally: cursor.close()
+        finally: cnxn.close()
+
+class CSVSource(CardSource):
+    """A CSV file with the Cards table's columns, with or without a header row"""
+    def rows(self) -> Iterator[tuple]:
+        with open(self.filename, "r", newline = "", encoding = "utf-8-sig") as file:
+            for row in csv.reader(file): yield tuple(row)
+
+class XLSXSource(CardSource):
+    """The first sheet of an Excel file with the Cards table's columns, read in read-only mode"""
+    def rows(self) -> Iterator[tuple]:
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(self.filename, read_only = True, data_only = True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(values_only = True): yield row
+        finally: workbook.close()
+
+def source_type(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower()
+    if (extension not in SOURCE_EXTENSIONS): raise ValueError(f"Unknown collection file type {extension}, expected one of {list(SOURCE_EXTENSIONS)}")
+    return SOURCE_EXTENSIONS[extension]
+
+def open_source(filename: str, sql: str = DEFAULT_SQL, kind: str = "") -> CardSource:
+    """Picks the reader for filename from its extension, unless kind names one of SOURCE_TYPES"""
+    if (kind == ""): kind = source_type(filename)
+    if (sql == ""): sql = DEFAULT_SQL
+    if (kind == "access"): return AccessSource(filename, sql)
+    if (kind == "sqlite"): return SQLiteSource(filename, sql)
+    if (kind == "csv"): return CSVSource(filename)
+    if (kind == "xlsx"): return XLSXSource(filename)
+    raise ValueError(f"Unknown collection source {kind}, expected one of {SOURCE_TYPES}")
@@ -0,0 +1,185 @@
+"""History compaction, so the store and the workbook generated from it stop growing by a column every day.
+Days within the daily window keep their own partition. Older days are rolled up into one partition per week,
+and past the weekly window into one per month. A rollup is stored as the partition of the last day in its period:
+price is each card's last price in the period, so every reader sees it as a sampled day, and price_min, price_max,
+price_mean and price_count (likewise for the other currencies) hold the rest.
+Before a day is removed its partition goes into archive-YYYY-MM.npz, compressed and in long form with a date column"""
+from datetime import datetime, timedelta
+import card_api, history_store
+import os
+import numpy as np
+
+DAILY_DAYS = 90
+WEEKLY_DAYS = 365
+ARCHIVE_PREFIX = "archive-"
+ROLLUP_STATS = ["min", "max", "mean"]
+ROLLUP_SHEET = "Rollups"
+
+def period_of(date: str, today: str, daily_days: int = DAILY_DAYS, weekly_days: int = WEEKLY_DAYS) -> str | None:
+    """The period a date is rolled into ("2024-03" or "2024-03 W10"), None while it is within the daily window.
+    Weeks are cut at month ends, so a month's weekly rollups can later be rolled into the month exactly"""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    month_end = (day.replace(day = 28) + timedelta(days = 4)).replace(day = 1) - timedelta(days = 1)
+    if (month_end < datetime.strptime(today, "%Y-%m-%d") - timedelta(days = weekly_days)): return day.strftime("%Y-%m")
+    
+    week_end = min(day + timedelta(days = 6 - day.weekday()), month_end)
+    if (week_end < datetime.strptime(today, "%Y-%m-%d") - timedelta(days = daily_days)): return f"{day.strftime('%Y-%m')} W{day.isocalendar()[1]:02d}"
+    return None
+
+def partition_period(store: history_store.HistoryStore, date: str) -> tuple[str, str] | None:
+    # (period, first date covered) of a rollup partition, None for a day's own partition
+    with np.load(store.partition_filename(date)) as partition:
+        if ("period" not in partition.files): return None
+        return str(partition["period"]), str(partition["since"])
+
+def price_columns(files: list[str]) -> list[str]:
+    return [history_store.price_column(currency) for currency in card_api.CURRENCIES if history_store.price_column(currency) in files]
+
+def merge_partitions(store: history_store.HistoryStore, dates: list[str], period: str, since: str) -> str:
+    """Rolls the partitions of dates (days and earlier rollups, oldest first) into one written as the last date's partition"""
+    size = len(store.cards)
+    seen = np.zeros(size, dtype = bool)
+    quantities = np.zeros(size, dtype = np.int32)
+    stale = np.zeros(size, dtype = bool)
+    stats: dict[str, dict[str, np.ndarray]] = {}
+    
+    for date in dates:
+        with np.load(store.partition_filename(date)) as partition:
+            card_ids = partition["card_id"]
+            seen[card_ids] = True
+            quantities[card_ids] = partition["quantity"]
+            stale[card_ids] = partition["stale"] if "stale" in partition.files else False
+            
+            for column in price_columns(partition.files):
+                if (column not in stats): stats[column] = {"last": np.full(size, np.nan), "min": np.full(size, np.nan), "max": np.full(size, np.nan), "total": np.zeros(size), "count": np.zeros(size, dtype = np.int32)}
+                column_stats = stats[column]
+                prices = partition[column]
+                rolled = f"{column}_count" in partition.files
+                priced = prices == prices
+                
+                column_stats["last"][card_ids[priced]] = prices[priced]
+                column_stats["min"][card_ids] = np.fmin(column_stats["min"][card_ids], partition[f"{column}_min"] if rolled else prices)
+                column_stats["max"][card_ids] = np.fmax(column_stats["max"][card_ids], partition[f"{column}_max"] if rolled else prices)
+                counts = partition[f"{column}_count"] if rolled else priced.astype(np.int32)
+                column_stats["total"][card_ids] += np.nan_to_num((partition[f"{column}_mean"] if rolled else prices) * counts)
+                column_stats["count"][card_ids] += counts
+    
+    card_ids = np.flatnonzero(seen)
+    extra_columns = {"period": np.array(period), "since": np.array(since)}
+    for column, column_stats in stats.items():
+        counts = column_stats["count"][card_ids]
+        extra_columns[f"{column}_min"] = column_stats["min"][card_ids]
+        extra_columns[f"{column}_max"] = column_stats["max"][card_ids]
+        extra_columns[f"{column}_mean"] = np.divide(column_stats["total"][card_ids], counts, out = np.full(len(card_ids), np.nan), where = counts > 0)
+        extra_columns[f"{column}_count"] = counts
+    
+    last = {column: column_stats["last"][card_ids] for column, column_stats in stats.items()}
+    prices = last.pop(history_store.price_column(), np.full(len(card_ids), np.nan))
+    currency_prices = {currency: last[history_store.price_column(currency)] for currency in card_api.CURRENCIES if history_store.price_column(currency) in last}
+    return store.write_partition(dates[-1], card_ids, prices, quantities[card_ids], stale[card_ids], currency_prices, extra_columns)
+
+def archive_filename(store: history_store.HistoryStore, month: str) -> str: return os.path.join(store.directory, f"{ARCHIVE_PREFIX}{month}.npz")
+
+def archive_days(store: history_store.HistoryStore, dates: list[str]) -> None:
+    """Adds the days' partitions to their month's archive. Days already in it are replaced, so archiving again after a crash is harmless"""
+    months: dict[str, list[str]] = {}
+    for date in dates: months.setdefault(date[:7], []).append(date)
+    
+    for month, month_dates in months.items():
+        filename = archive_filename(store, month)
+        parts: list[dict[str, np.ndarray]] = []
+        if (os.path.exists(filename)):
+            with np.load(filename) as archive:
+                kept = ~np.isin(archive["date"], np.array(month_dates, dtype = "datetime64[D]"))
+                parts.append({name: archive[name][kept] for name in archive.files})
+        for date in month_dates:
+            with np.load(store.partition_filename(date)) as partition:
+                columns = {name: partition[name] for name in partition.files}
+            columns["date"] = np.full(len(columns["card_id"]), np.datetime64(date, "D"))
+            parts.append(columns)
+        
+        names = list(dict.fromkeys(name for part in parts for name in part))
+        # Columns a partition did not have: prices are NaN and nothing was carried forward
+        missing = lambda name, count: np.zeros(count, dtype = bool) if name == "stale" else np.full(count, np.nan)
+        columns = {name: np.concatenate([part[name] if name in part else missing(name, len(part["card_id"])) for part in parts]) for name in names}
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "wb") as file:
+            np.savez_compressed(file, **columns)
+        os.replace(temp_filename, filename)
+
+def compact(store: history_store.HistoryStore, today: str, daily_days: int = DAILY_DAYS, weekly_days: int = WEEKLY_DAYS) -> list[str]:
+    """Rolls every period that has left the daily (or weekly) window into one partition, archiving the raw days first.
+    Returns the periods written. Periods that are already a single rollup are left alone, so running it daily only touches what moved"""
+    periods: dict[str, list[str]] = {}
+    for date in store.dates():
+        period = period_of(date, today, daily_days, weekly_days)
+        if (period != None): periods.setdefault(period, []).append(date)
+    
+    written = []
+    for period, dates in periods.items():
+        rollups = {date: partition_period(store, date) for date in dates}
+        if (len(dates) == 1 and rollups[dates[0]] != None and rollups[dates[0]][0] == period): continue
+        
+        # Days a rollup already covers are only left over if an earlier compaction stopped before removing them
+        covered = [(rollup[1], date) for date, rollup in rollups.items() if rollup != None]
+        days = [date for date in dates if rollups[date] == None and not any(since <= date <= end for since, end in covered)]
+        merged = [date for date in dates if rollups[date] != None or date in days]
+        since = min(days + [since for since, _ in covered])
+        
+        archive_days(store, days)
+        filename = merge_partitions(store, merged, period, since)
+        # Everything else in the period is now in the rollup (or was already), whichever date it was written as
+        for date in dates:
+            if (store.partition_filename(date) != filename): os.remove(store.partition_filename(date))
+        written.append(period)
+    
+    return written
+
+def write_rollup_sheet(workbook, store: history_store.HistoryStore) -> None:
+    """Adds the min, max and mean of every rollup period (the last price is the period's column on the price sheet) to a write only workbook"""
+    from openpyxl.cell import WriteOnlyCell
+    import magic_excel as me
+    rollups = [(date, rollup[0]) for date in store.dates() for rollup in [partition_period(store, date)] if rollup != None]
+    if (len(rollups) == 0): return
+    
+    sheet = workbook.create_sheet(ROLLUP_SHEET)
+    values = np.full((len(store.cards), len(rollups) * len(ROLLUP_STATS)), np.nan)
+    for index, (date, _) in enumerate(rollups):
+        with np.load(store.partition_filename(date)) as partition:
+            for offset, stat in enumerate(ROLLUP_STATS): values[partition["card_id"], index * len(ROLLUP_STATS) + offset] = partition[f"{history_store.price_column()}_{stat}"]
+    
+    header = []
+    for value in me.HEADERS[:4] + [f"{period} {stat}" for _, period in rollups for stat in ROLLUP_STATS]:
+        cell = WriteOnlyCell(sheet, value = value)
+        cell.fill = me.HEADER_FILL
+        cell.border = me.HEADER_BORDER
+        cell.font = me.HEADER_FONT
+        cell.alignment = me.CENTER_ALIGN
+        header.append(cell)
+    sheet.append(header)
+    
+    for card_id, key in enumerate(store.cards):
+        row: list = list(key)
+        for price in values[card_id].tolist():
+            if (price != price):
+                row.append(None)
+                continue
+            cell = WriteOnlyCell(sheet, value = price)
+            cell.number_format = me.PRICE_FORMAT
+            row.append(cell)
+        sheet.append(row)
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description = "Roll old history into weekly and monthly partitions, archiving the raw days")
+    parser.add_argument("history_dir", nargs = "?", default = history_store.HISTORY_DIRECTORY)
+    parser.add_argument("--daily_days", type = int, default = DAILY_DAYS, help = f"Days kept at daily resolution. Default = {DAILY_DAYS}")
+    parser.add_argument("--weekly_days", type = int, default = WEEKLY_DAYS, help = f"Days kept at weekly resolution, older ones become monthly. Default = {WEEKLY_DAYS}")
+    args = parser.parse_args()
+    
+    store = history_store.HistoryStore(args.history_dir)
+    before = len(store.dates())
+    periods = compact(store, datetime.now().strftime("%Y-%m-%d"), args.daily_days, args.weekly_days)
+    print(f"Rolled up {len(periods)} periods, {before} partitions down to {len(store.dates())}")
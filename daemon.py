@@ -0,0 +1,242 @@
+"""Long-running price service. Keeps the SQLite cache, the optional bulk index and the HTTP session warm,
+and answers price lookups over local HTTP or a Unix socket:
+    
+    GET  /price?set=CMM&cn=642&finish=foil
+    POST /prices   {"cards": [{"set": "CMM", "collector_number": "642", "foiling": "foil", "quantity": 1}, ...]}
+    GET  /health, GET /metrics
+
+Run: python daemon.py [--port 8760 | --socket /tmp/magicpricing.sock] [--flush_seconds 60] [--batch_ms 50]"""
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import card_api, history_store, logger, price_cache, scryfall_bulk
+import argparse, json, os, socketserver, threading
+
+DEFAULT_PORT = 8760
+BATCH_WINDOW_MS = 50 # How long the batcher waits for more lookups before calling the API
+FLUSH_SECONDS = 60
+MAX_CARDS_PER_REQUEST = 10_000
+
+PriceKey = tuple[str, str, str] # (set, collector number, finish)
+
+class Batcher:
+    """Collects the cache misses of concurrent lookups and prices them together through /cards/collection.
+    Every printing is fetched once however many clients are waiting on it"""
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.pending: dict[tuple[str, str], Future] = {}
+        self.ready = threading.Condition()
+        self.thread = threading.Thread(target = self.run, name = "daemon-batcher", daemon = True)
+        self.thread.start()
+    
+    def fetch(self, card_set: str, collector_number: str) -> Future:
+        # The future resolves to a priced Card for the printing, or None if Scryfall does not have it
+        key = card_api.printing_key(card_set, collector_number)
+        with self.ready:
+            if (key not in self.pending):
+                self.pending[key] = Future()
+                self.ready.notify()
+            return self.pending[key]
+    
+    def run(self) -> None:
+        while True:
+            with self.ready:
+                while (len(self.pending) == 0): self.ready.wait()
+                # Give other clients a moment to add their printings, unless a full request worth is already waiting
+                self.ready.wait_for(lambda: len(self.pending) >= card_api.COLLECTION_BATCH_SIZE, timeout = self.window)
+                batch, self.pending = self.pending, {}
+            
+            cards = {key: card_api.Card("", key[1], key[0], "nonfoil") for key in batch}
+            logger.metrics.count("daemon_upstream_printings", len(cards))
+            try:
+                with logger.metrics.span("daemon_fetch"): not_found = card_api.set_prices_from_collection(list(cards.values()))
+            except Exception as err:
+                for future in batch.values(): future.set_exception(err)
+                continue
+            
+            missing = {id(err.card) for err in not_found}
+            for key, future in batch.items(): future.set_result(None if id(cards[key]) in missing else cards[key])
+
+class PriceDaemon:
+    """Answers lookups from the cache and the batcher. With a history_dir, new prices of cards in today's history partition
+    are also flushed to it. Lookups never add cards to the history or change their quantities"""
+    def __init__(self, cache: price_cache.SQLiteCache, history_dir: str = "", batch_window: float = BATCH_WINDOW_MS / 1000) -> None:
+        self.cache = cache
+        self.history_dir = history_dir
+        self.lock = threading.Lock() # Guards the cache and the prices waiting for the history store
+        self.priced: dict[PriceKey, card_api.Card] = {}
+        self.batcher = Batcher(batch_window)
+        self.stop = threading.Event()
+    
+    def lookup(self, entries: list[dict]) -> tuple[list[dict], list[dict]]:
+        """Prices (set, collector_number, foiling[, quantity]) entries. Returns (found, not_found) in request order"""
+        cards = [card_api.Card("", str(entry["collector_number"]), str(entry["set"]), str(entry.get("foiling", entry.get("finish", "nonfoil"))).lower(), quantity = int(entry.get("quantity", 1))) for entry in entries]
+        misses: list[card_api.Card] = []
+        priced: set[int] = set()
+        with self.lock:
+            for card in cards:
+                cached_price = self.cache.lookup(card)
+                if (cached_price != None):
+                    card.price = cached_price
+                    card.api_name = self.cache.lookup_name(card)
+                    priced.add(id(card))
+                else: misses.append(card)
+        logger.metrics.count("cache_hits", len(cards) - len(misses))
+        logger.metrics.count("cache_misses", len(misses))
+        
+        futures = {id(card): self.batcher.fetch(card.set, card.collector_number) for card in misses}
+        fetched: set[int] = set()
+        for card in misses:
+            printing = futures[id(card)].result()
+            if (printing == None): continue
+            card.prices = printing.prices
+            card.api_name = printing.api_name
+            card.set_price_from_api()
+            fetched.add(id(card))
+        
+        found: list[dict] = []
+        not_found: list[dict] = []
+        with self.lock:
+            for card in cards:
+                result = {"set": card.set, "collector_number": card.collector_number, "foiling": card.foiling}
+                if (id(card) not in priced and id(card) not in fetched):
+                    not_found.append(result)
+                    continue
+                
+                found.append(result | {"name": card.api_name, "price": card.price, "cached": id(card) in priced})
+                if (id(card) in fetched): self.cache.store(card)
+                # Only cards with a Scryfall name can be matched up with the collection's history
+                if (card.api_name != None): self.priced[(card.set.upper(), card.collector_number, card.foiling)] = card
+        return found, not_found
+    
+    def flush(self) -> None:
+        """Writes new prices to the cache and today's history partition, then drops cache entries that expired"""
+        with self.lock:
+            with logger.metrics.span("cache_write"): self.cache.save()
+            self.cache.reload()
+            priced, self.priced = self.priced, {}
+        
+        if (self.history_dir == "" or len(priced) == 0): return
+        # Only today's partition written by main.py is updated, and only for the cards in it, under their own key and quantity.
+        # Before main.py has run today the prices just wait in the cache, where main.py picks them up
+        store = history_store.HistoryStore(self.history_dir)
+        today = datetime.now().strftime("%Y-%m-%d")
+        if (today not in store.dates()): return
+        card_ids, _, quantities = store.read_partition(today)
+        held = dict(zip(card_ids.tolist(), quantities.tolist()))
+        printings = {(card_set.upper(), str(collector_number), foiling): card_id for card_id, (_, collector_number, card_set, foiling) in enumerate(store.cards) if card_id in held}
+        history_cards = []
+        for key, card in priced.items():
+            card_id = printings.get(key)
+            if (card_id == None): continue
+            name, collector_number, card_set, foiling = store.cards[card_id]
+            history_cards.append(card_api.Card(name, collector_number, card_set, foiling, quantity = held[card_id], price = card.price))
+        if (len(history_cards) == 0): return
+        
+        with logger.metrics.span("history_write"):
+            store.append(today, history_cards, merge = True)
+    
+    def flush_periodically(self, seconds: float) -> None:
+        while (not self.stop.wait(seconds)):
+            try: self.flush()
+            except Exception as err: logger.log_to_screen(f"Flush failed: {err}", "ERROR")
+
+def make_handler(daemon: PriceDaemon) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def log_message(self, format, *args) -> None: pass
+        
+        def send(self, code: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def answer(self, entries: list[dict], single: bool) -> None:
+            logger.metrics.count("daemon_requests")
+            try: found, not_found = daemon.lookup(entries)
+            except (KeyError, TypeError, ValueError) as err:
+                self.send(400, {"error": f"Bad card entry: {err}"})
+                return
+            except Exception as err:
+                self.send(502, {"error": str(err)})
+                return
+            
+            if (not single): self.send(200, {"data": found, "not_found": not_found})
+            elif (len(found) > 0): self.send(200, found[0])
+            else: self.send(404, {"error": "not found"} | not_found[0])
+        
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            if (url.path == "/health"): self.send(200, {"status": "ok", "cached_printings": len(daemon.cache.old)})
+            elif (url.path == "/metrics"): self.send(200, logger.metrics.summary())
+            elif (url.path == "/price"):
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                entry = {"set": query.get("set"), "collector_number": query.get("cn", query.get("collector_number")), "foiling": query.get("finish", query.get("foiling", "nonfoil"))}
+                if (entry["set"] == None or entry["collector_number"] == None): self.send(400, {"error": "set and cn are required"})
+                else: self.answer([entry], True)
+            else: self.send(404, {"error": f"Unknown path {url.path}"})
+        
+        def do_POST(self) -> None:
+            try: body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except json.JSONDecodeError:
+                self.send(400, {"error": "Body is not JSON"})
+                return
+            if (urlparse(self.path).path != "/prices"):
+                self.send(404, {"error": f"Unknown path {self.path}"})
+                return
+            cards = body.get("cards") if isinstance(body, dict) else None
+            if (not isinstance(cards, list) or len(cards) > MAX_CARDS_PER_REQUEST):
+                self.send(400, {"error": f"Expected {{\"cards\": [...]}} with at most {MAX_CARDS_PER_REQUEST} entries"})
+                return
+            self.answer(cards, False)
+    
+    return Handler
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(daemon: PriceDaemon, port: int = DEFAULT_PORT, socket_path: str = "") -> socketserver.BaseServer:
+    if (socket_path != ""):
+        if (os.path.exists(socket_path)): os.remove(socket_path) # Left behind by a previous run
+        return ThreadingUnixHTTPServer(socket_path, make_handler(daemon))
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(daemon))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve card prices from a warm cache")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT, help = f"Local HTTP port. Default = {DEFAULT_PORT}")
+    parser.add_argument("--socket", default = "", help = "Serve on this Unix socket instead of a port")
+    parser.add_argument("--cache_ttl_hours", type = float, default = price_cache.DEFAULT_TTL_SECONDS / 60 / 60, help = "How long a cached price stays valid. Default = 24")
+    parser.add_argument("--history_dir", default = "", help = f"Also flush new prices of cards the collection holds to this history store (e.g. '{history_store.HISTORY_DIRECTORY}'). Other lookups only go to the cache")
+    parser.add_argument("--flush_seconds", type = float, default = FLUSH_SECONDS, help = f"How often new prices are written out. Default = {FLUSH_SECONDS}")
+    parser.add_argument("--batch_ms", type = float, default = BATCH_WINDOW_MS, help = f"How long to gather lookups into one upstream request. Default = {BATCH_WINDOW_MS}")
+    parser.add_argument("--bulk_file", default = "", help = "Price from a Scryfall default_cards bulk data file instead of the API")
+    parser.add_argument("--workers", type = int, default = card_api.MAX_WORKERS, help = f"Number of API requests in flight at once. Default = {card_api.MAX_WORKERS}")
+    args = parser.parse_args()
+    
+    card_api.fetcher = card_api.Fetcher(rate = 1000 / card_api.API_CALL_TIMEOUT_MS, max_workers = args.workers)
+    if (args.bulk_file != ""): card_api.bulk_index = scryfall_bulk.load_index(args.bulk_file)
+    cache = price_cache.SQLiteCache(ttl = args.cache_ttl_hours * 60 * 60)
+    logger.log_to_screen(f"Loaded {cache.load()} cached printings", "LOG")
+    
+    price_daemon = PriceDaemon(cache, args.history_dir, args.batch_ms / 1000)
+    server = serve(price_daemon, args.port, args.socket)
+    flusher = threading.Thread(target = price_daemon.flush_periodically, args = (args.flush_seconds,), name = "daemon-flusher", daemon = True)
+    flusher.start()
+    
+    logger.log_to_screen(f"Serving prices on {args.socket or f'http://127.0.0.1:{args.port}'}", "LOG")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        price_daemon.stop.set()
+        server.server_close()
+        price_daemon.flush()
+        cache.close()
+        if (args.socket != "" and os.path.exists(args.socket)): os.remove(args.socket)
@@ -0,0 +1,118 @@
+"""CSV and Parquet exports, for when only the numbers are needed. The day's snapshot is streamed out batch by batch
+as cards are priced, and the history store can be written wide (one column per date) like the workbook.
+Parquet needs pyarrow, which is only imported when a Parquet file is written"""
+from abc import ABC, abstractmethod
+from os import path
+import card_api, history_store
+import csv, os
+import numpy as np
+
+SNAPSHOT_COLUMNS = ["date", "name", "number", "set", "foiling", "quantity"]
+PIVOT_COLUMNS = SNAPSHOT_COLUMNS[1:]
+PIVOT_SUFFIX = "-history"
+
+def export_filename(excel_filename: str, export_format: str, suffix: str = "") -> str:
+    # --excel_filename names every export, only the extension follows the format
+    return path.splitext(excel_filename)[0] + suffix + "." + export_format
+
+def price_columns(currencies: list[str] | None) -> list[str]:
+    return [history_store.price_column(currency) for currency in [card_api.CURRENCY] + [currency for currency in currencies or [] if currency != card_api.CURRENCY]]
+
+def import_pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from None
+    return pyarrow, pyarrow.parquet
+
+class SnapshotWriter(ABC):
+    """Writes (date, name, number, set, foiling, quantity, price[, price_<currency>...]) rows to a temporary file
+    that replaces filename on close(), so a failed run leaves the last complete snapshot in place"""
+    def __init__(self, filename: str, date: str, currencies: list[str] | None = None) -> None:
+        self.filename = filename
+        self.temp_filename = filename + ".tmp"
+        self.date = date
+        self.currencies = [card_api.CURRENCY] + [currency for currency in currencies or [] if currency != card_api.CURRENCY]
+        self.columns = SNAPSHOT_COLUMNS + price_columns(currencies)
+        self.rows_written = 0
+    
+    @abstractmethod
+    def write(self, cards: list[card_api.Card]) -> None: ...
+    
+    def finish(self) -> None: pass
+    
+    def close(self) -> None:
+        self.finish()
+        os.replace(self.temp_filename, self.filename)
+    
+    def abort(self) -> None:
+        self.finish()
+        if (os.path.exists(self.temp_filename)): os.remove(self.temp_filename)
+
+class CSVSnapshotWriter(SnapshotWriter):
+    def __init__(self, filename: str, date: str, currencies: list[str] | None = None) -> None:
+        super().__init__(filename, date, currencies)
+        self.file = open(self.temp_filename, "w", encoding = "utf-8", newline = "")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.columns)
+    
+    def write(self, cards: list[card_api.Card]) -> None:
+        self.writer.writerows((self.date, card.name, card.collector_number, card.set, card.foiling, card.quantity, *(card.price_in(currency) for currency in self.currencies)) for card in cards)
+        self.rows_written += len(cards)
+    
+    def finish(self) -> None: self.file.close()
+
+class ParquetSnapshotWriter(SnapshotWriter):
+    """Every batch becomes one row group, so memory stays at one batch however large the collection is"""
+    def __init__(self, filename: str, date: str, currencies: list[str] | None = None) -> None:
+        super().__init__(filename, date, currencies)
+        self.pa, pq = import_pyarrow()
+        types = [self.pa.string()] * 5 + [self.pa.int32()] + [self.pa.float64()] * len(self.currencies)
+        self.schema = self.pa.schema(list(zip(self.columns, types)))
+        self.writer = pq.ParquetWriter(self.temp_filename, self.schema)
+    
+    def write(self, cards: list[card_api.Card]) -> None:
+        if (len(cards) == 0): return
+        values = [
+            [self.date] * len(cards),
+            [card.name for card in cards],
+            [str(card.collector_number) for card in cards],
+            [card.set for card in cards],
+            [card.foiling for card in cards],
+            [card.quantity for card in cards],
+            *([card.price_in(currency) for card in cards] for currency in self.currencies)
+        ]
+        arrays = [self.pa.array(column, type = field.type) for column, field in zip(values, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema = self.schema))
+        self.rows_written += len(cards)
+    
+    def finish(self) -> None: self.writer.close()
+
+def open_snapshot_writer(export_format: str, filename: str, date: str, currencies: list[str] | None = None) -> SnapshotWriter:
+    if (export_format == "csv"): return CSVSnapshotWriter(filename, date, currencies)
+    if (export_format == "parquet"): return ParquetSnapshotWriter(filename, date, currencies)
+    raise ValueError(f"No snapshot writer for {export_format}, expected csv or parquet")
+
+def export_pivot(store: history_store.HistoryStore, filename: str, export_format: str, currency: str = card_api.CURRENCY) -> int:
+    """Writes the whole history wide, one row per card and one column per date, like the workbook. Returns the number of dates"""
+    dates, prices, quantities = store.load_matrix(currency = currency)
+    temp_filename = filename + ".tmp"
+    
+    if (export_format == "csv"):
+        with open(temp_filename, "w", encoding = "utf-8", newline = "") as file:
+            writer = csv.writer(file)
+            writer.writerow(PIVOT_COLUMNS + dates)
+            for card_id, key in enumerate(store.cards):
+                writer.writerow([*key, int(quantities[card_id])] + ["" if price != price else price for price in prices[card_id].tolist()])
+    
+    elif (export_format == "parquet"):
+        pa, pq = import_pyarrow()
+        columns = {column: pa.array([key[index] for key in store.cards], type = pa.string()) for index, column in enumerate(PIVOT_COLUMNS[:-1])}
+        columns["quantity"] = pa.array(quantities, type = pa.int32())
+        for column, date in enumerate(dates): columns[date] = pa.array(np.ascontiguousarray(prices[:, column]), type = pa.float64(), from_pandas = True) # NaN becomes null
+        pq.write_table(pa.table(columns), temp_filename)
+    
+    else: raise ValueError(f"No pivot export for {export_format}, expected csv or parquet")
+    
+    os.replace(temp_filename, filename)
+    return len(dates)
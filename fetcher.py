@@ -0,0 +1,178 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import IO, TYPE_CHECKING, Callable, Iterable, Iterator, TypeVar
+from time import monotonic, perf_counter, sleep, time
+from logger import metrics
+import os, random, struct, threading
+
+# requests is imported with the first request, runs priced from the cache or a bulk file never load it
+if (TYPE_CHECKING):
+    import requests
+
+if (os.name == "nt"): import msvcrt
+else: import fcntl
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+USER_AGENT = "MagicPricing/2.0"
+STATE_FORMAT = struct.Struct("<dd") # FileTokenBucket state: tokens, last update
+
+class TokenBucket:
+    """Thread safe token bucket. Holds the aggregate request rate to `rate` per second, allowing bursts of up to `capacity`"""
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if (self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+class FileTokenBucket:
+    """TokenBucket shared by every process that uses the same state file, so parallel runs hold the combined rate to `rate` per second.
+    The state (tokens, last update as wall clock time) lives in the file and is only changed under an exclusive file lock"""
+    def __init__(self, filename: str, rate: float, capacity: float = 1.0) -> None:
+        self.filename = filename
+        self.rate = rate
+        self.capacity = capacity
+        self.lock = threading.Lock() # File locks do not exclude threads of the same process
+        self.file = open(filename, "a+b")
+    
+    def acquire(self) -> None:
+        while True:
+            with self.lock, locked_file(self.file):
+                self.file.seek(0)
+                state = self.file.read(STATE_FORMAT.size)
+                now = time()
+                tokens, updated = STATE_FORMAT.unpack(state) if len(state) == STATE_FORMAT.size else (self.capacity, now)
+                tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+                
+                took = tokens >= 1
+                if (took): tokens -= 1
+                self.file.seek(0)
+                self.file.truncate()
+                self.file.write(STATE_FORMAT.pack(tokens, now))
+                self.file.flush()
+                if (took): return
+                wait = (1 - tokens) / self.rate
+            sleep(wait)
+    
+    def close(self) -> None: self.file.close()
+
+@contextmanager
+def locked_file(file: IO[bytes]) -> Iterator[None]:
+    # Exclusive lock on the whole file, blocking until it is free
+    if (os.name == "nt"):
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError: continue # LK_LOCK gives up after 10 seconds
+        try: yield
+        finally:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try: yield
+        finally: fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+def parse_retry_after(value: str | None) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    if (value == None): return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    
+    try: return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError): return None
+
+class Fetcher:
+    """Pooled keep-alive HTTP session shared by a thread pool, rate limited by one TokenBucket. The session is opened on the first request.
+    Retries 429 and 5xx responses with exponential backoff and jitter, honouring Retry-After"""
+    def __init__(self, rate: float, max_workers: int = 8, max_retries: int = 5, backoff_base: float = 0.5, backoff_cap: float = 30.0, bucket: TokenBucket | FileTokenBucket | None = None) -> None:
+        self.bucket = bucket or TokenBucket(rate)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.session: requests.Session | None = None
+        self.session_lock = threading.Lock()
+    
+    def open_session(self) -> requests.Session:
+        with self.session_lock:
+            if (self.session == None):
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.headers.update({"User-Agent": USER_AGENT, "Accept": "application/json"})
+                adapter = HTTPAdapter(pool_connections = self.max_workers, pool_maxsize = self.max_workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.session = session
+            return self.session
+    
+    def backoff(self, attempt: int, retry_after: float | None) -> float:
+        # Full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if (retry_after != None): delay = max(delay, retry_after)
+        return delay
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        import requests
+        session = self.session or self.open_session()
+        attempt = 0
+        while True:
+            with metrics.span("rate_limit_wait"): self.bucket.acquire()
+            metrics.count("api_calls")
+            start = perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.count("api_connection_errors")
+                if (attempt >= self.max_retries): raise
+                sleep(self.backoff(attempt, None))
+                attempt += 1
+                metrics.count("api_retries")
+                continue
+            finally:
+                elapsed = perf_counter() - start
+                metrics.add_time("api_request", elapsed)
+                metrics.observe_latency(elapsed)
+            
+            metrics.count(f"api_status_{response.status_code}")
+            if (response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries): return response
+            sleep(self.backoff(attempt, parse_retry_after(response.headers.get("Retry-After"))))
+            attempt += 1
+            metrics.count("api_retries")
+    
+    def get(self, url: str, **kwargs) -> requests.Response: return self.request("GET", url, **kwargs)
+    
+    def post(self, url: str, **kwargs) -> requests.Response: return self.request("POST", url, **kwargs)
+    
+    def map(self, func: Callable[[T], R], items: Iterable[T]) -> list[R]:
+        # Results come back in the same order as items. The first exception raised by func is re-raised here
+        items = list(items)
+        if (len(items) <= 1 or self.max_workers <= 1): return [func(item) for item in items]
+        
+        with ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+            return list(pool.map(func, items))
+    
+    def close(self) -> None:
+        if (self.session != None): self.session.close()
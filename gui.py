@@ -1,158 +1,366 @@
-import dearpygui.dearpygui as dpg, numpy as np, pandas as pd
-import card_api, logger, magic_excel as me
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import logger
+import os
+from time import perf_counter
 
+# numpy, pandas, the history store, dearpygui, the statistics and openpyxl (through magic_excel) are imported where they are used,
+# so importing this module is cheap and the window only loads the Excel stack when there is no history store
+if (TYPE_CHECKING):
+    import numpy as np, pandas as pd
+    import history_store
 
-def get_price_history_excel(filename: str) -> list[card_api.Card]:
-    cards = []
-    with me.ExcelManager(filename, "r") as file:
-        sheet = file.active
-        if (sheet == None): exit()
+
+def history_sidecar_filename(filename: str) -> str: return f"{filename}.history.npz"
+
+def load_price_history(filename: str, use_sidecar: bool = True) -> pd.DataFrame:
+    """Reads the workbook's price history straight into a cards x dates float64 matrix.
+    The result is cached in a sidecar file that is reused while the workbook's mtime and size are unchanged"""
+    import numpy as np, pandas as pd
+    stat = os.stat(filename)
+    signature = np.array([stat.st_mtime_ns, stat.st_size], dtype = np.int64)
+    sidecar = history_sidecar_filename(filename)
+    
+    if (use_sidecar and os.path.exists(sidecar)):
+        try:
+            with np.load(sidecar) as cached:
+                if (np.array_equal(cached["signature"], signature)):
+                    return matrix_to_df(cached["prices"], cached["dates"], cached["labels"].tolist())
+        except (OSError, KeyError, ValueError):
+            pass # Unreadable sidecar, rebuild it
+    
+    from openpyxl import load_workbook
+    import magic_excel as me
+    workbook = load_workbook(filename, read_only = True)
+    sheet = workbook.active
+    if (sheet == None): exit()
+    rows = sheet.iter_rows(values_only = True)
+    header = next(rows, ())
+    
+    # Date columns run from F until the first empty header
+    end_column = len(me.HEADERS)
+    while (end_column < len(header) and header[end_column] != None): end_column += 1
+    dates = pd.to_datetime([str(value) for value in header[len(me.HEADERS):end_column]], format = "mixed").values.astype("datetime64[ns]")
+    
+    prices = np.full((max((sheet.max_row or 1) - 1, 0), len(dates)), np.nan)
+    labels = []
+    for row in rows:
+        if (len(row) == 0 or row[0] == None): break
+        if (len(labels) == prices.shape[0]): prices = np.vstack([prices, np.full((max(prices.shape[0], 64), len(dates)), np.nan)]) # Dimensions were understated or missing (write only workbooks)
         
-        end_column: int = 1
-        end_row: int = 1
-        while (sheet[f"{me.number_to_column(end_column + 1)}1"].value != None):
-            end_column += 1
-            
-        while (sheet[f"A{end_row + 1}"].value != None):
-            end_row += 1
-            
-        for row in range(2, end_row + 1):
-            card_name = sheet[f"A{row}"].value
-            card_num = sheet[f"B{row}"].value
-            card_set = sheet[f"C{row}"].value
-            card_foil = sheet[f"D{row}"].value
-            card_count = sheet[f"E{row}"].value
-            prices = {}
-            for col in range(6, end_column + 1):
-                col_letter = me.number_to_column(col)
-                date = str(sheet[f"{col_letter}1"].value)
-                price = sheet[f"{col_letter}{row}"].value
-                if (price != None): price = float(price)
-                prices[date] = price
-            
-            new_card = card_api.Card(card_name, card_num, card_set, card_foil, card_count, price_history = prices)
-            cards.append(new_card)
-            
-            
-    return cards
+        values = row[len(me.HEADERS):end_column]
+        prices[len(labels), :len(values)] = [np.nan if value == None else value for value in values]
+        labels.append(f"{row[0]} [{row[1]} {row[2]} {row[3]}]")
+    workbook.close()
+    prices = prices[:len(labels)].T.copy() # dates x cards, so every card is one contiguous column
+    
+    if (use_sidecar):
+        with open(sidecar, "wb") as file:
+            np.savez(file, signature = signature, prices = prices, dates = dates, labels = np.array(labels, dtype = str))
+    
+    return matrix_to_df(prices, dates, labels)
 
-def convert_to_df(cards: list[card_api.Card], drop_nan: bool = True) -> pd.DataFrame:
-    df = pd.DataFrame({
-        f"{card.name} [{card.collector_number} {card.set} {card.foiling}]": card.price_history for card in cards
-    })
+def matrix_to_df(prices: np.ndarray, dates: np.ndarray, labels: list[str]) -> pd.DataFrame:
+    import pandas as pd
+    return pd.DataFrame(prices, index = pd.DatetimeIndex(dates, name = "Date"), columns = labels, copy = False)
+
+def card_label(key: history_store.CardKey) -> str:
+    name, number, card_set, foiling = key
+    return f"{name} [{number} {card_set} {foiling}]"
+
+def get_price_history_store(directory: str) -> pd.DataFrame:
+    import pandas as pd
+    import history_store
+    store = history_store.HistoryStore(directory)
+    dates, prices, _ = store.load_matrix()
     
-    df.index = pd.to_datetime(df.index, format = "mixed")
+    df = pd.DataFrame(prices.T, index = pd.to_datetime(dates, format = "%Y-%m-%d"), columns = [card_label(key) for key in store.cards])
     df.index.name = "Date"
+    return df
+
+def new_history_prices(directory: str, last_date: str) -> list[tuple[str, pd.Series]]:
+    """(date, price per card label) of every partition written after last_date, oldest first"""
+    import pandas as pd
+    import history_store
+    store = history_store.HistoryStore(directory)
+    new_prices = []
+    for date in store.dates():
+        if (date <= last_date): continue
+        card_ids, prices, _ = store.read_partition(date)
+        new_prices.append((date, pd.Series(prices, index = [card_label(store.cards[card_id]) for card_id in card_ids.tolist()])))
+    return new_prices
+
+PAGE_SIZE = 40 # Rows of widgets in the table, the rest of the cards are paged through them
+HISTORY_POLL_SECONDS = 60 # How often the window looks for partitions written since it loaded the history store
+TABLE_COLUMNS = [
+    ("Card name", None),
+    ("Current price", "current"),
+    ("Highest price", "max"),
+    ("Lowest price", "min"),
+    ("Average price (all time)", "mean"),
+    ("Average price (1 week)", "mean_7d"),
+    ("Average price (30 days)", "mean_30d"),
+    ("Change", "change_pct"),
+    ("Volatility (30 days)", "volatility")
+]
+
+def format_price(value: float) -> str: return "-" if value != value else f"${value:,.2f}"
+
+def format_percent(value: float) -> str: return "-" if value != value else f"{value:+.1f}%"
+
+def format_stat(stat: str, value: float) -> str: return format_percent(value) if stat in ["change_pct", "volatility"] else format_price(value)
+
+def downsample_lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets: keeps the threshold points that best preserve the shape of the line"""
+    import numpy as np
+    n = len(x)
+    if (threshold >= n or threshold < 3): return x, y
     
-    if (drop_nan):
-        for card in df:
-            df[card].dropna()
+    every = (n - 2) / (threshold - 2)
+    sampled = np.empty(threshold, dtype = np.int64)
+    sampled[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third point of the triangle
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+        
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        areas = np.abs((x[a] - avg_x) * (y[range_start:range_end] - y[a]) - (x[a] - x[range_start:range_end]) * (avg_y - y[a]))
+        a = range_start + int(np.argmax(areas))
+        sampled[i + 1] = a
+    sampled[-1] = n - 1
+    
+    return x[sampled], y[sampled]
+
+class TableView:
+    """Sort, filter and page state for the card table, all done on the precomputed stats arrays.
+    Only the rows of the current page are ever turned into widget values"""
+    def __init__(self, table: pd.DataFrame, page_size: int = PAGE_SIZE) -> None:
+        import numpy as np
+        self.labels = np.array(table.index, dtype = str)
+        self.lower_labels = np.char.lower(self.labels)
+        self.stats = list(table.columns)
+        self.values = table.to_numpy(dtype = np.float64)
+        self.page_size = page_size
+        
+        self.included = np.zeros(len(self.labels), dtype = bool) # Cards added to the table
+        self.sort_stat: str | None = None
+        self.descending = False
+        self.filter_text = ""
+        self.filter_stat: str | None = None
+        self.filter_min = -np.inf
+        self.filter_max = np.inf
+        self.page = 0
+        self.order = np.zeros(0, dtype = np.int64)
+        self.refresh()
+    
+    def set_table(self, table: pd.DataFrame) -> None:
+        # New statistics for the same cards, plus any new ones at the end. Included cards, sort, filter and page are kept
+        import numpy as np
+        included = self.included
+        self.labels = np.array(table.index, dtype = str)
+        self.lower_labels = np.char.lower(self.labels)
+        self.values = table.to_numpy(dtype = np.float64)
+        self.included = np.zeros(len(self.labels), dtype = bool)
+        self.included[:len(included)] = included
+        self.refresh()
+    
+    def include(self, labels: list[str] | None = None) -> None:
+        # None adds every card
+        import numpy as np
+        if (labels == None): self.included[:] = True
+        else: self.included[np.isin(self.labels, labels)] = True
+        self.refresh()
+    
+    def refresh(self) -> None:
+        import numpy as np
+        mask = self.included.copy()
+        if (self.filter_text != ""): mask &= np.char.find(self.lower_labels, self.filter_text.lower()) >= 0
+        if (self.filter_stat != None):
+            column = self.values[:, self.stats.index(self.filter_stat)]
+            mask &= (column >= self.filter_min) & (column <= self.filter_max)
+        rows = np.nonzero(mask)[0]
+        
+        if (self.sort_stat == None): keys = self.labels[rows]
+        else:
+            keys = self.values[rows, self.stats.index(self.sort_stat)]
+            keys = np.where(np.isnan(keys), np.inf, -keys if self.descending else keys) # NaN always sorts last
+        order = np.argsort(keys, kind = "stable")
+        if (self.sort_stat == None and self.descending): order = order[::-1]
+        
+        self.order = rows[order]
+        self.page = min(self.page, self.page_count() - 1)
+    
+    def page_count(self) -> int: return max(1, -(-len(self.order) // self.page_size))
+    
+    def page_rows(self) -> np.ndarray: return self.order[self.page * self.page_size:(self.page + 1) * self.page_size]
+
+def main(history_dir: str = None):
+    import dearpygui.dearpygui as dpg
+    import numpy as np, pandas as pd
+    import history_store, stats
+    if (history_dir == None): history_dir = history_store.HISTORY_DIRECTORY
     
-    return df
-  
-def main():
     def callback_card_chosen(sender, data):
         logger.log_to_screen(f"Card chosen: {data}", "LOG")
         update_graph_table(data)
-
+    
     def update_graph_table(card_name):
-        # Get and set axis information
+        # Get and set axis information, downsampled to about one point per pixel of the plot
         card_series = cards_df[card_name].dropna()
-        x = (card_series.index.astype("int64") // 1e9).tolist()
-        y = card_series.values.tolist()
-        dpg.set_value("price_series", [x, y])
+        x = (card_series.index.astype("int64") // 10**9).to_numpy(dtype = np.float64)
+        y = card_series.to_numpy(dtype = np.float64)
+        plot_width = dpg.get_item_rect_size("history_plot")[0] or dpg.get_viewport_client_width() or 1280
+        x, y = downsample_lttb(x, y, int(plot_width))
+        dpg.set_value("price_series", [x.tolist(), y.tolist()])
         
         # Fit the axis
         dpg.fit_axis_data("x_axis")
-        y_max = max(y) if y else 1
+        y_max = y.max() if len(y) > 0 else 1
         dpg.set_axis_limits("y_axis", 0, y_max * 1.1)
         
-
-        # Update text
-        if (all_cards_added): 
-            logger.log_to_screen(f"{card_name} already added to table", "WARNING")
-            return
-        with dpg.table_row(parent = "recent_cards"):
-            dpg.add_text(f"{card_name}") # Card name
-            dpg.add_text(f"${y[-1]:,.2f}") # Current price
-            dpg.add_text(f"${max(y):,.2f}") # Highest price
-            dpg.add_text(f"${min(y):,.2f}") # Lowest price
-            dpg.add_text(f"${np.average(y):,.2f}") # Total average
-            dpg.add_text(f"${np.average(y[-7]):,.2f}") # Last week average
+        # Update table
+        table_view.include([card_name])
+        render_table()
+    
+    def render_table():
+        # Only the widgets of one page exist, refill them from the view
+        rows = table_view.page_rows()
+        for slot in range(PAGE_SIZE):
+            if (slot >= len(rows)):
+                dpg.configure_item(f"table_row_{slot}", show = False)
+                continue
             
-        added_cards.append(card_name)
-
+            row = rows[slot]
+            dpg.configure_item(f"table_row_{slot}", show = True)
+            dpg.configure_item(f"table_cell_{slot}_0", label = table_view.labels[row], user_data = table_view.labels[row])
+            for column, (_, stat) in enumerate(TABLE_COLUMNS[1:], start = 1):
+                dpg.set_value(f"table_cell_{slot}_{column}", format_stat(stat, table_view.values[row, table_view.stats.index(stat)]))
+        
+        dpg.set_value("table_page", f"Page {table_view.page + 1} of {table_view.page_count()} ({len(table_view.order)} cards)")
+    
     def callback_set_all_cards(sender, data):
-        # Check if already added all cards. If have, stop
-        nonlocal all_cards_added
-        if (all_cards_added):
-            logger.log_to_screen("Already added all cards to the table", "WARNING")
-            return
         logger.log_to_screen("Adding all cards to the table", "LOG")
+        table_view.include()
+        render_table()
+    
+    def callback_sort(sender, sort_specs):
+        # sort_specs is [[column id, direction]], direction is 1 for ascending and -1 for descending
+        if (sort_specs == None): return
+        column_id, direction = sort_specs[0]
+        table_view.sort_stat = dpg.get_item_user_data(column_id)
+        table_view.descending = direction < 0
+        table_view.refresh()
+        render_table()
+    
+    def callback_filter(sender, data):
+        table_view.filter_text = dpg.get_value("filter_text")
+        filter_stat = dpg.get_value("filter_stat")
+        table_view.filter_stat = None if filter_stat == "None" else dict((label, stat) for label, stat in TABLE_COLUMNS[1:])[filter_stat]
+        table_view.filter_min = dpg.get_value("filter_min")
+        table_view.filter_max = dpg.get_value("filter_max")
+        table_view.page = 0
+        table_view.refresh()
+        render_table()
+    
+    def callback_page(sender, data, step):
+        table_view.page = min(max(table_view.page + step, 0), table_view.page_count() - 1)
+        render_table()
+    
+    def callback_row_chosen(sender, data, card_name):
+        dpg.set_value(sender, False)
+        callback_card_chosen(sender, card_name)
+    
+    def check_for_new_prices():
+        # Partitions main.py wrote since the window opened are folded into the statistics one date at a time
+        nonlocal cards_df, last_date
+        new_prices = new_history_prices(history_dir, last_date)
+        if (len(new_prices) == 0): return
         
-        # Loop through already added cards, do not add ones already there
-        for card in cards_df:
-            if card in added_cards:
-                logger.log_to_screen(f"Already added {card}, skipping", "WARNING")
-            else:
-                with dpg.table_row(parent = "recent_cards"):
-                    dpg.add_text(f"{card}") # Card name
-                    dpg.add_text(f"${cards_df[card].dropna().iloc[-1]:,.2f}") # Current price
-                    dpg.add_text(f"${max(cards_df[card].dropna()):,.2f}") # Highest price
-                    dpg.add_text(f"${min(cards_df[card].dropna()):,.2f}") # Lowest price
-                    dpg.add_text(f"${np.average(cards_df[card].dropna()):,.2f}") # Total average
-                    try:
-                        # Try to get the 7 day average
-                        dpg.add_text(f"${np.average(cards_df[card].dropna().iloc[-7]):,.2f}") # Last week average
-                    except:
-                        # Fails (usually due to less than 7 days of data). Use normal average instead
-                        dpg.add_text(f"${np.average(cards_df[card].dropna()):,.2f}") # Last week average
+        for date, prices in new_prices:
+            price_stats.add_date(date, prices)
+            cards_df = pd.concat([cards_df, prices.to_frame(pd.Timestamp(date)).T])
+        cards_df.index.name = "Date"
+        last_date = new_prices[-1][0]
+        logger.log_to_screen(f"Added prices of {', '.join(date for date, _ in new_prices)}", "LOG")
         
-        # Set all_cards_added to True
-        all_cards_added = True
+        table_view.set_table(price_stats.table)
+        dpg.configure_item("card_combo", items = list(cards_df.keys()))
+        render_table()
     
-    # global all_cards_added # idk why i need to set this to global but no other variable
-    all_cards_added = False
     filename = "magic.xlsx"
-    logger.log_to_screen(f"File {filename} chosen", "LOG")
-    cards = get_price_history_excel(filename)
-    logger.log_to_screen(f"Retrieving prices from {filename}", "LOG")
-    cards_df = convert_to_df(cards)
+    last_date = None # Last partition loaded, None when the prices come from the workbook
+    if (history_dir and os.path.isdir(history_dir) and not history_store.HistoryStore(history_dir).is_empty()):
+        logger.log_to_screen(f"Retrieving prices from {history_dir}", "LOG")
+        cards_df = get_price_history_store(history_dir)
+        last_date = history_store.HistoryStore(history_dir).dates()[-1]
+    else:
+        logger.log_to_screen(f"File {filename} chosen", "LOG")
+        logger.log_to_screen(f"Retrieving prices from {filename}", "LOG")
+        cards_df = load_price_history(filename)
     cards_df = cards_df[sorted(cards_df.columns)]
     logger.log_to_screen(f"Converting cards to dataframe", "LOG")
-    added_cards = []
+    price_stats = stats.PriceStats(cards_df)
+    table_view = TableView(price_stats.table)
+    logger.log_to_screen(f"Computed statistics for {len(price_stats.labels)} cards", "LOG")
     
     
     # Create main window
     dpg.create_context()
     with dpg.window(tag = "main_window"):
         # Drop down menu for selecting a card
-        dpg.add_combo(label = "Cards", items = list(cards_df.keys()), callback = callback_card_chosen)
+        dpg.add_combo(label = "Cards", items = list(cards_df.keys()), callback = callback_card_chosen, tag = "card_combo")
         
         # Line graph for price history
-        with dpg.plot(label = "History", height = 800, width = -1):
+        with dpg.plot(label = "History", height = 600, width = -1, tag = "history_plot"):
             dpg.add_plot_axis(dpg.mvXAxis, label = "Date", tag = "x_axis", tick_format = "%Y-%m-%d", scale = dpg.mvPlotScale_Time)
             dpg.add_plot_axis(dpg.mvYAxis, label = "Price", tag = "y_axis", tick_format = "$%.2f")
             dpg.add_line_series([], [], label = "Price", parent = "y_axis", tag = "price_series")
         
         
-        # Table with all/recent cards
-        dpg.add_button(label = "Add all cards to table", callback = callback_set_all_cards)
-        with dpg.table(header_row = True, tag = "recent_cards", resizable = True, borders_innerH = True, borders_innerV = True, borders_outerH = True, borders_outerV = True, policy = dpg.mvTable_SizingFixedFit):
-            dpg.add_table_column(label = "Card name", width_stretch = True) # Card name
-            dpg.add_table_column(label = "Current price", width_stretch = True) # Current price
-            dpg.add_table_column(label = "Highest price", width_stretch = True) # Highest price
-            dpg.add_table_column(label = "Lowest price", width_stretch = True) # Lowest price
-            dpg.add_table_column(label = "Average price (all time)", width_stretch = True) # Total average
-            dpg.add_table_column(label = "Average price (1 week)", width_stretch = True) # Last week average
-
+        # Table controls
+        with dpg.group(horizontal = True):
+            dpg.add_button(label = "Add all cards to table", callback = callback_set_all_cards)
+            dpg.add_input_text(label = "Name", tag = "filter_text", width = 200, callback = callback_filter)
+            dpg.add_combo(label = "Filter by", tag = "filter_stat", items = ["None"] + [label for label, _ in TABLE_COLUMNS[1:]], default_value = "None", width = 200, callback = callback_filter)
+            dpg.add_input_float(label = "Min", tag = "filter_min", default_value = 0.0, width = 120, callback = callback_filter)
+            dpg.add_input_float(label = "Max", tag = "filter_max", default_value = 1e9, width = 120, callback = callback_filter)
+        with dpg.group(horizontal = True):
+            dpg.add_button(label = "<", callback = callback_page, user_data = -1)
+            dpg.add_button(label = ">", callback = callback_page, user_data = 1)
+            dpg.add_text("", tag = "table_page")
+        
+        # Table with all/recent cards, a fixed pool of rows that render_table refills
+        with dpg.table(header_row = True, tag = "recent_cards", resizable = True, sortable = True, callback = callback_sort, borders_innerH = True, borders_innerV = True, borders_outerH = True, borders_outerV = True, policy = dpg.mvTable_SizingFixedFit):
+            for label, stat in TABLE_COLUMNS:
+                dpg.add_table_column(label = label, width_stretch = True, user_data = stat)
+            
+            for slot in range(PAGE_SIZE):
+                with dpg.table_row(tag = f"table_row_{slot}", show = False):
+                    dpg.add_selectable(label = "", tag = f"table_cell_{slot}_0", span_columns = True, callback = callback_row_chosen)
+                    for column in range(1, len(TABLE_COLUMNS)):
+                        dpg.add_text("", tag = f"table_cell_{slot}_{column}")
+    render_table()
+    
     # Run that shit
     dpg.create_viewport(title = "Card Pricing History and Statistics", width = 1280, height = 1024) 
     dpg.setup_dearpygui()
     dpg.show_viewport()
     dpg.set_primary_window("main_window", True)
-    dpg.start_dearpygui()
+    last_check = perf_counter()
+    while (dpg.is_dearpygui_running()):
+        if (last_date != None and perf_counter() - last_check >= HISTORY_POLL_SECONDS):
+            last_check = perf_counter()
+            check_for_new_prices()
+        dpg.render_dearpygui_frame()
     dpg.destroy_context()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(prog = "Magic Card Prices", description = "Shows the price history of Magic cards")
+    parser.add_argument("--history_dir", default = None, help = "Price history store to read and watch for new prices, the one main.py writes to. Empty to read magic.xlsx. Default = history")
+    main(parser.parse_args().history_dir)
\ No newline at end of file
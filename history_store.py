@@ -0,0 +1,240 @@
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Iterable
+import card_api
+import json, os
+import numpy as np
+
+# openpyxl (through magic_excel) is only needed to import and export workbooks, runs that do neither skip loading it
+if (TYPE_CHECKING):
+    from openpyxl import Workbook
+
+HISTORY_DIRECTORY = "history"
+CARDS_FILENAME = "cards.jsonl"
+PARTITION_PREFIX = "prices-"
+
+CardKey = tuple[str, str, str, str] # (name, number, set, foiling)
+
+def card_key(card: card_api.Card) -> CardKey: return (card.name, str(card.collector_number), card.set, card.foiling)
+
+def price_column(currency: str = card_api.CURRENCY) -> str: return "price" if currency == card_api.CURRENCY else f"price_{currency}"
+
+def normalize_date(value) -> str:
+    # Date headers can come back from openpyxl as datetimes or as the strings export_excel wrote
+    if (isinstance(value, datetime)): return value.strftime("%Y-%m-%d")
+    return str(value).split(" ")[0]
+
+class HistoryStore:
+    """Append-only, long form price history. cards.jsonl is the card dictionary (card_id = line number),
+    and every run adds one prices-YYYY-MM-DD.npz partition holding (card_id, price, quantity) columns,
+    plus a price_<currency> column for every other currency that was captured. compaction.py rolls old days up into
+    weekly and monthly partitions that read like a day holding each card's last price"""
+    def __init__(self, directory: str = HISTORY_DIRECTORY) -> None:
+        self.directory = directory
+        self.cards: list[CardKey] = []
+        self.card_ids: dict[CardKey, int] = {}
+        self.unsaved: list[CardKey] = []
+        os.makedirs(self.directory, exist_ok = True)
+        
+        cards_filename = os.path.join(self.directory, CARDS_FILENAME)
+        if (os.path.exists(cards_filename)):
+            with open(cards_filename, "r", encoding = "utf-8") as file:
+                for line in file:
+                    if (line.strip() == ""): continue
+                    self.register(tuple(json.loads(line)))
+    
+    def register(self, key: CardKey) -> int:
+        if (key not in self.card_ids):
+            self.card_ids[key] = len(self.cards)
+            self.cards.append(key)
+        return self.card_ids[key]
+    
+    def get_card_id(self, key: CardKey) -> int:
+        # Unseen cards are added to the dictionary on disk by the next write_partition
+        if (key in self.card_ids): return self.card_ids[key]
+        self.unsaved.append(key)
+        return self.register(key)
+    
+    def save_cards(self) -> None:
+        if (len(self.unsaved) == 0): return
+        with open(os.path.join(self.directory, CARDS_FILENAME), "a", encoding = "utf-8") as file:
+            file.writelines(json.dumps(list(key)) + "\n" for key in self.unsaved)
+        self.unsaved = []
+    
+    def partition_filename(self, date: str) -> str: return os.path.join(self.directory, f"{PARTITION_PREFIX}{date}.npz")
+    
+    def dates(self) -> list[str]:
+        return sorted(name[len(PARTITION_PREFIX):-len(".npz")] for name in os.listdir(self.directory) if name.startswith(PARTITION_PREFIX) and name.endswith(".npz"))
+    
+    def is_empty(self) -> bool: return len(self.dates()) == 0
+    
+    def write_partition(self, date: str, card_ids: np.ndarray, prices: np.ndarray, quantities: np.ndarray, stale: np.ndarray | None = None, currency_prices: dict[str, np.ndarray] | None = None, extra_columns: dict[str, np.ndarray] | None = None) -> str:
+        # Written to a temporary file first so a crash never leaves a half written partition. extra_columns are written as they are (rollup statistics)
+        self.save_cards()
+        filename = self.partition_filename(date)
+        temp_filename = filename + ".tmp"
+        columns = {"card_id": card_ids.astype(np.int32), "price": prices.astype(np.float64), "quantity": quantities.astype(np.int32)}
+        if (stale is not None and stale.any()): columns["stale"] = stale.astype(bool) # Only written when some prices were carried forward
+        for currency, values in (currency_prices or {}).items(): columns[price_column(currency)] = values.astype(np.float64)
+        columns.update(extra_columns or {})
+        with open(temp_filename, "wb") as file:
+            np.savez(file, **columns)
+        os.replace(temp_filename, filename)
+        return filename
+    
+    def append(self, date: str, cards: Iterable[card_api.Card], merge: bool = False, currencies: list[str] | None = None) -> str:
+        """Writes the day's prices as one partition. Running twice on the same day replaces that day's partition,
+        unless merge is set, then the cards are added to it and keep the quantity (and the currencies they have no price in) already recorded for them.
+        currencies are other currencies to record from Card.currency_prices, NaN for cards that do not have them"""
+        currencies = [currency for currency in currencies or [] if currency != card_api.CURRENCY]
+        latest: dict[int, tuple[float, int, bool, tuple[float, ...]]] = {}
+        if (merge and os.path.exists(self.partition_filename(date))):
+            with np.load(self.partition_filename(date)) as partition:
+                # Currencies already recorded that day are kept, even if this call does not price them
+                currencies += [currency for currency in card_api.CURRENCIES if currency != card_api.CURRENCY and currency not in currencies and price_column(currency) in partition.files]
+                count = len(partition["card_id"])
+                stale = partition["stale"] if "stale" in partition.files else np.zeros(count, dtype = bool)
+                others = [partition[price_column(currency)] if price_column(currency) in partition.files else np.full(count, np.nan) for currency in currencies]
+                for card_id, price, quantity, is_stale, *other_prices in zip(partition["card_id"].tolist(), partition["price"].tolist(), partition["quantity"].tolist(), stale.tolist(), *(values.tolist() for values in others)):
+                    latest[card_id] = (price, quantity, is_stale, tuple(other_prices))
+        
+        nan = float("nan")
+        for card in cards:
+            card_id = self.get_card_id(card_key(card))
+            previous = latest.get(card_id) if merge else None
+            quantity = previous[1] if previous != None else card.quantity
+            # When merging, a currency the card was not priced in keeps the value already recorded
+            other_prices = tuple((previous[3][index] if previous != None else nan) if price == None else price for index, price in enumerate(card.price_in(currency) for currency in currencies))
+            latest[card_id] = (card.price, quantity, card.stale, other_prices)
+        
+        card_ids = np.fromiter(latest.keys(), dtype = np.int32, count = len(latest))
+        prices = np.fromiter((entry[0] for entry in latest.values()), dtype = np.float64, count = len(latest))
+        quantities = np.fromiter((entry[1] for entry in latest.values()), dtype = np.int32, count = len(latest))
+        stale = np.fromiter((entry[2] for entry in latest.values()), dtype = bool, count = len(latest))
+        currency_prices = {currency: np.fromiter((entry[3][index] for entry in latest.values()), dtype = np.float64, count = len(latest)) for index, currency in enumerate(currencies)}
+        return self.write_partition(date, card_ids, prices, quantities, stale, currency_prices)
+    
+    def read_partition(self, date: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with np.load(self.partition_filename(date)) as partition:
+            return partition["card_id"], partition["price"], partition["quantity"]
+    
+    def load_stale(self, dates: list[str]) -> np.ndarray:
+        """cards x dates mask of the prices that were carried forward instead of refreshed"""
+        stale = np.zeros((len(self.cards), len(dates)), dtype = bool)
+        for column, date in enumerate(dates):
+            with np.load(self.partition_filename(date)) as partition:
+                if ("stale" in partition.files): stale[partition["card_id"], column] = partition["stale"]
+        return stale
+    
+    def load_matrix(self, dates: list[str] | None = None, currency: str = card_api.CURRENCY) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """Returns (dates, prices, quantities). prices is a cards x dates float64 matrix with NaN where a card had no price
+        in the currency, quantities holds each card's most recent quantity"""
+        if (dates == None): dates = self.dates()
+        prices = np.full((len(self.cards), len(dates)), np.nan)
+        quantities = np.zeros(len(self.cards), dtype = np.int32)
+        
+        for column, date in enumerate(dates):
+            with np.load(self.partition_filename(date)) as partition:
+                card_ids = partition["card_id"]
+                if (price_column(currency) in partition.files): prices[card_ids, column] = partition[price_column(currency)]
+                quantities[card_ids] = partition["quantity"]
+        
+        return dates, prices, quantities
+    
+    def import_workbook(self, filename: str) -> int:
+        """One time import of an existing price workbook (one row per card, one column per date). Returns the number of dates imported"""
+        from openpyxl import load_workbook
+        import magic_excel as me
+        workbook = load_workbook(filename, read_only = True)
+        sheet = workbook.active
+        rows = sheet.iter_rows(values_only = True)
+        header = next(rows, ())
+        date_columns = [(column, normalize_date(value)) for column, value in enumerate(header) if column >= len(me.HEADERS) and value != None]
+        
+        partitions: dict[str, dict[int, tuple[float, int]]] = {date: {} for _, date in date_columns}
+        for row in rows:
+            if (len(row) < len(me.HEADERS) or all(value == None for value in row[:4])): break
+            card_id = self.get_card_id((row[0], str(row[1]), row[2], row[3]))
+            quantity = int(row[4] or 0)
+            for column, date in date_columns:
+                if (column < len(row) and row[column] != None): partitions[date][card_id] = (float(row[column]), quantity)
+        workbook.close()
+        
+        for date, entries in partitions.items():
+            if (len(entries) == 0): continue
+            card_ids = np.fromiter(entries.keys(), dtype = np.int32, count = len(entries))
+            prices = np.fromiter((price for price, _ in entries.values()), dtype = np.float64, count = len(entries))
+            quantities = np.fromiter((quantity for _, quantity in entries.values()), dtype = np.int32, count = len(entries))
+            self.write_partition(date, card_ids, prices, quantities)
+        
+        return len(partitions)
+    
+    def export_workbook(self, filename: str, sheet_name: str = "Sheet", add_sheets: Callable[["Workbook"], None] | None = None, currencies: list[str] | None = None) -> None:
+        """Generates the price workbook from the store, streaming it out with a write only workbook. add_sheets can append more sheets after the prices.
+        Every other currency in currencies gets a sheet of its own after the main one"""
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        import magic_excel as me
+        dates = self.dates()
+        stale = self.load_stale(dates)
+        workbook = Workbook(write_only = True)
+        other_currencies = [currency for currency in currencies or [] if currency != card_api.CURRENCY]
+        
+        for currency in [card_api.CURRENCY] + other_currencies:
+            _, prices, quantities = self.load_matrix(dates, currency)
+            sheet = workbook.create_sheet(sheet_name if currency == card_api.CURRENCY else f"{sheet_name} {currency.upper()}")
+            number_format = me.price_format(currency)
+            
+            # Column widths have to be set before the first row is written
+            for column, values in enumerate(zip(*self.cards) if len(self.cards) > 0 else [], start = 1):
+                sheet.column_dimensions[me.number_to_column(column)].width = max(len(str(value)) for value in values + (me.HEADERS[column - 1],)) + 2
+            for column in range(len(me.HEADERS) + 1, len(me.HEADERS) + len(dates) + 1):
+                sheet.column_dimensions[me.number_to_column(column)].width = 12
+            
+            header = []
+            for value in me.HEADERS + dates:
+                cell = WriteOnlyCell(sheet, value = value)
+                cell.fill = me.HEADER_FILL
+                cell.border = me.HEADER_BORDER
+                cell.font = me.HEADER_FONT
+                cell.alignment = me.CENTER_ALIGN
+                header.append(cell)
+            sheet.append(header)
+            
+            for card_id, key in enumerate(self.cards):
+                row: list = []
+                for value in [*key, int(quantities[card_id])]:
+                    cell = WriteOnlyCell(sheet, value = value)
+                    cell.alignment = me.CENTER_ALIGN
+                    row.append(cell)
+                
+                for price, is_stale in zip(prices[card_id].tolist(), stale[card_id].tolist()):
+                    if (price != price): # NaN, no price that day
+                        row.append(None)
+                        continue
+                    cell = WriteOnlyCell(sheet, value = price)
+                    cell.number_format = number_format
+                    cell.alignment = me.CENTER_ALIGN
+                    if (is_stale): cell.font = me.STALE_FONT
+                    row.append(cell)
+                sheet.append(row)
+        
+        if (add_sheets != None): add_sheets(workbook)
+        # Saved next to the old workbook and swapped in, so a failed export never leaves a truncated file
+        temp_filename = filename + ".tmp"
+        try: workbook.save(temp_filename)
+        except BaseException:
+            if (os.path.exists(temp_filename)): os.remove(temp_filename)
+            raise
+        os.replace(temp_filename, filename)
+
+
+if __name__ == "__main__":
+    import sys
+    
+    if (len(sys.argv) < 3 or sys.argv[1] != "import"):
+        print("Usage: python history_store.py import <workbook.xlsx> [history directory]")
+        exit()
+    
+    store = HistoryStore(sys.argv[3] if len(sys.argv) > 3 else HISTORY_DIRECTORY)
+    imported = store.import_workbook(sys.argv[2])
+    print(f"Imported {imported} dates for {len(store.cards)} cards into {store.directory}")
@@ -1,3 +1,11 @@
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+from typing import Iterable, Iterator, TypeVar
+import atexit, json, queue, threading
+
+T = TypeVar("T")
+
 class Color:
     BOLD = "\x1b[1m"
     DIM = "\x1b[2m"
@@ -32,13 +40,118 @@ level_colors = {
     "": "" # For no coloring
 }
 
-def log(message: str, level: str, filename: str, allow_file: bool = True, allow_screen: bool = True) -> None:
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000] # Upper bounds, anything slower goes in the last "+inf" bucket
+FLUSH_LINES = 256 # Most lines written per write() call
+
+def log(message: str, level: str, filename: str, allow_file: bool = True, allow_screen: bool = True, *args) -> None:
+    """message is a %-style format string for args, only formatted when it is logged somewhere"""
+    if (not allow_file and not allow_screen): return
+    if (len(args) > 0): message = message % args
     if (allow_file): log_to_file(message, level, filename)
     if (allow_screen): log_to_screen(message, level)
 
 def log_to_file(message: str, level: str, filename: str) -> None:
-    print(f"{level}: {message} [to {filename}]")
+    record = {"time": datetime.now().isoformat(timespec = "milliseconds"), "level": level, "message": message}
+    file_writer(filename).write(json.dumps(record))
     
 def log_to_screen(message: str, level: str) -> None:
     print(f"{level_colors[level]}{level}: {Color.RESET}{message}")
+
+class FileWriter:
+    """Appends lines to a file from a background thread, so logging never waits on the disk"""
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.lines: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target = self.run, name = f"log-writer-{filename}", daemon = True)
+        self.thread.start()
+    
+    def write(self, line: str) -> None: self.lines.put(line)
+    
+    def run(self) -> None:
+        with open(self.filename, "a", encoding = "utf-8") as file:
+            while True:
+                batch = [self.lines.get()]
+                while (len(batch) < FLUSH_LINES and not self.lines.empty()): batch.append(self.lines.get())
+                
+                done = batch[-1] is None
+                file.writelines(line + "\n" for line in batch if line is not None)
+                file.flush()
+                if (done): return
+    
+    def close(self) -> None:
+        self.lines.put(None)
+        self.thread.join()
+
+file_writers: dict[str, FileWriter] = {}
+file_writers_lock = threading.Lock()
+
+def file_writer(filename: str) -> FileWriter:
+    with file_writers_lock:
+        if (filename not in file_writers): file_writers[filename] = FileWriter(filename)
+        return file_writers[filename]
+
+@atexit.register
+def close_files() -> None:
+    with file_writers_lock:
+        for writer in file_writers.values(): writer.close()
+        file_writers.clear()
+
+class Metrics:
+    """Timing spans, counters and an API latency histogram for one run, safe to update from any thread"""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.start_time = perf_counter()
+        self.spans: dict[str, list[float]] = {} # name -> [count, total seconds, max seconds]
+        self.counters: dict[str, int] = {}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    
+    def count(self, name: str, amount: int = 1) -> None:
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def add_time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            span = self.spans.setdefault(name, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+    
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try: yield
+        finally: self.add_time(name, perf_counter() - start)
     
+    def timed(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        # Times only the work done inside items, not the consumer's work between items
+        iterator = iter(items)
+        while True:
+            start = perf_counter()
+            try: item = next(iterator)
+            except StopIteration: return
+            finally: self.add_time(name, perf_counter() - start)
+            yield item
+    
+    def observe_latency(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        bucket = next((index for index, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound), len(LATENCY_BUCKETS_MS))
+        with self.lock: self.latency_buckets[bucket] += 1
+    
+    def summary(self) -> dict:
+        with self.lock:
+            hits, misses = self.counters.get("cache_hits", 0), self.counters.get("cache_misses", 0)
+            return {
+                "started": self.started.isoformat(timespec = "seconds"),
+                "duration_s": round(perf_counter() - self.start_time, 3),
+                "spans": {name: {"count": count, "total_s": round(total, 4), "mean_ms": round(total / count * 1000, 3), "max_ms": round(longest * 1000, 3)} for name, (count, total, longest) in self.spans.items()},
+                "counters": dict(self.counters),
+                "cache_hit_rate": round(hits / (hits + misses), 4) if hits + misses > 0 else None,
+                "api_latency_ms": {f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.latency_buckets)} | {"+inf": self.latency_buckets[-1]}
+            }
+    
+    def write_summary(self, filename: str) -> dict:
+        summary = self.summary()
+        with open(filename, "w", encoding = "utf-8") as file: json.dump(summary, file, indent = 2)
+        return summary
+
+metrics = Metrics() # The current run's metrics, shared by every module
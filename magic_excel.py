@@ -2,13 +2,31 @@ import card_api
 import string
 from openpyxl import load_workbook, Workbook
 from dataclasses import dataclass
+from openpyxl.styles import Alignment, PatternFill, Border, Side, Font
 from openpyxl.worksheet.worksheet import Worksheet
 
+HEADERS = ["Name", "Number", "Set", "Foiling", "Quantity"]
+PRICE_FORMAT = '"$"#,##0.00'
+
+def price_format(currency: str = card_api.CURRENCY) -> str: return f'"{card_api.currency_symbols[currency]}"#,##0.00'
+
+# Shared style objects, every styled cell points at the same instances
+CENTER_ALIGN = Alignment(horizontal = "center", vertical = "center")
+HEADER_FILL = PatternFill(start_color = "A5A5A5", end_color = "A5A5A5", fill_type = "solid")
+HEADER_FONT = Font(name = "Calibri", size = 11, bold = True, color = "FFFFFFFF")
+STALE_FONT = Font(name = "Calibri", size = 11, italic = True, color = "FF808080") # Prices carried forward instead of refreshed
+HEADER_BORDER = Border(
+    left = Side(border_style = "thin", color = "000000"),
+    right = Side(border_style = "thin", color = "000000"),
+    top = Side(border_style = "double", color = "000000"),
+    bottom = Side(border_style = "double", color = "000000")
+)
+
 @dataclass
 class ExcelManager():
     filename: str
     mode: str
-        
+    
     def __enter__(self):
         try:
             self.file = load_workbook(self.filename)
@@ -19,7 +37,8 @@ class ExcelManager():
         return self.file
     
     def __exit__(self, exc_type, exc_value, traceback):
-        if ("w" in self.mode or "a" in self.mode):
+        # A failed export leaves the file as it was, it is only saved once everything was written
+        if (exc_type == None and ("w" in self.mode or "a" in self.mode)):
             try:
                 self.file.save(self.filename)
             except PermissionError:
@@ -44,29 +63,37 @@ def column_to_number(col: str) -> int:
         num += pow(26, index) * (string.ascii_uppercase.index(letter) + 1)
     return num
 
-def get_first_empty_column(sheet) -> str:
-    col_num = 1
-    while (sheet[f"{number_to_column(col_num)}1"].value != None):
-        col_num += 1
-    
-    return number_to_column(col_num)
-
-def find_card_in_sheet(card: card_api.Card, sheet: Worksheet) -> int:
-    index = 2
-    sheet_card = (sheet[f"A{index}"].value, sheet[f"B{index}"].value, sheet[f"C{index}"].value, sheet[f"D{index}"].value)
-    card_tuple = (card.name, card.collector_number, card.set, card.foiling)
+class SheetIndex:
+    """Row lookup for a price sheet, built in one pass instead of scanning the sheet for every card.
+    Maps (name, number, set, foiling) to its row, and tracks the next free row and column"""
+    def __init__(self, sheet: Worksheet) -> None:
+        self.rows: dict[tuple, int] = {}
+        self.next_row = 2
+        self.next_column = 1
+        
+        rows = sheet.iter_rows(values_only = True)
+        header = next(rows, ())
+        while (self.next_column <= len(header) and header[self.next_column - 1] != None):
+            self.next_column += 1
+        
+        for row_number, row in enumerate(rows, start = 2):
+            key = tuple(row[:4]) + (None,) * (4 - len(row[:4]))
+            if (all(val == None for val in key)): break # The first empty row ends the table
+            self.rows.setdefault(key, row_number)
+            self.next_row = row_number + 1
     
-    while True:
-        sheet_card = (sheet[f"A{index}"].value, sheet[f"B{index}"].value, sheet[f"C{index}"].value, sheet[f"D{index}"].value)
-        if (sheet_card == card_tuple or all(val == None for val in sheet_card)): return index
-        index += 1
-
-def compare_tuples(tup1: tuple, tup2: tuple) -> bool:
-    if (len(tup1) != len(tup2)): return False
+    def find_card(self, card: card_api.Card) -> int:
+        # Returns the card's row, giving it the next free row if it is not in the sheet yet
+        card_tuple = (card.name, card.collector_number, card.set, card.foiling)
+        if (card_tuple not in self.rows):
+            self.rows[card_tuple] = self.next_row
+            self.next_row += 1
+        return self.rows[card_tuple]
     
-    for index in range(len(tup1)):
-        if (tup1[index] != tup2[index]): return False
-    return True
+    def claim_column(self) -> str:
+        column = number_to_column(self.next_column)
+        self.next_column += 1
+        return column
 
 def set_column_width(sheet: Worksheet, column: str) -> None:
     max_len = 0
@@ -77,4 +104,84 @@ def set_column_width(sheet: Worksheet, column: str) -> None:
         except:
             continue
         
-        sheet.column_dimensions[column].width = max_len + 2
\ No newline at end of file
+        sheet.column_dimensions[column].width = max_len + 2
+
+def style_header(sheet: Worksheet, column: str) -> None:
+    cell = sheet[f"{column}1"]
+    cell.fill = HEADER_FILL
+    cell.border = HEADER_BORDER
+    cell.font = HEADER_FONT
+    cell.alignment = CENTER_ALIGN
+
+def widen_column(sheet: Worksheet, column: str, max_len: int) -> None:
+    # Like set_column_width, but from the longest value written instead of rescanning the column
+    current = sheet.column_dimensions[column].width or 0
+    if (max_len + 2 > current): sheet.column_dimensions[column].width = max_len + 2
+
+class PriceColumnWriter:
+    """Writes prices into a new date column batch by batch, adding rows for new cards.
+    When incremental, only the new column and new rows are styled, otherwise every cell of the sheet is restyled in finish()"""
+    def __init__(self, sheet: Worksheet, date: str, incremental: bool = True, currency: str = card_api.CURRENCY) -> None:
+        self.sheet = sheet
+        self.date = date
+        self.incremental = incremental
+        self.currency = currency
+        self.number_format = price_format(currency)
+        for col_num, header in enumerate(HEADERS, start = 1): sheet[f"{number_to_column(col_num)}1"] = header
+        
+        self.sheet_index = SheetIndex(sheet)
+        self.column = self.sheet_index.claim_column()
+        self.first_new_row = self.sheet_index.next_row
+        sheet[f"{self.column}1"] = date
+        sheet[f"{self.column}1"].number_format = "YYYY-MM-DD"
+        
+        # Longest value written per column, so widths never need a rescan
+        self.max_lens: dict[str, int] = {number_to_column(col_num): len(header) for col_num, header in enumerate(HEADERS, start = 1)}
+        self.max_lens[self.column] = len(date)
+        self.cards_written = 0
+    
+    def write(self, cards: list[card_api.Card]) -> None:
+        sheet = self.sheet
+        for card in cards:
+            card_row = self.sheet_index.find_card(card)
+            card_values = [card.name, card.collector_number, card.set, card.foiling, card.quantity]
+            
+            if (card_row >= self.first_new_row):
+                for col_num, value in enumerate(card_values, start = 1):
+                    cell = sheet.cell(row = card_row, column = col_num, value = value)
+                    if (self.incremental): cell.alignment = CENTER_ALIGN
+                    column = number_to_column(col_num)
+                    self.max_lens[column] = max(self.max_lens[column], len(str(value)))
+            else: sheet.cell(row = card_row, column = len(HEADERS), value = card.quantity) # Quantity can change
+            
+            price = card.price_in(self.currency)
+            if (price == None): continue # Only cached in the main currency, left empty
+            cell = sheet[f"{self.column}{card_row}"]
+            cell.value = price
+            cell.number_format = self.number_format
+            if (self.incremental): cell.alignment = CENTER_ALIGN
+            if (card.stale): cell.font = STALE_FONT
+            self.max_lens[self.column] = max(self.max_lens[self.column], len(f"{card_api.currency_symbols[self.currency]}{price:,.2f}"))
+        self.cards_written += len(cards)
+    
+    def finish(self) -> str:
+        sheet = self.sheet
+        if (self.incremental):
+            for column, max_len in self.max_lens.items(): widen_column(sheet, column, max_len)
+        else:
+            # Center align all of the cells
+            for row in sheet.iter_rows():
+                for cell in row:
+                    cell.alignment = CENTER_ALIGN
+            for column in self.max_lens: set_column_width(sheet, column)
+        
+        # Fix the style of the headers that can/did change
+        for column in self.max_lens: style_header(sheet, column)
+        
+        return self.column
+
+def write_price_column(sheet: Worksheet, cards: list[card_api.Card], date: str, incremental: bool = True) -> str:
+    """Writes the cards' prices into a new date column, adding rows for new cards. Returns the new column's letter"""
+    column_writer = PriceColumnWriter(sheet, date, incremental)
+    column_writer.write(cards)
+    return column_writer.finish()
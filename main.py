@@ -1,279 +1,502 @@
-import card_api, logger, magic_excel as me
-import pyodbc, argparse
-from os import getcwd
+from __future__ import annotations
+import card_api, card_sources, fetcher, logger, pipeline, price_cache, scryfall_bulk, argparse, json
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+from os import path
 from datetime import datetime
-from openpyxl.styles import Alignment
-from openpyxl.styles import PatternFill, Border, Side, Font
-from os import system
-system("")
+from time import monotonic, perf_counter, sleep
 
-parser = argparse.ArgumentParser(prog = "Magic Card Pricing", description = "Logs the prices of Magic cards")
-parser.add_argument("--dont_read_cache", action = "store_false", default = True, help = "Do not read from prices.cache")
-parser.add_argument("--dont_write_cache", action = "store_false", default = True, help = "Do not write to prices.cache")
-parser.add_argument("-l", "--log", action = "store_true", default = False, help = "Log events to the log file. NOT IMPLEMENTED YET")
-parser.add_argument("-v", "--verbose", action = "store_true", default = False, help = "Print debug information to the screen")
-parser.add_argument("-p", "--print_cards", action = "store_true", default = False, help = "Print the cards to screen as the price is found")
-parser.add_argument("-V", "--validate", action = "store_true", default = False, help = "Validate the card names. Writes mismatches to validate.txt")
-parser.add_argument("-Vo", "--validate_only", action = "store_true", default = False, help = "Same as --validate, but does not continue after validating")
-parser.add_argument("--sql", default = "SELECT * FROM Cards", help = "Use a custom SQL query. Default is 'SELECT * FROM Cards'")
-parser.add_argument("--log_file", default = "magic.log", help = "The log file's name. NOT YET IMPLEMENTED")
-parser.add_argument("--database", default = "Magic.accdb", help = "The database file's read from. Allows for .accdb, .csv, and .xlsx (last two not implemented yet)")
-parser.add_argument("--strict_mode", action = "store_true", default = False, help = "When used with --validate, acts as --validate_only")
-parser.add_argument("--clear_cache", action = "store_true", default = False, help = "Clear the cache before starting")
-parser.add_argument("--excel_filename", default = "magic.xlsx", help = "The filename for the exported Excel spreadsheet. Default = 'magic.xlsx'")
-parser.add_argument("-E", "--dont_export", action = "store_true", default = False, help = "Don't export to Excel")
-parser.add_argument("--keep_open", action = "store_true", default = False, help = "Keep program open at the end")
+# The history store, analytics, exports and openpyxl are imported by the stages that use them, so quick runs
+# (--validate_only, a small --sql slice) do not pay for numpy and openpyxl at startup
+if (TYPE_CHECKING):
+    import history_store, refresh
 
-args = parser.parse_args()
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog = "Magic Card Pricing", description = "Logs the prices of Magic cards")
+    parser.add_argument("--dont_read_cache", action = "store_false", default = True, help = "Do not read from the price cache")
+    parser.add_argument("--dont_write_cache", action = "store_false", default = True, help = "Do not write to the price cache")
+    parser.add_argument("--cache_backend", choices = price_cache.CACHE_BACKENDS, default = "sqlite", help = "Where cached prices are kept: 'sqlite' (prices.db, default) or 'text' (the old prices.cache)")
+    parser.add_argument("--cache_ttl_hours", type = float, default = price_cache.DEFAULT_TTL_SECONDS / 60 / 60, help = "How long a cached price stays valid with the sqlite backend. Default = 24")
+    parser.add_argument("-l", "--log", action = "store_true", default = False, help = "Log events to the log file, as JSON lines")
+    parser.add_argument("-v", "--verbose", action = "store_true", default = False, help = "Print debug information to the screen")
+    parser.add_argument("-p", "--print_cards", action = "store_true", default = False, help = "Print the cards to screen as the price is found")
+    parser.add_argument("-V", "--validate", action = "store_true", default = False, help = "Validate the card names. Writes mismatches to validate.txt")
+    parser.add_argument("-Vo", "--validate_only", action = "store_true", default = False, help = "Same as --validate, but does not continue after validating")
+    parser.add_argument("--sql", default = "SELECT * FROM Cards", help = "Use a custom SQL query for Access and SQLite collections. Default is 'SELECT * FROM Cards'")
+    parser.add_argument("--log_file", default = "magic.log", help = "The log file's name. Default = 'magic.log'")
+    parser.add_argument("--currencies", nargs = "+", choices = card_api.CURRENCIES, default = [card_api.CURRENCY], help = f"Currencies to record, each gets its own sheet and history series. They all come from the same responses and cache rows. Default = {card_api.CURRENCY}")
+    parser.add_argument("--report_file", default = "portfolio_report.json", help = "Where the JSON portfolio report (value over time, by set and finish, top movers) is written. It is also added to the workbook as a Summary sheet. Use '' to skip it. Default = 'portfolio_report.json'")
+    parser.add_argument("--summary_file", default = "run_summary.json", help = "Where the JSON run summary (stage timings, cache hit rate, API calls and latency) is written. Use '' to skip it")
+    parser.add_argument("--database", default = "Magic.accdb", help = "The collection file cards are read from. Allows for .accdb/.mdb (Access, Windows only), .csv, .xlsx, and .db/.sqlite (SQLite)")
+    parser.add_argument("--source_type", choices = card_sources.SOURCE_TYPES, default = "", help = "Read --database as this type instead of going by its extension")
+    parser.add_argument("--strict_mode", action = "store_true", default = False, help = "When used with --validate, acts as --validate_only")
+    parser.add_argument("--clear_cache", action = "store_true", default = False, help = "Clear the cache before starting")
+    parser.add_argument("--excel_filename", default = "magic.xlsx", help = "The filename for the exported Excel spreadsheet. Other export formats use it with their own extension. Default = 'magic.xlsx'")
+    parser.add_argument("--export_format", choices = ["xlsx", "csv", "parquet"], default = "xlsx", help = "'xlsx' (default) exports the workbook. 'csv' and 'parquet' stream today's prices straight to a snapshot file instead, much faster for large collections. 'parquet' needs the optional pyarrow package (pip install pyarrow), it is not in requirements.txt")
+    parser.add_argument("--pivot", action = "store_true", default = False, help = "With --export_format csv or parquet, also write the whole history with one column per date to <excel_filename>-history.<format>")
+    parser.add_argument("-E", "--dont_export", action = "store_true", default = False, help = "Don't export to Excel (or the --export_format file)")
+    parser.add_argument("--history_dir", default = "history", help = "Directory of the price history store. The Excel file is regenerated from it on every run, which is slower than updating it in place but keeps it in sync with the store. Use '' to update the Excel file in place instead")
+    parser.add_argument("--compact", action = "store_true", default = False, help = "Roll history older than --daily_days into one column per week, and past a year per month (last price on the price sheet, min/max/mean on a Rollups sheet). The raw days are archived in the history directory")
+    parser.add_argument("--daily_days", type = int, default = 90, help = "With --compact, the days kept at daily resolution. Default = 90")
+    parser.add_argument("--restyle_all", action = "store_true", default = False, help = "Restyle every cell of the sheet when exporting instead of only the new column and rows (slow on large workbooks)")
+    parser.add_argument("--tiered_refresh", action = "store_true", default = False, help = "Refresh expensive or volatile cards often and cheap, stable ones rarely instead of every card every day (sqlite cache only)")
+    parser.add_argument("--request_budget", type = int, default = 0, help = "With --tiered_refresh, the most /cards/collection requests to make this run. Other expired cards keep their last price, marked stale. Default = 0 (no limit)")
+    parser.add_argument("--shared_cache", action = "store_true", default = False, help = "Other processes use the same sqlite cache at the same time (runner.py). Printings are claimed before fetching so each is fetched once")
+    parser.add_argument("--rate_limit_file", default = "", help = "Share the API rate limit with every process using this file (runner.py)")
+    parser.add_argument("--keep_open", action = "store_true", default = False, help = "Keep program open at the end")
+    parser.add_argument("--bulk_file", default = "", help = "Price offline against a Scryfall default_cards bulk data file instead of calling the API")
+    parser.add_argument("--workers", type = int, default = card_api.MAX_WORKERS, help = f"Number of API requests in flight at once. Default = {card_api.MAX_WORKERS}")
+    return parser
 
-def get_cards_from_access_database(filename: str, sql: str = "", autocall_api: bool = False) -> list[card_api.Card]:
-    if (sql == ""): sql = "SELECT * FROM Cards"
-    
-    # Connect to database
-    try:
-        encoding = "latin-1"
-        directory = getcwd() + "\\"
-        driverStr = r'Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ='
-        cnxn = pyodbc.connect(driverStr + directory + filename + ";")
-        logger.log(f"Connection to {filename} opened", "LOG", args.log_file, args.log, args.verbose)
-        cursor = cnxn.cursor()
-        cnxn.setdecoding(pyodbc.SQL_CHAR, encoding=encoding)
-        cnxn.setdecoding(pyodbc.SQL_WCHAR, encoding=encoding)
-        cnxn.setencoding(encoding=encoding)
-    except Exception as err:
-        print(err)
-        return []
-    
-    # Read the database
-    
-    try: cursor.execute(sql)
-    except Exception as err: cursor.execute("SELECT * FROM Cards")
+def default_config(**options) -> argparse.Namespace:
+    """main's options for library use: the command line defaults, with options overriding them by name, e.g. default_config(database = "Trades.csv")"""
+    config = build_parser().parse_args([])
+    for name, value in options.items():
+        if (not hasattr(config, name)): raise TypeError(f"Unknown option {name}")
+        setattr(config, name, value)
+    return config
+
+CLAIM_WAIT_SECONDS = 120
+CLAIM_POLL_SECONDS = 0.25
+
+def iter_cards(config: argparse.Namespace, filename: str, sql: str = "", autocall_api: bool = False, source_type: str = "") -> Iterator[card_api.Card]:
+    """Opens the collection straight away, raising ValueError for an unknown type and OSError for a missing file or one
+    that cannot be opened, so a bad --database fails before any stage starts. The cards are read as the iterator is consumed"""
+    source = card_sources.open_source(filename, sql, source_type)
+    if (not path.exists(filename)): raise FileNotFoundError(f"Collection {filename} not found")
+    source.open()
     
-    logger.log(f"Fetching cards using {sql}", "LOG", args.log_file, args.log, args.verbose)
-    rows = cursor.fetchall()
-    logger.log(f"Found {len(rows)} cards", "LOG", args.log_file, args.log, args.verbose)
-    card_list = []
+    logger.log("Reading cards from %s (%s)", "LOG", config.log_file, config.log, config.verbose, filename, type(source).__name__)
+    return read_cards(config, source, filename, autocall_api)
+
+def read_cards(config: argparse.Namespace, source: card_sources.CardSource, filename: str, autocall_api: bool = False) -> Iterator[card_api.Card]:
+    try: yield from logger.metrics.timed("db_read", source.cards(autocall_api))
+    finally: logger.log("Found %s cards in %s", "LOG", config.log_file, config.log, config.verbose, source.cards_found, filename)
+
+def get_cards(config: argparse.Namespace, filename: str, sql: str = "", autocall_api: bool = False, source_type: str = "") -> list[card_api.Card]:
+    return list(iter_cards(config, filename, sql, autocall_api, source_type))
+
+def open_cache(config: argparse.Namespace) -> price_cache.TextCache | price_cache.SQLiteCache:
+    cache = price_cache.open_cache(config.cache_backend, config.cache_ttl_hours * 60 * 60)
+    logger.log("Cache file %s opened (%s)", "LOG", config.log_file, config.log, config.verbose, cache.filename, config.cache_backend)
+    return cache
+
+def open_scheduler(config: argparse.Namespace, cache: price_cache.TextCache | price_cache.SQLiteCache) -> refresh.RefreshScheduler | None:
+    if (not config.tiered_refresh): return None
+    if (not isinstance(cache, price_cache.SQLiteCache)):
+        logger.log("Tiered refresh needs the sqlite cache backend, refreshing everything", "WARNING", config.log_file, config.log, config.verbose)
+        return None
     
-    # Create the card objects
-    for temp_card in rows:
-        card_name = temp_card[0]
-        card_cn = temp_card[1]
-        card_set = temp_card[2]
-        card_foil = temp_card[3].lower()
-        card_quantity = int(temp_card[4])
+    import history_store, refresh
+    volatility = {}
+    if (config.history_dir != "" and path.isdir(config.history_dir)): volatility = refresh.history_volatility(history_store.HistoryStore(config.history_dir))
+    expired = cache.load_expired()
+    logger.log("Tiered refresh: %s expired cache entries, volatility for %s cards, budget %s", "LOG", config.log_file, config.log, config.verbose, expired, len(volatility), config.request_budget or 'unlimited')
+    return refresh.RefreshScheduler(config.request_budget, volatility)
+
+def price_cards(config: argparse.Namespace, cards: list[card_api.Card], cache: price_cache.TextCache | price_cache.SQLiteCache, scheduler: refresh.RefreshScheduler | None = None) -> None:
+    # Prices the cards from the cache, fetching the cache misses (or the ones the scheduler picks)
+    cache_misses: list[card_api.Card] = []
+    for card in cards:
+        cached_price = cache.lookup(card)
         
-        if (card_set == "PLIST"): card_set = "PLST"
+        if (cached_price != None):
+            card.price = cached_price
+            logger.metrics.count("cache_hits")
+            if (config.print_cards): print(f"\tFound {card}")
         
-        card = card_api.Card(card_name, card_cn, card_set, card_foil, quantity = card_quantity, call_api = autocall_api)
-        card_list.append(card)
+        elif (card.prices != None):
+            # Already fetched while validating, no need to call the API again
+            card.set_price_from_api()
+            cache.store(card)
+            if (config.print_cards): print(f"\tFound {card}")
         
+        else: cache_misses.append(card)
+    logger.metrics.count("cache_misses", len(cache_misses))
     
-    # Clean up
-    cursor.close()
-    cnxn.close()
-    
-    logger.log(f"Connection to {filename} closed", "LOG", args.log_file, args.log, args.verbose)
+    if (len(cache_misses) > 0 and scheduler != None):
+        # Over the request budget, cheaper expired cards keep their last known price until a later run
+        last_known: dict[int, float] = {}
+        for card in cache_misses:
+            price = cache.last_known(card)
+            if (price != None): last_known[id(card)] = price
+        
+        cache_misses, deferred = scheduler.select(cache_misses, last_known)
+        for card in deferred:
+            card.price = last_known[id(card)]
+            card.stale = True
+            if (config.print_cards): print(f"\tCarried forward {card}")
+        logger.metrics.count("cards_stale", len(deferred))
+        if (len(deferred) > 0): logger.log("Request budget spent, carried forward %s stale prices", "WARNING", config.log_file, config.log, config.verbose, len(deferred))
     
-    return card_list
+    if (len(cache_misses) == 0): return
+    if (config.shared_cache and isinstance(cache, price_cache.SQLiteCache)): fetch_cards_shared(config, cache_misses, cache, scheduler)
+    else: fetch_cards(config, cache_misses, cache, scheduler)
 
-def read_cards_from_cache() -> dict:
-    cache_filename = "prices.cache"
-    cache = {}
-    today = datetime.today().strftime("%Y%m%d")
+def fetch_cards(config: argparse.Namespace, cards: list[card_api.Card], cache: price_cache.TextCache | price_cache.SQLiteCache, scheduler: refresh.RefreshScheduler | None = None) -> None:
+    # This is where we call the API, batched through /cards/collection
+    # We will also store the new prices in the cache, only writing to file if allowed
+    logger.log("Fetching %s cards from the API", "LOG", config.log_file, config.log, config.verbose, len(cards))
+    not_found = card_api.set_prices_from_collection(cards)
+    missing_cards = {id(err.card) for err in not_found}
+    logger.metrics.count("cards_not_found", len(not_found))
+    for err in not_found: logger.log("%s", "ERROR", config.log_file, config.log, config.verbose, err)
     
-    with open(cache_filename, "r") as file:
-        logger.log(f"Cache file {cache_filename} opened for reading", "LOG", args.log_file, args.log, args.verbose)
-        # If date is today, we can continue
-        cache_date = file.readline().strip()
+    for card in cards:
+        if (id(card) in missing_cards): continue
+        if (scheduler != None): cache.store(card, scheduler.interval(card))
+        else: cache.store(card)
+        if (config.print_cards): print(f"\tFound {card}")
+
+def fetch_cards_shared(config: argparse.Namespace, cards: list[card_api.Card], cache: price_cache.SQLiteCache, scheduler: refresh.RefreshScheduler | None = None) -> None:
+    """fetch_cards for processes sharing one cache. A printing is fetched by whichever process claims it first and saved right away,
+    the others wait for its row. Printings still claimed after CLAIM_WAIT_SECONDS are fetched anyway"""
+    deadline = monotonic() + CLAIM_WAIT_SECONDS
+    waiting = cards
+    while (len(waiting) > 0):
+        cache.refresh(waiting)
+        still_waiting: list[card_api.Card] = []
+        for card in waiting:
+            cached_price = cache.lookup(card)
+            if (cached_price == None):
+                still_waiting.append(card)
+                continue
+            card.price = cached_price
+            logger.metrics.count("shared_cache_hits")
+            if (config.print_cards): print(f"\tFound {card}")
+        waiting = still_waiting
+        if (len(waiting) == 0): break
         
-        if (today == cache_date): # We are good to continue
-            prices = [l.strip().split(",") for l in file.readlines()]
-            for price in prices: cache[price[0]] = price[1]
-            logger.log(f"Found {len(cache)} cached card prices", "LOG", args.log_file, args.log, args.verbose)
+        if (monotonic() > deadline):
+            logger.log("Gave up waiting on %s printings claimed by other processes", "WARNING", config.log_file, config.log, config.verbose, len(waiting))
+            fetch_cards(config, waiting, cache, scheduler)
+            break
         
-        else: logger.log(f"Cache is old, ignoring the cache", "WARNING", args.log_file, args.log, args.verbose)
-    
-    return cache
+        claimed = cache.claim(waiting)
+        mine = [card for card in waiting if cache.card_key(card) in claimed]
+        if (len(mine) == 0):
+            sleep(CLAIM_POLL_SECONDS)
+            continue
+        try:
+            fetch_cards(config, mine, cache, scheduler)
+            with logger.metrics.span("cache_write"): cache.save()
+        finally: cache.release()
+        waiting = [card for card in waiting if cache.card_key(card) not in claimed]
 
-def write_cards_to_cache(new_cache: dict, old_cache: dict) -> None:
-    cache_filename: str = "prices.cache"
-    today: str = datetime.today().strftime("%Y%m%d")
-    
-    cache_date: str = "not today!"
-    cards_added: int = 0
-    with open(cache_filename, "r") as file: cache_date = file.readline().strip()
+def capture_currencies(config: argparse.Namespace, cards: list[card_api.Card], cache: price_cache.TextCache | price_cache.SQLiteCache) -> None:
+    # The other currencies asked for, from each card's response or else its cache row. No extra requests
+    if (all(currency == card_api.CURRENCY for currency in config.currencies)): return
+    for card in cards:
+        if (card.prices != None): card.capture_currencies()
+        else: card.currency_prices = cache.lookup_currencies(card)
+
+def stream_card_prices(config: argparse.Namespace, cards: Iterator[card_api.Card], write: Callable[[Iterator[list[card_api.Card]]], None], check_cache: bool = True, write_to_cache: bool = True) -> None:
+    """Streaming version of get_card_prices_from_api (without validation). Cards are read, priced and handed to write
+    in batches, so the writer loads the workbook while prices are still being fetched"""
+    cache = open_cache(config)
+    migrating = isinstance(cache, price_cache.SQLiteCache) and not cache.text_cache_migrated()
+    if (check_cache): 
+        with logger.metrics.span("cache_load"): cached = cache.load()
+        if (cached > 0): logger.log("Found %s cached card prices", "LOG", config.log_file, config.log, config.verbose, cached)
+        else: logger.log("Cache is old or empty, ignoring the cache", "WARNING", config.log_file, config.log, config.verbose)
+    scheduler = open_scheduler(config, cache) if check_cache else None
     
-    if (cache_date != today): 
-        # TODO: Rewrite entire cache regardless
-        with open(cache_filename, "w") as file:
-            logger.log(f"Cache file {cache_filename} opened for writing", "LOG", args.log_file, args.log, args.verbose)
-            file.write(f"{today}\n")
-            for hash_key in new_cache: 
-                cards_added += 1
-                file.write(f"{hash_key},{new_cache[hash_key]}\n")
-            logger.log(f"Finished writing {cards_added} to the cache", "LOG", args.log_file, args.log, args.verbose)
-        
-    else:
-        # TODO: Check if card is in old_cache. If it is not, append card to file
-        with open(cache_filename, "a") as file:
-            logger.log(f"Cache file {cache_filename} opened for writing", "LOG", args.log_file, args.log, args.verbose)
-            
-            for hash_key in new_cache:
-                if (hash_key not in old_cache):
-                    cards_added += 1
-                    file.write(f"{hash_key},{new_cache[hash_key]}\n")
-            logger.log(f"Finished writing {cards_added} to the cache", "LOG", args.log_file, args.log, args.verbose)
+    def price_batch(batch: list[card_api.Card]) -> None:
+        if (migrating): cache.migrate_text_cache(batch, mark_done = False)
+        price_cards(config, batch, cache, scheduler)
+        capture_currencies(config, batch, cache)
     
+    if (config.print_cards): print("Starting card price fetching")
+    try: pipeline.Pipeline().run(cards, price_batch, write)
+    finally:
+        if (migrating): cache.mark_text_cache_migrated()
+        if (write_to_cache): 
+            with logger.metrics.span("cache_write"): cards_added = cache.save()
+            logger.log("Finished writing %s to the cache", "LOG", config.log_file, config.log, config.verbose, cards_added)
+        cache.close()
     
-    return
+    logger.log("Finished fetching", "LOG", config.log_file, config.log, config.verbose)
+
 
-def get_card_prices_from_api(cards: list[card_api.Card], check_cache: bool = True, write_to_cache: bool = True) -> bool:
-    cache_filename: str = "prices.cache"
-    old_cache: dict = {}
-    new_cache: dict = {}
+def get_card_prices_from_api(config: argparse.Namespace, cards: list[card_api.Card], check_cache: bool = True, write_to_cache: bool = True) -> bool:
     invalid_cards: list[card_api.Card] = []
     today: str = datetime.today().strftime("%Y%m%d")
     
-    logger.log(f"Today's date: {today}", "LOG", args.log_file, args.log, args.verbose)
+    logger.log("Today's date: %s", "LOG", config.log_file, config.log, config.verbose, today)
     
-    # Make sure the file exists
-    file = open(cache_filename, "a")
-    file.close()
+    cache = open_cache(config)
+    if (isinstance(cache, price_cache.SQLiteCache)):
+        migrated = cache.migrate_text_cache(cards)
+        if (migrated > 0): logger.log("Migrated %s card prices from %s", "LOG", config.log_file, config.log, config.verbose, migrated, price_cache.TEXT_CACHE_FILENAME)
     
     # Read the cache
-    if (check_cache): old_cache = read_cards_from_cache()
+    if (check_cache): 
+        with logger.metrics.span("cache_load"): cached = cache.load()
+        if (cached > 0): logger.log("Found %s cached card prices", "LOG", config.log_file, config.log, config.verbose, cached)
+        else: logger.log("Cache is old or empty, ignoring the cache", "WARNING", config.log_file, config.log, config.verbose)
     
-    # If we are validating, call API for all cards, no matter what
-    if (args.validate or args.validate_only): 
-        # Call API for all cards, no matter what
-        for card in cards:
-            card_str = f"{card.name} [{card.set} {card.collector_number} {card.foiling}]"
-            print(f"Validation of {logger.Color.BLUE}{card_str}{logger.Color.RESET}", end = "")
-            card_valid = validate_card_name(card)
-            
-            if (not card_valid): 
-                # We found an invalid card
-                invalid_cards.append(card)
-                print(f"{logger.Color.RED} failed {logger.Color.RESET}")
-            else:
-                print(f"{logger.Color.GREEN} succeeded {logger.Color.RESET}")
+    # If we are validating, check and price every card in one pass
+    if (config.validate or config.validate_only): 
+        invalid_cards = validate_and_price_cards(config, cards, cache)
         
-        
-        # Write to file
-        with open("validate.txt", "w") as file:
-            for card in invalid_cards:
-                db_card = f"{card.name} [{card.set} {card.collector_number} {card.foiling}]"
-                api_card = f"{card.response_json['name']} [{card.response_json['set'].upper()} {card.response_json['collector_number']}]"
-                file.write(f"Got {db_card} but found {api_card}\n")
-                
-        if ((len(invalid_cards) > 0 and args.strict_mode) or args.validate_only): 
-            if (len(invalid_cards) > 0): logger.log("Not all cards succeeded validation, quitting. Check validate.txt", "ERROR", args.log_file, args.log, args.verbose)
-            else: logger.log("All cards validated successfully", "LOG", args.log_file, args.log, args.verbose)
+        if ((len(invalid_cards) > 0 and config.strict_mode) or config.validate_only): 
+            if (len(invalid_cards) > 0): logger.log("Not all cards succeeded validation, quitting. Check validate.txt", "ERROR", config.log_file, config.log, config.verbose)
+            else: logger.log("All cards validated successfully", "LOG", config.log_file, config.log, config.verbose)
+            if (write_to_cache):
+                with logger.metrics.span("cache_write"): cache.save()
+            cache.close()
             return len(invalid_cards) == 0
-        
-    # Go through old_cache and get prices
-    if (args.print_cards): print("Starting card price fetching")
+    
+    else:
+        if (config.print_cards): print("Starting card price fetching")
+        price_cards(config, cards, cache, open_scheduler(config, cache) if check_cache else None)
+    
+    # Invalid cards are left unpriced in every currency, not just the main one
+    invalid_ids = {id(card) for card in invalid_cards}
+    capture_currencies(config, [card for card in cards if id(card) not in invalid_ids], cache)
+    
+    # Write to cache
+    if (write_to_cache): 
+        with logger.metrics.span("cache_write"): cards_added = cache.save()
+        logger.log("Finished writing %s to the cache", "LOG", config.log_file, config.log, config.verbose, cards_added)
+    cache.close()
+    
+    logger.log("Finished fetching", "LOG", config.log_file, config.log, config.verbose)
+    return len(invalid_cards) == 0
+
+def validate_and_price_cards(config: argparse.Namespace, cards: list[card_api.Card], cache: price_cache.TextCache | price_cache.SQLiteCache) -> list[card_api.Card]:
+    """Validates and prices the cards in a single pass and writes the mismatches to validate.txt. Returns the invalid cards, which are left unpriced.
+    Cards with a cached price and canonical name are checked against the cache, the rest are fetched once per printing through /cards/collection"""
+    invalid_cards: list[card_api.Card] = []
+    cache_misses: list[card_api.Card] = []
     for card in cards:
-        if (card in invalid_cards): 
-            if (args.print_cards): print(f"\tSkipping invalid card {card}")
-            continue
-        card_hash = card.generate_hash()
-        
-        if (card_hash in old_cache):
-            card.price = float(old_cache[card_hash])
-            new_cache[card_hash] = float(old_cache[card_hash])
+        cached_name, cached_price = cache.lookup_name(card), cache.lookup(card)
+        if (cached_name != None and cached_price != None):
+            card.api_name = cached_name
+            card.price = cached_price
+        elif (card.prices == None): cache_misses.append(card)
+    logger.metrics.count("cache_hits", len(cards) - len(cache_misses))
+    logger.metrics.count("cache_misses", len(cache_misses))
+    
+    if (len(cache_misses) > 0):
+        logger.log("Fetching %s cards from the API", "LOG", config.log_file, config.log, config.verbose, len(cache_misses))
+        not_found = card_api.set_prices_from_collection(cache_misses)
+        missing_cards = {id(err.card) for err in not_found}
+        logger.metrics.count("cards_not_found", len(not_found))
+        for err in not_found: logger.log("%s", "ERROR", config.log_file, config.log, config.verbose, err)
+        for card in cache_misses:
+            if (id(card) not in missing_cards): cache.store(card)
+    
+    for card in cards:
+        card_str = f"{card.name} [{card.set} {card.collector_number} {card.foiling}]"
+        print(f"Validation of {logger.Color.BLUE}{card_str}{logger.Color.RESET}", end = "")
         
+        if (card.name != card.api_name): 
+            # We found an invalid card, it is skipped like before
+            invalid_cards.append(card)
+            card.price = 0.0
+            print(f"{logger.Color.RED} failed {logger.Color.RESET}")
         else:
-            # This is where we call the API
-            # We will also write the new price to the new_cache, only writing to file if allowed
-            card.set_price_from_api()
-            new_price = card.price
-            new_cache[card_hash] = new_price
-        if (args.print_cards): print(f"\tFound {card}")
+            print(f"{logger.Color.GREEN} succeeded {logger.Color.RESET}")
+            if (config.print_cards): print(f"\tFound {card}")
     
-    # Write to cache
-    if (write_to_cache): write_cards_to_cache(new_cache, old_cache)
+    # Write to file
+    with open("validate.txt", "w") as file:
+        for card in invalid_cards:
+            db_card = f"{card.name} [{card.set} {card.collector_number} {card.foiling}]"
+            if (card.api_name == None):
+                file.write(f"Got {db_card} but it was not found\n")
+                continue
+            api_card = f"{card.api_name} [{card.set.upper()} {card.collector_number}]"
+            file.write(f"Got {db_card} but found {api_card}\n")
     
-    logger.log(f"Finished fetching", "LOG", args.log_file, args.log, args.verbose)
-    return len(invalid_cards) == 0
+    return invalid_cards
 
-def validate_card_name(card: card_api.Card) -> bool:
-    card.response_json = card_api.get_api_response(card) # May as well set the price as well
-    return card.name == card.response_json["name"]
+def export_excel(config: argparse.Namespace, filename: str, cards: list[card_api.Card], sheet_name = "Sheet") -> None:
+    export_excel_batches(config, filename, [cards], sheet_name)
 
-def export_excel(filename: str, cards: list[card_api.Card], sheet_name = "Sheet") -> None:
+def export_excel_batches(config: argparse.Namespace, filename: str, batches: Iterable[list[card_api.Card]], sheet_name = "Sheet") -> None:
+    import magic_excel as me
+    # The workbook is loaded before the first batch is needed, so with the pipeline it loads while prices are fetched
+    load_start = perf_counter()
     with me.ExcelManager(filename, "w") as file:
+        logger.metrics.add_time("excel_load", perf_counter() - load_start)
         sheet = file.active
-        center_align = Alignment(horizontal = "center", vertical = "center")
         if (sheet == None): raise ValueError("how")
         sheet.title = sheet_name
-        logger.log(f"Opened {filename}, sheet {sheet.title}", "LOG", args.log_file, args.log, args.verbose)
-        
-        # Initial settings
-        sheet["A1"] = "Name"
-        sheet["B1"] = "Number"
-        sheet["C1"] = "Set"
-        sheet["D1"] = "Foiling"
-        sheet["E1"] = "Quantity"
+        logger.log("Opened %s, sheet %s", "LOG", config.log_file, config.log, config.verbose, filename, sheet.title)
         
-        # Start writing data in first available space
-        # Get the first empty column and set it
-        new_column = me.get_first_empty_column(sheet)
+        # Start writing data in the first empty column
         date_formatted = datetime.now().strftime("%Y-%m-%d")
-        sheet[f"{new_column}1"] = date_formatted
-        sheet[f"{new_column}1"].number_format = "YYYY-MM-DD"
-        
-        logger.log(f"Next empty column found: {new_column}, setting date to {date_formatted}", "LOG", args.log_file, args.log, args.verbose)
+        if (config.restyle_all): logger.log("Restyling every cell of %s", "LOG", config.log_file, config.log, config.verbose, sheet.title)
+        column_writer = me.PriceColumnWriter(sheet, date_formatted, incremental = not config.restyle_all)
         
-        # Start inputting  card information
-        for card in cards:
-            card_row = me.find_card_in_sheet(card, sheet)
-            sheet[f"A{card_row}"] = card.name
-            sheet[f"B{card_row}"] = card.collector_number
-            sheet[f"C{card_row}"] = card.set
-            sheet[f"D{card_row}"] = card.foiling
-            sheet[f"E{card_row}"] = card.quantity
-            sheet[f"{new_column}{card_row}"] = card.price
-            sheet[f"{new_column}{card_row}"].number_format = '"$"#,##0.00'
-            
-        logger.log(f"Adding style and alignment to cells", "LOG", args.log_file, args.log, args.verbose)
-        # Center align all of the cells
-        center_align = Alignment(horizontal="center", vertical="center")
-        for row in sheet.iter_rows():
-            for cell in row:
-                cell.alignment = center_align
-                
-                
-        fill = PatternFill(start_color="A5A5A5", end_color="A5A5A5", fill_type="solid")
-        font = Font(name="Calibri", size=11, bold=True, color="FFFFFFFF")
-        double_side = Side(border_style="double", color="000000")
-        thin_side = Side(border_style="thin", color="000000")
-        border = Border(left=thin_side, right=thin_side, top=double_side, bottom=double_side)
+        # Other currencies go to their own sheets, written from the same batches
+        currency_writers: list[me.PriceColumnWriter] = []
+        for currency in config.currencies:
+            if (currency == card_api.CURRENCY): continue
+            currency_sheet_name = f"{sheet_name} {currency.upper()}"
+            currency_sheet = file[currency_sheet_name] if currency_sheet_name in file.sheetnames else file.create_sheet(currency_sheet_name)
+            currency_writers.append(me.PriceColumnWriter(currency_sheet, date_formatted, incremental = not config.restyle_all, currency = currency))
         
-        # Fix the width/style of the columns that can/did change
-        for i in [1, 2, 3, 4, 5, me.column_to_number(new_column)]:
-            me.set_column_width(sheet, me.number_to_column(i))
-            sheet[f"{me.number_to_column(i)}1"].fill = fill
-            sheet[f"{me.number_to_column(i)}1"].border = border
-            sheet[f"{me.number_to_column(i)}1"].font = font
-            
-    logger.log(f"Saved and closed {filename}", "LOG", args.log_file, args.log, args.verbose)
+        for batch in batches:
+            with logger.metrics.span("excel_write"):
+                column_writer.write(batch)
+                for currency_writer in currency_writers: currency_writer.write(batch)
+        with logger.metrics.span("excel_write"):
+            new_column = column_writer.finish()
+            for currency_writer in currency_writers: currency_writer.finish()
+        logger.log("Wrote %s prices to column %s, date %s", "LOG", config.log_file, config.log, config.verbose, column_writer.cards_written, new_column, date_formatted)
+        save_start = perf_counter()
+    
+    logger.metrics.add_time("excel_save", perf_counter() - save_start)
+    logger.log("Saved and closed %s", "LOG", config.log_file, config.log, config.verbose, filename)
 
-if __name__ == "__main__":
-    if (args.clear_cache): 
-        file = open("prices.cache", "w")
-        file.close()
+def export_excel_from_history(config: argparse.Namespace, store: history_store.HistoryStore, filename: str, sheet_name = "Sheet", report: dict | None = None) -> None:
+    import analytics, compaction
+    def add_sheets(workbook) -> None:
+        if (report != None): analytics.write_summary_sheet(workbook, report)
+        if (config.compact): compaction.write_rollup_sheet(workbook, store)
+    while True:
+        try:
+            with logger.metrics.span("excel_export"): store.export_workbook(filename, sheet_name, add_sheets, config.currencies)
+            break
+        except PermissionError:
+            input("Close Excel and press enter")
+    logger.log("Generated %s from %s", "LOG", config.log_file, config.log, config.verbose, filename, store.directory)
+
+def open_history(config: argparse.Namespace, directory: str, excel_filename: str) -> history_store.HistoryStore:
+    import history_store
+    store = history_store.HistoryStore(directory)
+    
+    # The first time, bring over the history that so far only lived in the workbook
+    if (store.is_empty() and path.exists(excel_filename)):
+        imported = store.import_workbook(excel_filename)
+        logger.log("Imported %s dates for %s cards from %s into %s", "LOG", config.log_file, config.log, config.verbose, imported, len(store.cards), excel_filename, directory)
+    
+    return store
+
+def portfolio_report(config: argparse.Namespace, store: history_store.HistoryStore, today: str) -> dict | None:
+    # Totals are only computed for the dates that are new since the last run, plus today's rewritten partition
+    if (config.report_file == ""): return None
+    import analytics
+    with logger.metrics.span("analytics"):
+        portfolio = analytics.Portfolio(store)
+        computed = portfolio.update([today])
+        report = portfolio.report(today)
+        analytics.write_report(report, config.report_file)
+    logger.log("Portfolio value %s on %s (totals computed for %s dates), report written to %s", "LOG", config.log_file, config.log, config.verbose, report["value"], today, len(computed), config.report_file)
+    return report
+
+def compact_history(config: argparse.Namespace, store: history_store.HistoryStore, today: str) -> None:
+    # After the portfolio totals, so days imported this run are totalled before they are rolled up
+    import compaction
+    with logger.metrics.span("compaction"): periods = compaction.compact(store, today, config.daily_days)
+    if (len(periods) > 0): logger.log("Rolled %s into weekly and monthly partitions, the raw days are archived in %s", "LOG", config.log_file, config.log, config.verbose, ", ".join(periods), store.directory)
+
+def write_snapshot(config: argparse.Namespace, batches: Iterable[list[card_api.Card]], excel_filename: str) -> Iterator[list[card_api.Card]]:
+    """Writes every batch to today's CSV or Parquet snapshot as it passes through, so the snapshot is done in the same pass as the history"""
+    import data_export
+    filename = data_export.export_filename(excel_filename, config.export_format)
+    writer = data_export.open_snapshot_writer(config.export_format, filename, datetime.now().strftime("%Y-%m-%d"), config.currencies)
+    try:
+        for batch in batches:
+            with logger.metrics.span("snapshot_write"): writer.write(batch)
+            yield batch
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    logger.log("Wrote %s prices to %s", "LOG", config.log_file, config.log, config.verbose, writer.rows_written, filename)
+
+def export_pivot(config: argparse.Namespace, store: history_store.HistoryStore, excel_filename: str) -> None:
+    import data_export
+    filename = data_export.export_filename(excel_filename, config.export_format, data_export.PIVOT_SUFFIX)
+    with logger.metrics.span("pivot_export"): dates = data_export.export_pivot(store, filename, config.export_format)
+    logger.log("Wrote %s dates of history to %s", "LOG", config.log_file, config.log, config.verbose, dates, filename)
+
+def write_prices(config: argparse.Namespace, batches: Iterable[list[card_api.Card]], excel_filename: str, sheet_name = "Sheet") -> None:
+    """Writer stage: appends the priced cards to the history store and exports the Excel file (or the CSV/Parquet snapshot), whichever are enabled.
+    With a history store the whole workbook is rewritten from it, the incremental SheetIndex/PriceColumnWriter path only runs without one"""
+    if (config.export_format != "xlsx" and not config.dont_export): batches = write_snapshot(config, batches, excel_filename)
+    
+    if (config.history_dir != ""):
+        store = open_history(config, config.history_dir, excel_filename)
+        today = datetime.now().strftime("%Y-%m-%d")
+        partition = store.append(today, (card for batch in batches for card in batch), currencies = config.currencies)
+        logger.log("Wrote today's prices to %s", "LOG", config.log_file, config.log, config.verbose, partition)
+        report = portfolio_report(config, store, today)
+        if (config.compact): compact_history(config, store, today)
+        if (config.dont_export): return
+        if (config.export_format == "xlsx"): export_excel_from_history(config, store, excel_filename, sheet_name, report)
+        elif (config.pivot): export_pivot(config, store, excel_filename)
+        return
+    
+    if (config.report_file != "" and not config.dont_export): logger.log("The portfolio report is computed from the history store, skipping it", "WARNING", config.log_file, config.log, config.verbose)
+    if (config.pivot): logger.log("The history pivot is written from the history store, skipping it", "WARNING", config.log_file, config.log, config.verbose)
+    if (config.compact): logger.log("Compaction rolls up the history store, skipping it", "WARNING", config.log_file, config.log, config.verbose)
+    if (config.export_format == "xlsx" and not config.dont_export): export_excel_batches(config, excel_filename, batches, sheet_name)
+    else:
+        for _ in batches: pass # Nothing else to write, just keep the pipeline moving (and the snapshot writing)
+
+def write_run_summary(config: argparse.Namespace) -> None:
+    if (config.summary_file == ""): return
+    summary = logger.metrics.write_summary(config.summary_file)
+    logger.log("Run summary written to %s: %s", "LOG", config.log_file, config.log, config.verbose, config.summary_file, json.dumps(summary))
+
+def run(config: argparse.Namespace) -> int:
+    """One pricing run with the given options: read the collection, price it and write the history and export. Returns the exit code"""
+    # The collection is opened before anything else, a bad --database must never reach the cache, the history or the workbook
+    try: cards = iter_cards(config, config.database, config.sql, source_type = config.source_type)
+    except (OSError, ValueError) as err:
+        logger.log("%s", "ERROR", config.log_file, config.log, True, err)
+        return 1
     
-    card_list = get_cards_from_access_database(args.database, args.sql)
-    cards_valid = get_card_prices_from_api(card_list, args.dont_read_cache, args.dont_write_cache)
+    if (config.export_format == "parquet" and not config.dont_export):
+        import data_export
+        data_export.import_pyarrow() # Fail before any prices are fetched
+    rate = 1000 / card_api.API_CALL_TIMEOUT_MS
+    bucket = fetcher.FileTokenBucket(config.rate_limit_file, rate) if config.rate_limit_file != "" else None
+    card_api.fetcher = card_api.Fetcher(rate = rate, max_workers = config.workers, bucket = bucket)
+    if (config.bulk_file != ""):
+        card_api.bulk_index = scryfall_bulk.load_index(config.bulk_file)
+        logger.log("Loaded %s printings from %s", "LOG", config.log_file, config.log, config.verbose, len(card_api.bulk_index), config.bulk_file)
+    if (config.clear_cache): 
+        cache = open_cache(config)
+        cache.clear()
+        cache.close()
     
-    if (args.validate_only or (not cards_valid and args.strict_mode and args.validate)): exit()
+    if (".xlsx" not in config.excel_filename): excel_filename = config.excel_filename + ".xlsx"
+    else: excel_filename = config.excel_filename
+    sheet_name = path.splitext(path.basename(config.database))[0]
     
-    if (".xlsx" not in args.excel_filename): excel_filename = args.excel_filename + ".xlsx"
-    else: excel_filename = args.excel_filename
+    if (config.validate or config.validate_only or (config.tiered_refresh and config.request_budget > 0)):
+        # Validation, and spending a request budget on the most valuable cards, need every card before anything is priced
+        card_list = list(cards)
+        cards_valid = get_card_prices_from_api(config, card_list, config.dont_read_cache, config.dont_write_cache)
+        
+        if (config.validate_only or (not cards_valid and config.strict_mode and config.validate)):
+            write_run_summary(config)
+            return 0
+        write_prices(config, [card_list], excel_filename, sheet_name)
     
-    if (not args.dont_export): export_excel(excel_filename, card_list, args.database.split(".")[0])
-            
-    logger.log(f"Done", "LOG", args.log_file, args.log, args.verbose)
-    if (args.keep_open): input("Press enter to exit ")
-            
\ No newline at end of file
+    else:
+        # Read, price and write in overlapping stages
+        write = lambda batches: write_prices(config, batches, excel_filename, sheet_name)
+        stream_card_prices(config, cards, write, config.dont_read_cache, config.dont_write_cache)
+    
+    write_run_summary(config)
+    logger.log("Done", "LOG", config.log_file, config.log, config.verbose)
+    return 0
+
+def main(argv: list[str] | None = None) -> int:
+    from os import system
+    system("")
+    
+    config = build_parser().parse_args(argv)
+    code = run(config)
+    if (config.keep_open): input("Press enter to exit ")
+    return code
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,85 @@
+from typing import Callable, Iterable, Iterator, TypeVar
+import queue, threading
+
+T = TypeVar("T")
+
+BATCH_SIZE = 750 # Ten /cards/collection requests worth of cards
+QUEUE_SIZE = 4 # Batches waiting between stages, this bounds memory instead of the collection size
+POLL_SECONDS = 0.1
+
+class _Done:
+    pass
+
+class PipelineAborted(Exception):
+    """Raised inside a stage when another stage failed"""
+
+DONE = _Done() # Marks the end of a queue
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    batch: list[T] = []
+    for item in items:
+        batch.append(item)
+        if (len(batch) >= size):
+            yield batch
+            batch = []
+    if (len(batch) > 0): yield batch
+
+class Pipeline:
+    """reader -> pricer -> writer over bounded queues. The reader and writer run on their own threads, the pricer on the caller's,
+    so loading the workbook and reading the database overlap with the network time of pricing"""
+    def __init__(self, batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE) -> None:
+        self.batch_size = batch_size
+        self.read_queue: queue.Queue = queue.Queue(maxsize = queue_size)
+        self.write_queue: queue.Queue = queue.Queue(maxsize = queue_size)
+        self.stop = threading.Event()
+        self.errors: list[BaseException] = []
+    
+    def put(self, target: queue.Queue, item) -> bool:
+        # Gives up if another stage failed, so nothing blocks forever on a full queue
+        while (not self.stop.is_set()):
+            try:
+                target.put(item, timeout = POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def consume(self, source: queue.Queue) -> Iterator[list]:
+        while True:
+            if (self.stop.is_set()): raise PipelineAborted()
+            try: batch = source.get(timeout = POLL_SECONDS)
+            except queue.Empty: continue
+            if (batch is DONE): return
+            yield batch
+    
+    def fail(self, err: BaseException) -> None:
+        self.errors.append(err)
+        self.stop.set()
+    
+    def run(self, source: Iterable[T], price: Callable[[list[T]], None], write: Callable[[Iterator[list[T]]], None]) -> None:
+        """Reads batches from source, calls price on each batch, and streams the priced batches to write.
+        The first exception from any stage is re-raised here after every stage has stopped"""
+        def reader() -> None:
+            try:
+                for batch in batched(source, self.batch_size):
+                    if (not self.put(self.read_queue, batch)): return
+            except BaseException as err: self.fail(err)
+            finally: self.put(self.read_queue, DONE)
+        
+        def writer() -> None:
+            try: write(self.consume(self.write_queue))
+            except BaseException as err: self.fail(err)
+        
+        threads = [threading.Thread(target = reader, name = "pipeline-reader", daemon = True), threading.Thread(target = writer, name = "pipeline-writer", daemon = True)]
+        for thread in threads: thread.start()
+        
+        try:
+            for batch in self.consume(self.read_queue):
+                price(batch)
+                if (not self.put(self.write_queue, batch)): break
+        except BaseException as err: self.fail(err)
+        finally:
+            self.put(self.write_queue, DONE)
+            for thread in threads: thread.join()
+        
+        if (len(self.errors) > 0): raise self.errors[0]
@@ -0,0 +1,282 @@
+from datetime import datetime
+from time import time
+import card_api
+import os, sqlite3
+
+CACHE_BACKENDS = ["sqlite", "text"]
+TEXT_CACHE_FILENAME = "prices.cache"
+SQLITE_CACHE_FILENAME = "prices.db"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+CLAIM_TIMEOUT_SECONDS = 10 * 60 # A claim older than this belongs to a process that died, anyone may take it over
+SQL_VARIABLES = 900 # Stays under SQLite's default limit of host parameters per statement
+
+# One cached price per currency and finish. The main currency keeps the original nonfoil, foil and etched columns
+PRICE_COLUMNS = [foiling if currency == card_api.CURRENCY else f"{currency}_{foiling}" for currency in card_api.CURRENCIES for foiling in card_api.foil_options]
+PRICE_SELECT = ", ".join(PRICE_COLUMNS)
+
+def price_index(foiling: str, currency: str = card_api.CURRENCY) -> int: return card_api.CURRENCIES.index(currency) * len(card_api.foil_options) + card_api.foil_options.index(foiling)
+
+def today_str() -> str: return datetime.today().strftime("%Y%m%d")
+
+class TextCache:
+    """The original prices.cache format: a date line, then one card_hash,price line per card. Only valid for the day it was written"""
+    def __init__(self, filename: str = TEXT_CACHE_FILENAME) -> None:
+        self.filename = filename
+        self.old: dict[str, float] = {}
+        self.new: dict[str, float] = {}
+        
+        # Make sure the file exists
+        file = open(self.filename, "a")
+        file.close()
+    
+    def load(self) -> int:
+        with open(self.filename, "r") as file:
+            # If date is today, we can use the cache
+            if (file.readline().strip() == today_str()):
+                for line in file:
+                    line = line.strip()
+                    if (line == ""): continue
+                    card_hash, price = line.split(",")
+                    self.old[card_hash] = float(price)
+        return len(self.old)
+    
+    def lookup_name(self, card: card_api.Card) -> str | None: return None # prices.cache has no names
+    
+    def lookup_currencies(self, card: card_api.Card) -> tuple[float | None, ...] | None: return None # Nor other currencies
+    
+    def lookup(self, card: card_api.Card) -> float | None:
+        card_hash = card.generate_hash()
+        if (card_hash not in self.old): return None
+        self.new[card_hash] = self.old[card_hash]
+        return self.old[card_hash]
+    
+    def store(self, card: card_api.Card) -> None:
+        self.new[card.generate_hash()] = card.price
+        self.old[card.generate_hash()] = card.price
+        if (card.prices == None): return
+        
+        # One response prices every finish of the printing, cache them all so other finishes are hits later
+        for foiling in card_api.foil_options:
+            card_hash = card_api.card_hash(card.name, card.collector_number, card.set, foiling)
+            self.new[card_hash] = card_api.price_for_foiling(card.prices, foiling)
+            self.old[card_hash] = self.new[card_hash]
+    
+    def save(self) -> int:
+        today = today_str()
+        with open(self.filename, "r") as file:
+            cache_date = file.readline().strip()
+            written = {line.split(",")[0] for line in file if line.strip() != ""} if cache_date == today else set()
+        
+        cards_added = 0
+        if (cache_date != today):
+            # Old cache, rewrite the entire file
+            with open(self.filename, "w") as file:
+                file.write(f"{today}\n")
+                for card_hash in self.new:
+                    cards_added += 1
+                    file.write(f"{card_hash},{self.new[card_hash]}\n")
+        else:
+            # Today's cache, only append cards that are not in the file yet
+            with open(self.filename, "a") as file:
+                for card_hash in self.new:
+                    if (card_hash in written): continue
+                    cards_added += 1
+                    file.write(f"{card_hash},{self.new[card_hash]}\n")
+        
+        return cards_added
+    
+    def clear(self) -> None:
+        file = open(self.filename, "w")
+        file.close()
+    
+    def close(self) -> None: pass
+
+class SQLiteCache:
+    """Price cache in a WAL mode SQLite database. One row per printing holds the price of every finish,
+    the time it was fetched and how long it stays valid, so only expired rows are refetched"""
+    def __init__(self, filename: str = SQLITE_CACHE_FILENAME, ttl: float = DEFAULT_TTL_SECONDS) -> None:
+        self.filename = filename
+        self.ttl = ttl
+        self.old: dict[str, tuple[float | None, ...]] = {}
+        self.names: dict[str, str] = {} # Canonical Scryfall names, so cached cards can be validated without the API
+        self.expired: dict[str, tuple[float | None, ...]] = {}
+        self.pending: dict[str, tuple] = {}
+        self.legacy: TextCache | None = None
+        self.owner = f"{os.getpid()}-{id(self)}"
+        
+        # Long-running users (the daemon) share it across threads behind their own lock. Parallel runs (runner.py) wait on each other's writes
+        self.connection = sqlite3.connect(self.filename, timeout = 30, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS prices (
+                key TEXT PRIMARY KEY,
+                name TEXT,
+                nonfoil REAL,
+                foil REAL,
+                etched REAL,
+                fetched_at REAL NOT NULL,
+                ttl REAL NOT NULL
+            )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS prices_expires_at ON prices (fetched_at + ttl)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # The other currencies' columns. Databases from before they were cached get them too, NULL until a row is refetched
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(prices)")}
+            for column in PRICE_COLUMNS:
+                if (column in existing): continue
+                try: self.connection.execute(f"ALTER TABLE prices ADD COLUMN {column} REAL")
+                except sqlite3.OperationalError as err:
+                    if ("duplicate column" not in str(err)): raise # Otherwise a parallel run added it first
+            self.connection.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT NOT NULL, claimed_at REAL NOT NULL)")
+    
+    @staticmethod
+    def card_key(card: card_api.Card) -> str: return "/".join(card_api.printing_key(card.set, card.collector_number))
+    
+    def load(self) -> int:
+        # Only rows that have not expired are loaded, expired ones become cache misses and get refreshed
+        rows = self.connection.execute(f"SELECT key, name, {PRICE_SELECT} FROM prices WHERE fetched_at + ttl > ?", (time(),))
+        for key, name, *prices in rows:
+            self.old[key] = tuple(prices)
+            if (name != None): self.names[key] = name
+        return len(self.old)
+    
+    def load_expired(self) -> int:
+        # Last known prices of the expired rows, for cards the refresh scheduler does not fetch this run
+        rows = self.connection.execute(f"SELECT key, {PRICE_SELECT} FROM prices WHERE fetched_at + ttl <= ?", (time(),))
+        for key, *prices in rows: self.expired[key] = tuple(prices)
+        return len(self.expired)
+    
+    def last_known(self, card: card_api.Card) -> float | None:
+        prices = self.expired.get(self.card_key(card))
+        if (prices == None): return None
+        return prices[price_index(card.foiling)]
+    
+    def reload(self) -> int:
+        # Drops the rows that expired since load(), for processes that keep the cache open
+        self.old = {}
+        self.names = {}
+        return self.load()
+    
+    def refresh(self, cards: list[card_api.Card]) -> int:
+        # Picks up the rows other processes saved since load() for these cards' printings
+        keys = list({self.card_key(card) for card in cards})
+        refreshed = 0
+        for start in range(0, len(keys), SQL_VARIABLES):
+            chunk = keys[start:start + SQL_VARIABLES]
+            rows = self.connection.execute(f"SELECT key, name, {PRICE_SELECT} FROM prices WHERE fetched_at + ttl > ? AND key IN ({', '.join('?' * len(chunk))})", (time(), *chunk))
+            for key, name, *prices in rows:
+                self.old[key] = tuple(prices)
+                if (name != None): self.names[key] = name
+                refreshed += 1
+        return refreshed
+    
+    def claim(self, cards: list[card_api.Card]) -> set[str]:
+        """Claims the cards' printings for this process to fetch. Returns the keys it got, printings claimed by another process are left out"""
+        keys = list({self.card_key(card) for card in cards})
+        now = time()
+        with self.connection:
+            self.connection.execute("DELETE FROM claims WHERE claimed_at < ?", (now - CLAIM_TIMEOUT_SECONDS,))
+            self.connection.executemany("INSERT OR IGNORE INTO claims (key, owner, claimed_at) VALUES (?, ?, ?)", ((key, self.owner, now) for key in keys))
+        claimed: set[str] = set()
+        for start in range(0, len(keys), SQL_VARIABLES):
+            chunk = keys[start:start + SQL_VARIABLES]
+            rows = self.connection.execute(f"SELECT key FROM claims WHERE owner = ? AND key IN ({', '.join('?' * len(chunk))})", (self.owner, *chunk))
+            claimed.update(key for key, in rows)
+        return claimed
+    
+    def release(self) -> None:
+        # Called once the claimed printings are saved, or could not be fetched
+        with self.connection: self.connection.execute("DELETE FROM claims WHERE owner = ?", (self.owner,))
+    
+    def lookup(self, card: card_api.Card) -> float | None:
+        prices = self.old.get(self.card_key(card))
+        if (prices == None): return None
+        return prices[price_index(card.foiling)] # None when this finish was never cached
+    
+    def lookup_currencies(self, card: card_api.Card) -> tuple[float | None, ...] | None:
+        # The card's finish in each of card_api.CURRENCIES, the same record Card.capture_currencies makes from a response
+        prices = self.old.get(self.card_key(card))
+        if (prices == None): return None
+        return tuple(prices[price_index(card.foiling, currency)] for currency in card_api.CURRENCIES)
+    
+    def lookup_name(self, card: card_api.Card) -> str | None: return self.names.get(self.card_key(card))
+    
+    def store(self, card: card_api.Card, ttl: float | None = None) -> None:
+        if (ttl == None): ttl = self.ttl
+        
+        if (card.prices != None):
+            # A full response prices every finish in every currency at once
+            name = card.api_name
+            prices = tuple(card_api.price_for_foiling(card.prices, foiling, currency) for currency in card_api.CURRENCIES for foiling in card_api.foil_options)
+        else:
+            name = card.api_name # Only a name Scryfall gave us is cached, never the collection's
+            prices = tuple(card.price if index == price_index(card.foiling) else None for index in range(len(PRICE_COLUMNS)))
+            
+            # Merge with other finishes of the same printing stored this run
+            if (self.card_key(card) in self.pending):
+                pending_prices = self.pending[self.card_key(card)][2:-2]
+                name = name or self.pending[self.card_key(card)][1]
+                prices = tuple(pending if price == None else price for price, pending in zip(prices, pending_prices))
+        
+        # A printing shared by several cards expires when the most urgent of them needs it
+        if (self.card_key(card) in self.pending): ttl = min(ttl, self.pending[self.card_key(card)][-1])
+        self.pending[self.card_key(card)] = (self.card_key(card), name, *prices, time(), ttl)
+        
+        # Later lookups this run hit the new prices too
+        old_prices = self.old.get(self.card_key(card), (None,) * len(prices))
+        self.old[self.card_key(card)] = tuple(old if price == None else price for price, old in zip(prices, old_prices))
+        if (name != None): self.names[self.card_key(card)] = name
+    
+    def save(self) -> int:
+        # One transaction of batched upserts. A finish that is unknown in the new row keeps its old price
+        with self.connection:
+            self.connection.executemany(f"""INSERT INTO prices (key, name, {PRICE_SELECT}, fetched_at, ttl) VALUES ({", ".join("?" * (len(PRICE_COLUMNS) + 4))})
+                ON CONFLICT (key) DO UPDATE SET
+                    name = COALESCE(excluded.name, name),
+                    {"".join(f"{column} = COALESCE(excluded.{column}, {column}), " for column in PRICE_COLUMNS)}
+                    fetched_at = excluded.fetched_at,
+                    ttl = excluded.ttl""", self.pending.values())
+        cards_added = len(self.pending)
+        self.pending = {}
+        return cards_added
+    
+    def text_cache_migrated(self) -> bool:
+        return self.connection.execute("SELECT value FROM meta WHERE key = 'migrated_text_cache'").fetchone() != None
+    
+    def mark_text_cache_migrated(self) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_text_cache', ?)", (today_str(),))
+    
+    def migrate_text_cache(self, cards: list[card_api.Card], filename: str = TEXT_CACHE_FILENAME, mark_done: bool = True) -> int:
+        """One shot import of today's prices.cache. Its keys are hashes, so the cards are needed to map them back to printings.
+        With mark_done = False it can be called once per batch, followed by mark_text_cache_migrated()"""
+        if (self.text_cache_migrated()): return 0
+        migrated = 0
+        
+        if (self.legacy == None and os.path.exists(filename)):
+            self.legacy = TextCache(filename)
+            self.legacy.load()
+        
+        if (self.legacy != None):
+            for card in cards:
+                card_hash = card.generate_hash()
+                if (card_hash not in self.legacy.old): continue
+                card.price = self.legacy.old[card_hash]
+                self.store(card)
+                migrated += 1
+            self.save()
+        
+        if (mark_done): self.mark_text_cache_migrated()
+        return migrated
+    
+    def clear(self) -> None:
+        with self.connection: self.connection.execute("DELETE FROM prices")
+    
+    def close(self) -> None:
+        self.release()
+        self.connection.close()
+
+def open_cache(backend: str, ttl: float = DEFAULT_TTL_SECONDS) -> TextCache | SQLiteCache:
+    if (backend == "text"): return TextCache()
+    if (backend == "sqlite"): return SQLiteCache(ttl = ttl)
+    raise ValueError(f"Unknown cache backend {backend}, expected one of {CACHE_BACKENDS}")
@@ -0,0 +1,65 @@
+import card_api, history_store
+import numpy as np
+import warnings
+
+HOUR = 60 * 60
+
+# (minimum quantity weighted value in dollars, refresh interval). The first tier a card reaches is used
+REFRESH_TIERS = [
+    (20.0, 6 * HOUR),
+    (5.0, 24 * HOUR),
+    (1.0, 3 * 24 * HOUR),
+    (0.0, 7 * 24 * HOUR)
+]
+MIN_INTERVAL = 1 * HOUR
+VOLATILITY_SCALE = 0.05 # A card moving 5% a day refreshes twice as often as a flat one
+VOLATILITY_DAYS = 30
+
+def history_volatility(store: history_store.HistoryStore, days: int = VOLATILITY_DAYS) -> dict[history_store.CardKey, float]:
+    """Standard deviation of each card's daily price change over the last days of the store, as a fraction"""
+    dates = store.dates()[-days:]
+    if (len(dates) < 2): return {}
+    _, prices, _ = store.load_matrix(dates)
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category = RuntimeWarning) # Zero prices and all-NaN rows are expected
+        returns = np.diff(prices, axis = 1) / prices[:, :-1]
+        volatility = np.nanstd(np.where(np.isfinite(returns), returns, np.nan), axis = 1)
+    
+    return {key: float(value) for key, value in zip(store.cards, volatility.tolist()) if value == value}
+
+class RefreshScheduler:
+    """Decides which cache misses are fetched this run. Each card gets a refresh interval from its quantity weighted value
+    and volatility, used as its cache row's TTL, so cheap and stable cards expire rarely. With a request budget, only the
+    most valuable expired printings are fetched and the rest carry their last known price forward, marked stale"""
+    def __init__(self, request_budget: int = 0, volatility: dict[history_store.CardKey, float] | None = None) -> None:
+        self.request_budget = request_budget # /cards/collection requests, 0 for no limit
+        self.printings_left = request_budget * card_api.COLLECTION_BATCH_SIZE
+        self.volatility = volatility or {}
+    
+    def interval(self, card: card_api.Card) -> float:
+        value = card.price * card.quantity
+        interval = next(seconds for min_value, seconds in REFRESH_TIERS if value >= min_value)
+        interval /= 1 + self.volatility.get(history_store.card_key(card), 0.0) / VOLATILITY_SCALE
+        return max(interval, MIN_INTERVAL)
+    
+    def select(self, cards: list[card_api.Card], last_known: dict[int, float]) -> tuple[list[card_api.Card], list[card_api.Card]]:
+        """Splits cache misses into (fetch now, defer). last_known maps id(card) to its expired cached price.
+        Cards that were never priced come first and are fetched even past the budget, since there is no price to carry forward.
+        Then printings go by their total last known value"""
+        if (self.request_budget <= 0): return cards, []
+        
+        groups = card_api.group_by_printing(cards)
+        def priority(group: list[card_api.Card]) -> tuple[bool, float]:
+            if (any(id(card) not in last_known for card in group)): return (True, 0.0)
+            return (False, sum(last_known[id(card)] * card.quantity for card in group))
+        
+        fetch: list[card_api.Card] = []
+        defer: list[card_api.Card] = []
+        for group in sorted(groups.values(), key = priority, reverse = True):
+            if (self.printings_left > 0 or priority(group)[0]):
+                self.printings_left -= 1
+                fetch.extend(group)
+            else: defer.extend(group)
+        
+        return fetch, defer
@@ -0,0 +1,66 @@
+"""Prices several collections at once, one process per collection from a pool. All of them share prices.db and one
+rate limit file, so a printing that is in several collections is fetched once per cache TTL (a day by default).
+
+Run: python runner.py Magic.accdb Trades.csv "Binder.db::SELECT * FROM Binder" [--processes 4] [main.py options]
+Each collection writes its own <name>.xlsx, history-<name> store, run_summary-<name>.json and report-<name>.json"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path
+from time import perf_counter
+import argparse, os
+
+RATE_LIMIT_FILENAME = "rate_limit.state"
+SQL_SEPARATOR = "::"
+
+def collection_argv(database: str, name: str, passthrough: list[str]) -> list[str]:
+    # main.py's command line for one collection. The collection's own files come last so they win over passed through ones
+    argv = ["main.py", *passthrough, "--database", database, "--excel_filename", f"{name}.xlsx", "--summary_file", f"run_summary-{name}.json", "--report_file", f"report-{name}.json"]
+    if ("--history_dir" not in passthrough): argv += ["--history_dir", f"history-{name}"]
+    return argv
+
+def collection_names(collections: list[str]) -> list[str]:
+    # Output stems, numbered when two collections have the same file name
+    stems = [path.splitext(path.basename(collection.split(SQL_SEPARATOR)[0]))[0] for collection in collections]
+    return [f"{stem}-{index}" if stems.count(stem) > 1 else stem for index, stem in enumerate(stems, start = 1)]
+
+def run_collection(argv: list[str]) -> tuple[int, float]:
+    """Runs main.py in this worker process. The price fetcher and the run metrics are per process globals, so every collection needs a fresh process"""
+    import main
+    start = perf_counter()
+    try: code = main.main(argv[1:])
+    except SystemExit as err: return (err.code if isinstance(err.code, int) else 0), perf_counter() - start
+    return code, perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Price several collections in parallel against one shared cache and rate limit", epilog = "Other options are passed on to main.py")
+    parser.add_argument("collections", nargs = "+", help = f"Collection files, optionally with a query as FILE{SQL_SEPARATOR}SQL")
+    parser.add_argument("--processes", type = int, default = min(4, os.cpu_count() or 1), help = "Collections priced at once. Default = 4 or the CPU count")
+    parser.add_argument("--rate_limit_file", default = RATE_LIMIT_FILENAME, help = f"File the processes share the API rate limit through. Default = '{RATE_LIMIT_FILENAME}'")
+    args, passthrough = parser.parse_known_args()
+    
+    if ("--cache_backend=text" in passthrough or ("--cache_backend", "text") in zip(passthrough, passthrough[1:])):
+        print("runner.py needs the sqlite cache backend, prices.cache cannot be shared between processes")
+        exit(1)
+    passthrough += ["--shared_cache", "--rate_limit_file", args.rate_limit_file]
+    
+    jobs = {}
+    for collection, name in zip(args.collections, collection_names(args.collections)):
+        database, _, sql = collection.partition(SQL_SEPARATOR)
+        jobs[name] = collection_argv(database, name, passthrough + (["--sql", sql] if sql != "" else []))
+    
+    failed = 0
+    start = perf_counter()
+    # One task per child, so each collection starts with its own fetcher and metrics
+    with ProcessPoolExecutor(max_workers = args.processes, max_tasks_per_child = 1) as pool:
+        futures = {pool.submit(run_collection, argv): name for name, argv in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                code, seconds = future.result()
+                print(f"{futures[future]}: {'done' if code == 0 else f'exited with {code}'} in {seconds:.1f} s")
+            except Exception as err:
+                code = 1
+                print(f"{futures[future]}: failed, {err}")
+            if (code != 0): failed += 1
+    
+    print(f"Priced {len(jobs) - failed}/{len(jobs)} collections in {perf_counter() - start:.1f} s")
+    if (failed > 0): exit(1)
@@ -0,0 +1,109 @@
+from json import JSONDecoder
+from typing import IO, Iterator
+import os, pickle
+
+PRICE_KEYS = ("usd", "usd_foil", "usd_etched", "eur", "eur_foil", "tix")
+INDEX_VERSION = 1
+CHUNK_SIZE = 1 << 20 # 1 MB
+
+# (set, collector_number) -> (name, prices in PRICE_KEYS order)
+BulkIndex = dict[tuple[str, str], tuple[str, tuple[float | None, ...]]]
+
+def iter_bulk_cards(file: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """Yields the card objects of a Scryfall bulk data file (a JSON array) one at a time, without loading the whole file"""
+    decoder = JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+    
+    while True:
+        # Skip whitespace and separators
+        while (pos < len(buffer) and buffer[pos] in " \t\r\n,"): pos += 1
+        
+        if (pos >= len(buffer)):
+            if (eof): raise ValueError("Bulk file ended before the closing ]")
+            buffer = file.read(chunk_size)
+            pos = 0
+            eof = buffer == ""
+            continue
+        
+        if (not started):
+            if (buffer[pos] != "["): raise ValueError("Bulk file is not a JSON array")
+            started = True
+            pos += 1
+            continue
+        
+        if (buffer[pos] == "]"): return
+        
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # Object is split across chunks, read more and try again
+            if (eof): raise
+            more = file.read(chunk_size)
+            eof = more == ""
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+        
+        yield obj
+        pos = end
+
+def parse_price(value) -> float | None:
+    if (value == None): return None
+    return float(value)
+
+def build_index(file: IO[str]) -> BulkIndex:
+    index: BulkIndex = {}
+    for card_json in iter_bulk_cards(file):
+        prices = card_json.get("prices") or {}
+        key = (card_json["set"].lower(), str(card_json["collector_number"]))
+        index[key] = (card_json["name"], tuple(parse_price(prices.get(price_key)) for price_key in PRICE_KEYS))
+    return index
+
+def index_filename(bulk_filename: str) -> str: return f"{bulk_filename}.idx"
+
+def source_signature(bulk_filename: str) -> tuple[int, int]:
+    stat = os.stat(bulk_filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def load_index(bulk_filename: str, rebuild: bool = False) -> BulkIndex:
+    """Loads the index for bulk_filename, building it if the saved one is missing or was built from a different file"""
+    signature = source_signature(bulk_filename)
+    
+    if (not rebuild):
+        try:
+            with open(index_filename(bulk_filename), "rb") as file:
+                saved = pickle.load(file)
+            if (saved["version"] == INDEX_VERSION and tuple(saved["source"]) == signature): return saved["index"]
+        except (FileNotFoundError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+    
+    with open(bulk_filename, "r", encoding = "utf-8") as file:
+        index = build_index(file)
+    
+    with open(index_filename(bulk_filename), "wb") as file:
+        pickle.dump({"version": INDEX_VERSION, "source": signature, "index": index}, file, protocol = pickle.HIGHEST_PROTOCOL)
+    
+    return index
+
+def to_response_json(key: tuple[str, str], entry: tuple[str, tuple[float | None, ...]]) -> dict:
+    # Same shape as the parts of a /cards/{set}/{cn} response that Card and validation use
+    name, prices = entry
+    return {
+        "object": "card",
+        "name": name,
+        "set": key[0],
+        "collector_number": key[1],
+        "prices": dict(zip(PRICE_KEYS, prices))
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    from time import perf_counter
+    
+    start = perf_counter()
+    bulk_index = load_index(sys.argv[1])
+    print(f"Loaded {len(bulk_index)} printings in {(perf_counter() - start) * 1000:.1f} ms")
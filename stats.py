@@ -0,0 +1,101 @@
+import numpy as np, pandas as pd
+import warnings
+
+STAT_COLUMNS = ["current", "max", "min", "mean", "mean_7d", "mean_30d", "change_pct", "volatility"]
+WINDOW_DAYS = 30
+
+class PriceStats:
+    """Summary statistics for every card at once, computed with NaN skipping reductions over the cards x dates history.
+    Running totals make adding a new date column O(cards) instead of rescanning the whole history"""
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.labels: list[str] = list(df.columns)
+        self.positions: dict[str, int] = {label: position for position, label in enumerate(self.labels)}
+        prices = df.to_numpy(dtype = np.float64, copy = False)
+        valid = ~np.isnan(prices)
+        
+        self.count = valid.sum(axis = 0)
+        self.total = np.where(valid, prices, 0.0).sum(axis = 0)
+        self.maximum = np.where(valid, prices, -np.inf).max(axis = 0, initial = -np.inf)
+        self.minimum = np.where(valid, prices, np.inf).min(axis = 0, initial = np.inf)
+        self.current = last_valid(prices)
+        self.previous = last_valid(np.where(last_valid_mask(valid), np.nan, prices))
+        
+        # Only the trailing window is kept for the 7/30 day figures
+        self.dates = df.index
+        window = self.dates > (self.dates[-1] - pd.Timedelta(days = WINDOW_DAYS)) if len(self.dates) > 0 else np.zeros(0, dtype = bool)
+        self.window_dates = self.dates[window]
+        self.window = prices[window]
+        self.refresh_table()
+    
+    def add_date(self, date, prices: pd.Series) -> None:
+        """Folds one new date column (a price per card label) into the running statistics"""
+        for label in prices.index:
+            if (label not in self.positions): self.add_card(label)
+        
+        day = np.full(len(self.labels), np.nan)
+        day[[self.positions[label] for label in prices.index]] = prices.to_numpy(dtype = np.float64)
+        valid = ~np.isnan(day)
+        
+        self.count += valid
+        self.total += np.where(valid, day, 0.0)
+        self.maximum = np.where(valid, np.fmax(self.maximum, day), self.maximum)
+        self.minimum = np.where(valid, np.fmin(self.minimum, day), self.minimum)
+        self.previous = np.where(valid, self.current, self.previous)
+        self.current = np.where(valid, day, self.current)
+        
+        date = pd.Timestamp(date)
+        self.window_dates = self.window_dates.append(pd.DatetimeIndex([date]))
+        self.window = np.vstack([self.window, day])
+        keep = self.window_dates > (date - pd.Timedelta(days = WINDOW_DAYS))
+        self.window_dates = self.window_dates[keep]
+        self.window = self.window[keep]
+        self.refresh_table()
+    
+    def add_card(self, label: str) -> None:
+        self.positions[label] = len(self.labels)
+        self.labels.append(label)
+        self.count = np.append(self.count, 0)
+        self.total = np.append(self.total, 0.0)
+        self.maximum = np.append(self.maximum, -np.inf)
+        self.minimum = np.append(self.minimum, np.inf)
+        self.current = np.append(self.current, np.nan)
+        self.previous = np.append(self.previous, np.nan)
+        self.window = np.hstack([self.window, np.full((self.window.shape[0], 1), np.nan)])
+    
+    def refresh_table(self) -> None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category = RuntimeWarning) # All-NaN windows are expected for new or unpriced cards
+            has_data = self.count > 0
+            last_date = self.window_dates[-1] if len(self.window_dates) > 0 else None
+            week = (self.window_dates > last_date - pd.Timedelta(days = 7)) if last_date != None else np.zeros(0, dtype = bool)
+            returns = np.diff(self.window, axis = 0) / self.window[:-1]
+            
+            self.table = pd.DataFrame({
+                "current": self.current,
+                "max": np.where(has_data, self.maximum, np.nan),
+                "min": np.where(has_data, self.minimum, np.nan),
+                "mean": np.where(has_data, self.total / np.maximum(self.count, 1), np.nan),
+                "mean_7d": np.nanmean(self.window[week], axis = 0) if week.any() else np.full(len(self.labels), np.nan),
+                "mean_30d": np.nanmean(self.window, axis = 0) if len(self.window) > 0 else np.full(len(self.labels), np.nan),
+                "change_pct": np.where(self.previous > 0, (self.current - self.previous) / self.previous * 100, np.nan),
+                "volatility": np.nanstd(np.where(np.isfinite(returns), returns, np.nan), axis = 0) * 100 if len(returns) > 0 else np.full(len(self.labels), np.nan)
+            }, index = pd.Index(self.labels, name = "Card"), columns = STAT_COLUMNS)
+    
+    def row(self, label: str) -> pd.Series: return self.table.loc[label]
+
+def last_valid_mask(valid: np.ndarray) -> np.ndarray:
+    # True at the last non-NaN entry of every column
+    rows = valid.shape[0]
+    if (rows == 0): return np.zeros_like(valid)
+    last_index = rows - 1 - np.argmax(valid[::-1], axis = 0)
+    mask = np.zeros_like(valid)
+    has_any = valid.any(axis = 0)
+    mask[last_index[has_any], np.nonzero(has_any)[0]] = True
+    return mask
+
+def last_valid(prices: np.ndarray) -> np.ndarray:
+    # The last non-NaN price of every column, NaN if there is none
+    valid = ~np.isnan(prices)
+    if (prices.shape[0] == 0): return np.full(prices.shape[1], np.nan)
+    last_index = prices.shape[0] - 1 - np.argmax(valid[::-1], axis = 0)
+    return np.where(valid.any(axis = 0), prices[last_index, np.arange(prices.shape[1])], np.nan)
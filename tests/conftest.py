@@ -0,0 +1,15 @@
+import os, sys
+import pytest
+
+# The modules live at the repo root and the Scryfall stub with the benchmarks, like running the scripts from the root
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(TESTS_DIR, ".."), os.path.join(TESTS_DIR, "..", "benchmarks")]
+
+@pytest.fixture
+def stub(monkeypatch):
+    """card_api pointed at a local Scryfall stub with 100 printings of set BNCH"""
+    import card_api, scryfall_stub
+    with scryfall_stub.StubServer(cards = 100) as server:
+        monkeypatch.setattr(card_api, "API_URL", server.url)
+        monkeypatch.setattr(card_api, "fetcher", card_api.Fetcher(rate = 1000, max_workers = 2))
+        yield server
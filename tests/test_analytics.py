@@ -0,0 +1,44 @@
+import analytics, card_api, history_store
+import json
+
+def write_day(store: history_store.HistoryStore, date: str, prices: dict[tuple[str, str, str], tuple[float, int]]) -> None:
+    store.append(date, [card_api.Card(name, "1", card_set, foiling, quantity = quantity, price = price) for (name, card_set, foiling), (price, quantity) in prices.items()])
+
+def make_store(directory: str) -> history_store.HistoryStore:
+    store = history_store.HistoryStore(directory)
+    write_day(store, "2026-01-01", {("Bolt", "LEA", "nonfoil"): (100.0, 1), ("Forest", "UNF", "foil"): (1.0, 10), ("Ring", "CMM", "nonfoil"): (2.0, 1)})
+    write_day(store, "2026-01-07", {("Bolt", "LEA", "nonfoil"): (90.0, 1), ("Forest", "UNF", "foil"): (1.5, 10), ("Ring", "CMM", "nonfoil"): (2.0, 1)})
+    write_day(store, "2026-01-08", {("Bolt", "LEA", "nonfoil"): (93.0, 1), ("Forest", "UNF", "foil"): (2.0, 10), ("Ring", "CMM", "nonfoil"): (1.0, 1), ("Island", "UNF", "nonfoil"): (0.5, 4)})
+    return store
+
+def test_totals_and_breakdowns(tmp_path):
+    portfolio = analytics.Portfolio(make_store(str(tmp_path)))
+    assert portfolio.update() == ["2026-01-01", "2026-01-07", "2026-01-08"]
+    assert portfolio.days["2026-01-08"] == {"value": 116.0, "cards": 4, "copies": 16, "by_set": {"CMM": 1.0, "LEA": 93.0, "UNF": 22.0}, "by_finish": {"foil": 20.0, "nonfoil": 96.0}}
+
+def test_movers_are_ranked_by_value_change(tmp_path):
+    portfolio = analytics.Portfolio(make_store(str(tmp_path)))
+    portfolio.update()
+    report = portfolio.report("2026-01-08")
+    
+    assert report["change"]["day"] == {"since": "2026-01-07", "value": 9.0, "pct": 8.4}
+    assert report["change"]["week"] == {"since": "2026-01-01", "value": 4.0, "pct": 3.6}
+    day = report["movers"]["day"]
+    # Forest's +0.50 on ten copies is worth more than Bolt's +3.00 on one
+    assert [(mover["name"], mover["value_change"]) for mover in day["gainers"]] == [("Forest", 5.0), ("Bolt", 3.0)]
+    assert [(mover["name"], mover["value_change"], mover["change_pct"]) for mover in day["losers"]] == [("Ring", -1.0, -50.0)]
+    week = report["movers"]["week"]
+    assert [mover["name"] for mover in week["gainers"]] == ["Forest"] # 10 x +1.00
+    assert [mover["name"] for mover in week["losers"]] == ["Bolt", "Ring"]
+    # Island was not held a week ago, it is neither a gainer nor a loser
+    assert all(mover["name"] != "Island" for movers in report["movers"].values() for side in ("gainers", "losers") for mover in movers[side])
+
+def test_only_new_and_rewritten_dates_are_computed(tmp_path):
+    store = make_store(str(tmp_path))
+    analytics.Portfolio(store).update()
+    write_day(store, "2026-01-08", {("Bolt", "LEA", "nonfoil"): (50.0, 2)})
+    
+    portfolio = analytics.Portfolio(store)
+    assert portfolio.update() == []
+    assert portfolio.update(["2026-01-08"]) == ["2026-01-08"]
+    with open(portfolio.filename, "r", encoding = "utf-8") as file: assert json.load(file)["2026-01-08"]["value"] == 100.0
@@ -0,0 +1,20 @@
+import card_api, scryfall_stub
+
+def test_printing_key():
+    assert card_api.printing_key("LEA", 161) == card_api.printing_key("lea", "161") == ("lea", "161")
+
+def test_collection_batches_each_printing_once(stub):
+    # 90 printings in every finish, the first ten also as duplicate rows, and one printing the stub does not have
+    cards = [card_api.Card("", str(number), "BNCH", foiling) for number in range(90) for foiling in card_api.foil_options]
+    cards += [card_api.Card("", str(number), "bnch", "nonfoil", quantity = 2) for number in range(10)]
+    cards.append(card_api.Card("Missing", "999", "BNCH", "nonfoil", price = 5.0))
+    
+    not_found = card_api.set_prices_from_collection(cards)
+    assert stub.counts["requests"] == 2 # 91 printings in batches of COLLECTION_BATCH_SIZE
+    assert [(err.code, err.card.name) for err in not_found] == [(404, "Missing")]
+    assert cards[-1].price == 5.0 # Cards that were not found keep their price
+    
+    for card in cards[:-1]:
+        expected = scryfall_stub.fixture("bnch", card.collector_number, 100)
+        assert card.api_name == expected["name"]
+        assert card.price == card_api.price_for_foiling(expected["prices"], card.foiling)
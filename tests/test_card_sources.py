@@ -0,0 +1,66 @@
+import card_sources, main
+from openpyxl import Workbook
+import sqlite3, sys, types
+import pytest
+
+ROWS = [("Lightning Bolt", "161", "LEA", "nonfoil", 4), ("Forest", 240.0, " PLIST ", "FOIL ", None), ("Sol Ring", "410★", "cmm", None, "2")]
+CARDS = [("Lightning Bolt", "161", "LEA", "nonfoil", 4), ("Forest", "240", "PLST", "foil", 1), ("Sol Ring", "410★", "cmm", "nonfoil", 2)]
+
+def card_tuples(source: card_sources.CardSource) -> list[tuple]:
+    return [(card.name, card.collector_number, card.set, card.foiling, card.quantity) for card in source.cards()]
+
+def test_normalize_row():
+    cards = [card_sources.normalize_row(row) for row in ROWS]
+    assert [(card.name, card.collector_number, card.set, card.foiling, card.quantity) for card in cards] == CARDS
+
+def test_every_source_reads_the_same_cards(tmp_path):
+    # A CSV has strings only, and often a trailing empty row
+    (tmp_path / "cards.csv").write_text("Name,Number,Set,Foiling,Quantity\nLightning Bolt,161,LEA,nonfoil,4\nForest,240, PLIST ,FOIL ,\nSol Ring,410★,cmm,,2\n,,,,\n", encoding = "utf-8")
+    
+    workbook = Workbook()
+    workbook.active.append(["Name", "Number", "Set", "Foiling", "Quantity"])
+    for row in ROWS: workbook.active.append(list(row))
+    workbook.save(tmp_path / "cards.xlsx")
+    
+    connection = sqlite3.connect(tmp_path / "cards.db")
+    with connection:
+        connection.execute("CREATE TABLE Cards (name, number, set_code, foiling, quantity)")
+        connection.executemany("INSERT INTO Cards VALUES (?, ?, ?, ?, ?)", ROWS)
+    connection.close()
+    
+    for filename in ["cards.csv", "cards.xlsx", "cards.db"]:
+        source = card_sources.open_source(str(tmp_path / filename))
+        assert card_tuples(source) == CARDS, filename
+        assert source.cards_found == 3
+
+def test_custom_sql_falls_back_to_the_cards_table(tmp_path):
+    connection = sqlite3.connect(tmp_path / "cards.db")
+    with connection:
+        connection.execute("CREATE TABLE Cards (name, number, set_code, foiling, quantity)")
+        connection.execute("INSERT INTO Cards VALUES ('Island', '236', 'UNF', 'nonfoil', 1)")
+    connection.close()
+    assert len(card_tuples(card_sources.open_source(str(tmp_path / "cards.db"), "SELECT * FROM Nope"))) == 1
+
+def test_source_type():
+    assert card_sources.source_type("Magic.ACCDB") == "access"
+    with pytest.raises(ValueError): card_sources.source_type("cards.txt")
+
+def run_collection(tmp_path, monkeypatch, database: str) -> int:
+    monkeypatch.chdir(tmp_path)
+    return main.run(main.default_config(database = database, summary_file = "", report_file = ""))
+
+def test_access_connection_errors_fail_the_run_before_it_starts(tmp_path, monkeypatch):
+    pyodbc = types.ModuleType("pyodbc")
+    pyodbc.Error = type("Error", (Exception,), {})
+    def connect(connection_string: str): raise pyodbc.Error("IM002", "Data source name not found and no default driver specified")
+    pyodbc.connect = connect
+    monkeypatch.setitem(sys.modules, "pyodbc", pyodbc)
+    (tmp_path / "Magic.accdb").write_bytes(b"")
+    
+    assert run_collection(tmp_path, monkeypatch, "Magic.accdb") == 1
+    assert not (tmp_path / "history").exists() and not (tmp_path / "magic.xlsx").exists()
+
+def test_a_file_that_is_not_a_database_fails_the_run(tmp_path, monkeypatch):
+    (tmp_path / "cards.db").write_text("Name,Number\n")
+    assert run_collection(tmp_path, monkeypatch, "cards.db") == 1
+    assert not (tmp_path / "history").exists()
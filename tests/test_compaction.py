@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+import compaction, history_store
+import numpy as np
+import os
+
+TODAY = "2026-06-30"
+
+def make_store(directory: str, start: str, days: int) -> history_store.HistoryStore:
+    # Two cards priced every day. Card 1 starts a week late and has no EUR price on odd days
+    store = history_store.HistoryStore(directory)
+    for key in [("Bolt", "1", "TST", "nonfoil"), ("Forest", "2", "TST", "nonfoil")]: store.get_card_id(key)
+    for day in range(days):
+        current = date.fromisoformat(start) + timedelta(days = day)
+        card_ids = np.array([0, 1] if day >= 7 else [0], dtype = np.int32)
+        prices = np.array([1.0 + day, 100.0 - day][:len(card_ids)])
+        eur = np.array([2.0 * day, day if day % 2 == 0 else np.nan][:len(card_ids)])
+        store.write_partition(current.isoformat(), card_ids, prices, 1 + card_ids, currency_prices = {"eur": eur})
+    return store
+
+def partition_files(directory: str) -> dict[str, bytes]:
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as file: files[name] = file.read()
+    return files
+
+def test_period_of():
+    assert compaction.period_of("2026-06-01", TODAY) == None
+    assert compaction.period_of("2026-03-02", TODAY) == "2026-03 W10"
+    # Weeks stop at the month end, so the 1st of March is its own week even though it is a Sunday
+    assert compaction.period_of("2026-03-01", TODAY) == "2026-03 W09"
+    assert compaction.period_of("2025-05-31", TODAY) == "2025-05"
+
+def test_weekly_rollup(tmp_path):
+    store = make_store(str(tmp_path), "2026-03-02", 14) # Mondays 2 and 9 March, two whole weeks
+    assert compaction.compact(store, TODAY) == ["2026-03 W10", "2026-03 W11"]
+    assert store.dates() == ["2026-03-08", "2026-03-15"]
+    assert compaction.partition_period(store, "2026-03-15") == ("2026-03 W11", "2026-03-09")
+    
+    with np.load(store.partition_filename("2026-03-15")) as partition:
+        assert partition["card_id"].tolist() == [0, 1]
+        assert partition["price"].tolist() == [14.0, 87.0] # The period's last price
+        assert partition["price_min"].tolist() == [8.0, 87.0]
+        assert partition["price_max"].tolist() == [14.0, 93.0]
+        assert partition["price_mean"].tolist() == [11.0, 90.0]
+        assert partition["price_count"].tolist() == [7, 7]
+        assert partition["price_eur_count"].tolist() == [7, 3] # Missing prices are not counted
+        assert partition["price_eur_mean"].tolist() == [20.0, 10.0]
+    with np.load(store.partition_filename("2026-03-08")) as partition:
+        assert partition["card_id"].tolist() == [0] # Card 1 was not priced in the first week
+    
+    # The raw days are archived first
+    with np.load(compaction.archive_filename(store, "2026-03")) as archive:
+        assert len(archive["date"]) == 7 + 14
+        assert np.isnan(archive["price_eur"][archive["card_id"] == 1]).sum() == 4
+
+def test_compaction_is_idempotent(tmp_path):
+    store = make_store(str(tmp_path), "2025-04-01", 400)
+    assert len(compaction.compact(store, TODAY)) > 0
+    compacted = partition_files(str(tmp_path))
+    assert compaction.compact(store, TODAY) == []
+    assert partition_files(str(tmp_path)) == compacted
+
+def test_weekly_rollups_roll_into_the_same_month_as_raw_days(tmp_path):
+    # Compacting daily, so March goes days -> weeks -> month, gives the same month as compacting the raw days at once
+    daily = make_store(str(tmp_path / "daily"), "2025-03-01", 31)
+    for today in ["2025-06-30", "2026-04-01"]: compaction.compact(daily, today)
+    direct = make_store(str(tmp_path / "direct"), "2025-03-01", 31)
+    compaction.compact(direct, "2026-04-01")
+    
+    assert daily.dates() == direct.dates() == ["2025-03-31"]
+    with np.load(daily.partition_filename("2025-03-31")) as rolled, np.load(direct.partition_filename("2025-03-31")) as expected:
+        assert sorted(rolled.files) == sorted(expected.files)
+        for name in expected.files: np.testing.assert_array_equal(rolled[name], expected[name])
+    with np.load(compaction.archive_filename(daily, "2025-03")) as archive:
+        assert len(np.unique(archive["date"])) == 31
+
+def test_half_finished_compaction_is_completed(tmp_path):
+    # A compaction that stopped after writing the rollup leaves raw days the rollup already covers
+    clean = make_store(str(tmp_path / "clean"), "2026-03-02", 7)
+    compaction.compact(clean, TODAY)
+    store = make_store(str(tmp_path / "crashed"), "2026-03-02", 7)
+    dates = store.dates()
+    compaction.archive_days(store, dates)
+    compaction.merge_partitions(store, dates, "2026-03 W10", dates[0])
+    assert len(store.dates()) == 7
+    
+    assert compaction.compact(store, TODAY) == ["2026-03 W10"]
+    assert store.dates() == clean.dates() == ["2026-03-08"]
+    with np.load(store.partition_filename("2026-03-08")) as rolled, np.load(clean.partition_filename("2026-03-08")) as expected:
+        for name in expected.files: np.testing.assert_array_equal(rolled[name], expected[name])
+    with np.load(compaction.archive_filename(store, "2026-03")) as archive:
+        assert len(archive["date"]) == 7 # Each raw day archived once, card 1 is only priced from the second week
@@ -0,0 +1,17 @@
+import card_api, main, scryfall_stub
+
+def test_invalid_cards_get_no_price_in_any_currency(tmp_path, monkeypatch, stub):
+    monkeypatch.chdir(tmp_path)
+    config = main.default_config(validate = True, currencies = ["usd", "eur"], summary_file = "")
+    valid = card_api.Card(scryfall_stub.fixture_name(1), "1", "BNCH", "nonfoil")
+    invalid = card_api.Card("Wrong Name", "2", "BNCH", "nonfoil")
+    
+    assert main.get_card_prices_from_api(config, [valid, invalid]) == False
+    assert valid.price_in("eur") == float(scryfall_stub.fixture("bnch", "1", 100)["prices"]["eur"])
+    assert invalid.price == 0.0
+    assert invalid.price_in("eur") == None
+    
+    # The second run validates from the cache, which does have the invalid card's prices
+    invalid = card_api.Card("Wrong Name", "2", "BNCH", "nonfoil")
+    assert main.get_card_prices_from_api(config, [invalid]) == False
+    assert invalid.price_in("eur") == None
@@ -0,0 +1,45 @@
+from datetime import datetime
+import card_api, daemon, history_store, price_cache, scryfall_stub
+import numpy as np
+
+def make_daemon(tmp_path, history_dir: str) -> daemon.PriceDaemon:
+    cache = price_cache.SQLiteCache(str(tmp_path / "prices.db"))
+    cache.load()
+    return daemon.PriceDaemon(cache, history_dir, batch_window = 0.01)
+
+def write_collection_day(directory: str) -> history_store.HistoryStore:
+    # The collection holds three copies of BNCH 1, priced by main.py today
+    store = history_store.HistoryStore(directory)
+    card = card_api.Card(scryfall_stub.fixture_name(1), "1", "BNCH", "nonfoil", quantity = 3, price = 1.0)
+    card.currency_prices = (1.0, 0.5, None)
+    store.append(datetime.now().strftime("%Y-%m-%d"), [card], currencies = ["eur"])
+    return store
+
+def test_lookup_outside_collection_leaves_history_unchanged(tmp_path, stub):
+    directory = str(tmp_path / "history")
+    write_collection_day(directory)
+    price_daemon = make_daemon(tmp_path, directory)
+    
+    found, not_found = price_daemon.lookup([{"set": "BNCH", "collector_number": "42"}, {"set": "bnch", "collector_number": "1", "quantity": 7}])
+    assert len(found) == 2 and not_found == []
+    price_daemon.flush()
+    
+    store = history_store.HistoryStore(directory)
+    assert store.cards == [(scryfall_stub.fixture_name(1), "1", "BNCH", "nonfoil")]
+    today = datetime.now().strftime("%Y-%m-%d")
+    with np.load(store.partition_filename(today)) as partition:
+        assert partition["card_id"].tolist() == [0]
+        assert partition["quantity"].tolist() == [3] # The lookup's quantity is not the collection's
+        assert partition["price"].tolist() == [float(scryfall_stub.fixture("bnch", "1", 100)["prices"]["usd"])]
+        assert partition["price_eur"].tolist() == [0.5] # Currencies the daemon does not price are kept
+
+def test_flush_waits_for_main_to_write_today(tmp_path, stub):
+    directory = str(tmp_path / "history")
+    history_store.HistoryStore(directory)
+    price_daemon = make_daemon(tmp_path, directory)
+    
+    price_daemon.lookup([{"set": "BNCH", "collector_number": "1"}])
+    price_daemon.flush()
+    
+    store = history_store.HistoryStore(directory)
+    assert store.dates() == [] and store.cards == []
@@ -0,0 +1,76 @@
+import card_api, data_export, history_store
+import csv
+import pytest
+
+def make_cards() -> list[card_api.Card]:
+    bolt = card_api.Card("Bolt", "161", "LEA", "nonfoil", quantity = 2, price = 450.0)
+    bolt.currency_prices = (450.0, 390.5, None)
+    return [bolt, card_api.Card("Forest", "240", "UNF", "foil", price = 0.25)] # Forest was only priced from the cache, in USD
+
+def read_csv(filename: str) -> list[list[str]]:
+    with open(filename, "r", encoding = "utf-8", newline = "") as file: return list(csv.reader(file))
+
+def test_export_filename():
+    assert data_export.export_filename("magic.xlsx", "csv") == "magic.csv"
+    assert data_export.export_filename("out/magic.xlsx", "parquet", data_export.PIVOT_SUFFIX) == "out/magic-history.parquet"
+
+def test_csv_snapshot(tmp_path):
+    filename = str(tmp_path / "magic.csv")
+    writer = data_export.open_snapshot_writer("csv", filename, "2026-01-01", ["usd", "eur"])
+    cards = make_cards()
+    writer.write(cards[:1])
+    writer.write(cards[1:])
+    writer.close()
+    
+    assert writer.rows_written == 2
+    assert read_csv(filename) == [
+        ["date", "name", "number", "set", "foiling", "quantity", "price", "price_eur"],
+        ["2026-01-01", "Bolt", "161", "LEA", "nonfoil", "2", "450.0", "390.5"],
+        ["2026-01-01", "Forest", "240", "UNF", "foil", "1", "0.25", ""]
+    ]
+
+def test_aborted_snapshot_keeps_the_last_complete_one(tmp_path):
+    filename = str(tmp_path / "magic.csv")
+    writer = data_export.open_snapshot_writer("csv", filename, "2026-01-01")
+    writer.write(make_cards())
+    writer.close()
+    before = read_csv(filename)
+    
+    writer = data_export.open_snapshot_writer("csv", filename, "2026-01-02")
+    writer.write(make_cards()[:1])
+    writer.abort()
+    assert read_csv(filename) == before
+    assert not (tmp_path / "magic.csv.tmp").exists()
+
+def test_unknown_format():
+    with pytest.raises(ValueError): data_export.open_snapshot_writer("xlsx", "magic.xlsx", "2026-01-01")
+
+def make_store(directory: str) -> history_store.HistoryStore:
+    store = history_store.HistoryStore(directory)
+    store.append("2026-01-01", make_cards())
+    store.append("2026-01-02", make_cards()[:1])
+    return store
+
+def test_csv_pivot(tmp_path):
+    filename = str(tmp_path / "magic-history.csv")
+    assert data_export.export_pivot(make_store(str(tmp_path / "history")), filename, "csv") == 2
+    assert read_csv(filename) == [
+        ["name", "number", "set", "foiling", "quantity", "2026-01-01", "2026-01-02"],
+        ["Bolt", "161", "LEA", "nonfoil", "2", "450.0", "450.0"],
+        ["Forest", "240", "UNF", "foil", "1", "0.25", ""]
+    ]
+
+def test_parquet_snapshot_and_pivot(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow") # Optional dependency
+    import pyarrow.parquet
+    filename = str(tmp_path / "magic.parquet")
+    writer = data_export.open_snapshot_writer("parquet", filename, "2026-01-01", ["usd", "eur"])
+    writer.write(make_cards())
+    writer.close()
+    table = pyarrow.parquet.read_table(filename)
+    assert table.column("price_eur").to_pylist() == [390.5, None]
+    assert table.column("quantity").type == pyarrow.int32()
+    
+    pivot_filename = str(tmp_path / "magic-history.parquet")
+    data_export.export_pivot(make_store(str(tmp_path / "history")), pivot_filename, "parquet")
+    assert pyarrow.parquet.read_table(pivot_filename).column("2026-01-02").to_pylist() == [450.0, None]
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+import fetcher, scryfall_stub
+from time import perf_counter
+import email.utils, threading
+
+def test_file_bucket_holds_the_combined_rate_of_every_user(tmp_path):
+    # Two buckets on one state file, like two runner.py processes, share one rate
+    filename = str(tmp_path / "rate_limit.state")
+    buckets = [fetcher.FileTokenBucket(filename, rate = 50), fetcher.FileTokenBucket(filename, rate = 50)]
+    start = perf_counter()
+    threads = [threading.Thread(target = lambda bucket = bucket: [bucket.acquire() for _ in range(10)]) for bucket in buckets]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert perf_counter() - start >= 19 / 50 * 0.9 # The first token is free
+    for bucket in buckets: bucket.close()
+
+def test_token_bucket_holds_the_rate_across_threads():
+    bucket = fetcher.TokenBucket(rate = 100)
+    start = perf_counter()
+    threads = [threading.Thread(target = lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert perf_counter() - start >= 19 / 100 * 0.9
+
+def test_parse_retry_after():
+    assert fetcher.parse_retry_after("2.5") == 2.5
+    assert fetcher.parse_retry_after("-1") == 0.0
+    assert fetcher.parse_retry_after(None) == None
+    assert fetcher.parse_retry_after("soon") == None
+    assert fetcher.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0 # A date in the past
+    assert 55 < fetcher.parse_retry_after(email.utils.format_datetime(datetime.now(timezone.utc) + timedelta(seconds = 60), usegmt = True)) <= 60
+
+def test_429s_are_retried_no_sooner_than_retry_after(monkeypatch):
+    delays: list[float] = []
+    monkeypatch.setattr(fetcher, "sleep", lambda seconds: None)
+    with scryfall_stub.StubServer(cards = 10, rate_429 = 0.5, retry_after = 0.25, seed = 3) as stub:
+        http = fetcher.Fetcher(rate = 1000, backoff_base = 0.001, max_retries = 20)
+        backoff = http.backoff
+        http.backoff = lambda attempt, retry_after: delays.append(backoff(attempt, retry_after)) or delays[-1]
+        responses = [http.get(f"{stub.url}/cards/bnch/{number}") for number in range(10)]
+        http.close()
+    
+    assert [response.status_code for response in responses] == [200] * 10
+    assert stub.counts["429"] > 0 and len(delays) == stub.counts["429"]
+    assert all(delay >= 0.25 for delay in delays)
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(fetcher, "sleep", lambda seconds: None)
+    with scryfall_stub.StubServer(cards = 10, error_rate = 1.0) as stub:
+        http = fetcher.Fetcher(rate = 1000, max_retries = 2)
+        assert http.get(f"{stub.url}/cards/bnch/1").status_code == 500
+        http.close()
+    assert stub.counts["requests"] == 3
+
+def test_map_keeps_order():
+    assert fetcher.Fetcher(rate = 1000, max_workers = 4).map(lambda number: number * number, range(20)) == [number * number for number in range(20)]
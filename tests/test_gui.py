@@ -0,0 +1,42 @@
+import card_api, gui, history_store, stats
+import pandas as pd
+import os, subprocess, sys
+
+def write_day(store: history_store.HistoryStore, date: str, prices: dict[str, float]) -> None:
+    store.append(date, [card_api.Card(name, "1", "TST", "nonfoil", price = price) for name, price in prices.items()])
+
+def test_new_partitions_update_stats_like_a_full_load(tmp_path):
+    directory = str(tmp_path / "history")
+    store = history_store.HistoryStore(directory)
+    write_day(store, "2026-01-01", {"Bolt": 1.0, "Counterspell": 2.0})
+    write_day(store, "2026-01-05", {"Bolt": 1.5, "Counterspell": float("nan")})
+    price_stats = stats.PriceStats(gui.get_price_history_store(directory))
+    
+    write_day(store, "2026-01-20", {"Bolt": 3.0, "Forest": 0.1})
+    write_day(store, "2026-02-10", {"Counterspell": 4.0, "Forest": 0.2})
+    new_prices = gui.new_history_prices(directory, "2026-01-05")
+    assert [date for date, _ in new_prices] == ["2026-01-20", "2026-02-10"]
+    for date, prices in new_prices: price_stats.add_date(date, prices)
+    
+    full = stats.PriceStats(gui.get_price_history_store(directory)).table
+    pd.testing.assert_frame_equal(price_stats.table.loc[full.index], full)
+
+def test_load_a_workbook_generated_from_the_store(tmp_path):
+    # Write only workbooks have no dimension tag, so the loader cannot size the matrix up front
+    store = history_store.HistoryStore(str(tmp_path / "history"))
+    for day in range(3): write_day(store, f"2026-01-0{day + 1}", {f"Card {number}": number + day / 10 for number in range(100)})
+    filename = str(tmp_path / "magic.xlsx")
+    store.export_workbook(filename)
+    
+    df = gui.load_price_history(filename)
+    expected = gui.get_price_history_store(store.directory)
+    assert list(df.columns) == list(expected.columns)
+    assert list(df.index) == list(expected.index)
+    assert (df.to_numpy() == expected.to_numpy()).all()
+    # The second load comes from the sidecar
+    pd.testing.assert_frame_equal(gui.load_price_history(filename), df)
+
+def test_import_gui_leaves_heavy_packages_unloaded():
+    code = "import sys, gui; print(' '.join(name for name in ['numpy', 'pandas', 'openpyxl', 'dearpygui'] if name in sys.modules))"
+    process = subprocess.run([sys.executable, "-c", code], cwd = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."), capture_output = True, text = True, check = True)
+    assert process.stdout.strip() == ""
@@ -0,0 +1,51 @@
+import history_store, main, scryfall_stub
+from openpyxl import load_workbook
+import os, subprocess, sys
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def write_collection(filename: str, count: int) -> None:
+    with open(filename, "w", encoding = "utf-8") as file:
+        file.write("Name,Number,Set,Foiling,Quantity\n")
+        for number in range(count): file.write(f"{scryfall_stub.fixture_name(number)},{number},BNCH,{'foil' if number % 2 else 'nonfoil'},{1 + number % 3}\n")
+
+@pytest.fixture
+def collection(tmp_path, monkeypatch, stub):
+    monkeypatch.chdir(tmp_path)
+    write_collection("cards.csv", 20)
+    return "cards.csv"
+
+def test_run_prices_the_collection_into_the_history_and_workbook(collection):
+    assert main.run(main.default_config(database = collection)) == 0
+    
+    store = history_store.HistoryStore("history")
+    assert len(store.cards) == 20 and len(store.dates()) == 1
+    sheet = load_workbook("magic.xlsx", read_only = True)["cards"]
+    rows = list(sheet.iter_rows(values_only = True))
+    assert len(rows) == 21
+    assert rows[2][:5] == (scryfall_stub.fixture_name(1), "1", "BNCH", "foil", 2)
+    assert rows[2][5] == float(scryfall_stub.fixture("bnch", "1", 100)["prices"]["usd_foil"])
+    for filename in ["prices.db", "portfolio_report.json", "run_summary.json"]: assert os.path.exists(filename)
+
+def test_second_run_is_priced_from_the_cache(collection, stub):
+    assert main.run(main.default_config(database = collection, summary_file = "")) == 0
+    requests = stub.counts["requests"]
+    assert main.run(main.default_config(database = collection, summary_file = "", export_format = "csv")) == 0
+    assert stub.counts["requests"] == requests
+    assert os.path.exists("magic.csv")
+
+def test_validate_only_writes_nothing_but_the_cache(collection):
+    assert main.run(main.default_config(database = collection, validate_only = True, summary_file = "")) == 0
+    assert not os.path.exists("history") and not os.path.exists("magic.xlsx")
+    with open("validate.txt", "r") as file: assert file.read() == ""
+
+@pytest.mark.parametrize("database", ["missing.csv", "cards.txt"])
+def test_bad_database_fails_before_anything_is_written(collection, database):
+    assert main.main(["--database", database, "--summary_file", ""]) == 1
+    assert sorted(os.listdir()) == ["cards.csv"]
+
+def test_import_main_leaves_heavy_packages_unloaded():
+    code = "import sys, main; print(' '.join(name for name in ['numpy', 'pandas', 'openpyxl', 'requests', 'pyodbc'] if name in sys.modules))"
+    process = subprocess.run([sys.executable, "-c", code], cwd = os.path.join(TESTS_DIR, ".."), capture_output = True, text = True, check = True)
+    assert process.stdout.strip() == ""
@@ -0,0 +1,53 @@
+import card_api, magic_excel, main, pipeline
+from openpyxl import Workbook
+import pytest
+
+def make_cards(count: int) -> list[card_api.Card]:
+    return [card_api.Card(f"Card {number}", str(number), "TST", "nonfoil") for number in range(count)]
+
+def write_workbook(filename: str) -> bytes:
+    workbook = Workbook()
+    workbook.active.title = "Sheet"
+    workbook.active.append(magic_excel.HEADERS + ["2026-01-01"])
+    workbook.active.append(["Card 0", "0", "TST", "nonfoil", 1, 1.0])
+    workbook.save(filename)
+    with open(filename, "rb") as file: return file.read()
+
+def test_batches_reach_the_writer_in_order():
+    written: list[list[int]] = []
+    def price(batch: list[int]) -> None:
+        for index, _ in enumerate(batch): batch[index] *= 2
+    pipeline.Pipeline(batch_size = 3, queue_size = 1).run(range(10), price, lambda batches: written.extend(batches))
+    assert written == [[0, 2, 4], [6, 8, 10], [12, 14, 16], [18]]
+
+def test_writer_failure_stops_pricing_and_is_raised():
+    priced: list[list[int]] = []
+    def write(batches) -> None:
+        next(batches)
+        raise OSError("disk full")
+    with pytest.raises(OSError, match = "disk full"):
+        pipeline.Pipeline(batch_size = 1, queue_size = 1).run(range(1000), priced.append, write)
+    assert len(priced) < 1000
+
+def test_reader_failure_is_raised():
+    def source():
+        yield 1
+        raise ValueError("bad row")
+    with pytest.raises(ValueError, match = "bad row"):
+        pipeline.Pipeline(batch_size = 1).run(source(), lambda batch: None, lambda batches: list(batches))
+
+@pytest.mark.parametrize("failing_batch", [0, 2])
+def test_aborted_run_leaves_the_workbook_untouched(tmp_path, monkeypatch, failing_batch):
+    monkeypatch.chdir(tmp_path)
+    before = write_workbook("magic.xlsx")
+    config = main.default_config(history_dir = "", report_file = "", summary_file = "")
+    
+    batches_priced = []
+    def price(batch: list[card_api.Card]) -> None:
+        if (len(batches_priced) == failing_batch): raise card_api.BadCardCallError(500, batch[0])
+        for card in batch: card.price = 2.0
+        batches_priced.append(batch)
+    
+    with pytest.raises(card_api.BadCardCallError):
+        pipeline.Pipeline(batch_size = 2).run(make_cards(10), price, lambda batches: main.write_prices(config, batches, "magic.xlsx"))
+    with open("magic.xlsx", "rb") as file: assert file.read() == before
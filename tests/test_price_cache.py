@@ -0,0 +1,90 @@
+import card_api, price_cache
+import pytest
+
+class Clock:
+    def __init__(self) -> None: self.now = 1_000_000.0
+    def __call__(self) -> float: return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(price_cache, "time", clock)
+    return clock
+
+def priced_card(collector_number: str, price: float, foiling: str = "nonfoil") -> card_api.Card:
+    return card_api.Card("", collector_number, "TST", foiling, price = price)
+
+def test_rows_expire_after_their_ttl(tmp_path, clock):
+    filename = str(tmp_path / "prices.db")
+    cache = price_cache.SQLiteCache(filename, ttl = 60)
+    cache.store(priced_card("1", 1.5))
+    cache.store(priced_card("2", 2.5), ttl = 600)
+    assert cache.save() == 2
+    
+    clock.now += 59
+    reader = price_cache.SQLiteCache(filename)
+    assert reader.load() == 2
+    assert reader.lookup(priced_card("1", 0)) == 1.5
+    
+    clock.now += 2
+    assert reader.reload() == 1
+    assert reader.lookup(priced_card("1", 0)) == None
+    assert reader.lookup(priced_card("2", 0)) == 2.5
+    # An expired row is still the last known price for cards the run does not refetch
+    assert reader.load_expired() == 1
+    assert reader.last_known(priced_card("1", 0)) == 1.5
+    assert reader.last_known(priced_card("2", 0)) == None
+
+def test_saving_one_finish_keeps_the_others(tmp_path, clock):
+    filename = str(tmp_path / "prices.db")
+    cache = price_cache.SQLiteCache(filename)
+    cache.store(priced_card("1", 1.0))
+    cache.save()
+    cache.store(priced_card("1", 8.0, "foil"))
+    cache.save()
+    
+    reader = price_cache.SQLiteCache(filename)
+    reader.load()
+    assert reader.lookup(priced_card("1", 0)) == 1.0
+    assert reader.lookup(priced_card("1", 0, "foil")) == 8.0
+    assert reader.lookup(priced_card("1", 0, "etched")) == None
+
+def test_todays_text_cache_is_migrated_once(tmp_path, clock):
+    text_cache = price_cache.TextCache(str(tmp_path / "prices.cache"))
+    cards = [card_api.Card("Bolt", "1", "TST", "nonfoil", price = 1.5), card_api.Card("Bolt", "1", "TST", "foil", price = 6.0)]
+    for card in cards: text_cache.store(card)
+    text_cache.save()
+    
+    cache = price_cache.SQLiteCache(str(tmp_path / "prices.db"))
+    unpriced = [card_api.Card("Bolt", "1", "TST", foiling) for foiling in ["nonfoil", "foil"]]
+    assert cache.migrate_text_cache(unpriced, str(tmp_path / "prices.cache")) == 2
+    assert cache.migrate_text_cache(unpriced, str(tmp_path / "prices.cache")) == 0
+    
+    reader = price_cache.SQLiteCache(str(tmp_path / "prices.db"))
+    reader.load()
+    assert [reader.lookup(card) for card in unpriced] == [1.5, 6.0]
+
+def test_claims_split_printings_between_processes(tmp_path, clock):
+    filename = str(tmp_path / "prices.db")
+    first = price_cache.SQLiteCache(filename)
+    second = price_cache.SQLiteCache(filename)
+    cards = [priced_card(str(number), 0) for number in range(4)]
+    
+    # Finishes of one printing share a claim
+    assert first.claim(cards[:2] + [priced_card("1", 0, "foil")]) == {"tst/0", "tst/1"}
+    assert second.claim(cards) == {"tst/2", "tst/3"}
+    
+    first.release()
+    assert second.claim(cards) == {"tst/0", "tst/1", "tst/2", "tst/3"}
+
+def test_claims_of_a_dead_process_time_out(tmp_path, clock):
+    filename = str(tmp_path / "prices.db")
+    dead = price_cache.SQLiteCache(filename)
+    alive = price_cache.SQLiteCache(filename)
+    cards = [priced_card("1", 0)]
+    assert dead.claim(cards) == {"tst/1"}
+    
+    clock.now += price_cache.CLAIM_TIMEOUT_SECONDS - 1
+    assert alive.claim(cards) == set()
+    clock.now += 2
+    assert alive.claim(cards) == {"tst/1"}
@@ -0,0 +1,42 @@
+import card_api, history_store, refresh
+import numpy as np
+
+def card(number: int, foiling: str = "nonfoil", quantity: int = 1, price: float = 0.0) -> card_api.Card:
+    return card_api.Card(f"Card {number}", str(number), "TST", foiling, quantity = quantity, price = price)
+
+def test_budget_fetches_the_most_valuable_printings(monkeypatch):
+    monkeypatch.setattr(card_api, "COLLECTION_BATCH_SIZE", 2)
+    scheduler = refresh.RefreshScheduler(request_budget = 2) # Four printings
+    cards = [card(number) for number in range(6)] + [card(1, "foil", quantity = 3)]
+    last_known = {id(cards[number]): price for number, price in [(0, 1.0), (1, 0.5), (2, 8.0), (3, 0.1), (4, 0.2)]}
+    last_known[id(cards[6])] = 1.0
+    
+    fetch, defer = scheduler.select(cards, last_known)
+    # Card 5 was never priced so it goes first, then printings by value: 2 (8.0), 1 (0.5 + 3 x 1.0 across its finishes) and 0 (1.0)
+    assert sorted((c.collector_number, c.foiling) for c in fetch) == [("0", "nonfoil"), ("1", "foil"), ("1", "nonfoil"), ("2", "nonfoil"), ("5", "nonfoil")]
+    assert sorted(c.collector_number for c in defer) == ["3", "4"]
+    
+    # Past the budget only cards without a price to carry forward are fetched
+    assert scheduler.select([cards[0], card(7)], last_known)[1] == [cards[0]]
+    assert [c.collector_number for c in scheduler.select([cards[0], card(7)], last_known)[0]] == ["7"]
+
+def test_no_budget_fetches_everything():
+    cards = [card(number) for number in range(3)]
+    assert refresh.RefreshScheduler().select(cards, {id(c): 1.0 for c in cards}) == (cards, [])
+
+def test_interval_by_value_and_volatility():
+    scheduler = refresh.RefreshScheduler(volatility = {("Card 2", "2", "TST", "nonfoil"): 0.05})
+    assert scheduler.interval(card(1, price = 25.0)) == 6 * refresh.HOUR
+    assert scheduler.interval(card(1, quantity = 4, price = 2.0)) == 24 * refresh.HOUR # Quantity weighted
+    assert scheduler.interval(card(1, price = 0.1)) == 7 * 24 * refresh.HOUR
+    assert scheduler.interval(card(2, price = 0.1)) == 7 * 24 * refresh.HOUR / 2
+    assert refresh.RefreshScheduler(volatility = {("Card 2", "2", "TST", "nonfoil"): 100.0}).interval(card(2, price = 25.0)) == refresh.MIN_INTERVAL
+
+def test_history_volatility(tmp_path):
+    store = history_store.HistoryStore(str(tmp_path))
+    for day, prices in enumerate([[1.0, 2.0], [1.1, 2.0], [0.99, 2.0]]):
+        store.write_partition(f"2026-01-0{day + 1}", np.array([0, 1], dtype = np.int32), np.array(prices), np.ones(2, dtype = np.int32))
+    for key in [("A", "1", "TST", "nonfoil"), ("B", "2", "TST", "nonfoil")]: store.get_card_id(key)
+    volatility = refresh.history_volatility(store)
+    assert abs(volatility[("A", "1", "TST", "nonfoil")] - 0.1) < 1e-9 # Returns of +10% and -10%
+    assert volatility[("B", "2", "TST", "nonfoil")] == 0.0
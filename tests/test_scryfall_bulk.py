@@ -0,0 +1,47 @@
+import io, json, os, shutil
+import scryfall_bulk
+import pytest
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "bulk_cards.json")
+
+def read_fixture() -> str:
+    with open(FIXTURE, "r", encoding = "utf-8") as file: return file.read()
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_streamed_cards_match_json_load_at_any_chunk_boundary(chunk_size):
+    # Small chunks split objects, strings with [ ] { } and multi-byte names across reads
+    text = read_fixture()
+    assert list(scryfall_bulk.iter_bulk_cards(io.StringIO(text), chunk_size)) == json.loads(text)
+
+def test_empty_array():
+    assert list(scryfall_bulk.iter_bulk_cards(io.StringIO(" [ \n] "), 1)) == []
+
+@pytest.mark.parametrize("text", ["", "[{\"name\": \"Bolt\"}", "{\"name\": \"Bolt\"}"])
+def test_truncated_or_not_an_array(text):
+    with pytest.raises(ValueError):
+        list(scryfall_bulk.iter_bulk_cards(io.StringIO(text), 4))
+
+def test_index_is_built_saved_and_reused(tmp_path):
+    bulk_filename = str(tmp_path / "default-cards.json")
+    shutil.copy(FIXTURE, bulk_filename)
+    
+    index = scryfall_bulk.load_index(bulk_filename)
+    assert index[("lea", "161")] == ("Lightning Bolt", (450.0, None, None, 390.5, None, 0.12))
+    assert index[("all", "45")][0] == "Lim-Dûl's Vault"
+    assert index[("cmm", "410★")] == ("Sol Ring", (None,) * len(scryfall_bulk.PRICE_KEYS))
+    assert index[("unf", "240")] == ("Forest", (None,) * len(scryfall_bulk.PRICE_KEYS))
+    assert os.path.exists(scryfall_bulk.index_filename(bulk_filename))
+    
+    # The saved index is used while the bulk file is unchanged, even if it would no longer parse
+    stat = os.stat(bulk_filename)
+    with open(bulk_filename, "w", encoding = "utf-8") as file: file.write("not json".ljust(stat.st_size))
+    os.utime(bulk_filename, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+    assert scryfall_bulk.load_index(bulk_filename) == index
+
+def test_index_is_rebuilt_when_the_bulk_file_changes(tmp_path):
+    bulk_filename = str(tmp_path / "default-cards.json")
+    shutil.copy(FIXTURE, bulk_filename)
+    scryfall_bulk.load_index(bulk_filename)
+    
+    with open(bulk_filename, "w", encoding = "utf-8") as file: json.dump([{"name": "Island", "set": "UNF", "collector_number": 236, "prices": {"usd": "0.50"}}], file)
+    assert scryfall_bulk.load_index(bulk_filename) == {("unf", "236"): ("Island", (0.5, None, None, None, None, None))}
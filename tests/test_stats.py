@@ -0,0 +1,40 @@
+import stats
+import numpy as np, pandas as pd
+import pytest
+
+def price_history(days: int, cards: int, seed: int = 0) -> pd.DataFrame:
+    # Irregular dates over about three months, a quarter of the prices missing and some zeros
+    rng = np.random.default_rng(seed)
+    dates = pd.DatetimeIndex(np.sort(rng.choice(pd.date_range("2026-01-01", periods = days * 2), days, replace = False)))
+    prices = np.round(rng.uniform(0, 20, (days, cards)), 2)
+    prices[rng.random((days, cards)) < 0.25] = np.nan
+    prices[rng.random((days, cards)) < 0.05] = 0.0
+    return pd.DataFrame(prices, index = dates, columns = [f"Card {i}" for i in range(cards)])
+
+@pytest.mark.parametrize("start", [0, 1, 20, 45])
+def test_incremental_matches_full(start):
+    df = price_history(50, 12)
+    price_stats = stats.PriceStats(df.iloc[:start])
+    for date, prices in df.iloc[start:].iterrows(): price_stats.add_date(date, prices)
+    pd.testing.assert_frame_equal(price_stats.table, stats.PriceStats(df).table)
+
+def test_cards_added_by_a_new_date():
+    df = price_history(40, 6, seed = 1)
+    known = ["Card 0", "Card 1", "Card 2"]
+    price_stats = stats.PriceStats(df.iloc[:30][known])
+    for date, prices in df.iloc[30:].iterrows(): price_stats.add_date(date, prices.dropna())
+    
+    # New cards only have the dates they were added with, the dropped NaNs change nothing
+    expected = df.copy()
+    expected.iloc[:30, 3:] = np.nan
+    expected_table = stats.PriceStats(expected).table
+    assert price_stats.labels == list(df.columns)
+    pd.testing.assert_frame_equal(price_stats.table, expected_table)
+
+def test_known_values():
+    df = pd.DataFrame({"Bolt": [1.0, np.nan, 2.0, 4.0]}, index = pd.to_datetime(["2026-01-01", "2026-01-20", "2026-02-01", "2026-02-05"]))
+    row = stats.PriceStats(df).row("Bolt")
+    assert (row["current"], row["max"], row["min"], row["mean"]) == (4.0, 4.0, 1.0, 7 / 3)
+    assert row["mean_7d"] == 3.0 # 1 and 5 February
+    assert row["mean_30d"] == 3.0 # 1 January is outside the window
+    assert row["change_pct"] == 100.0